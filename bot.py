@@ -8,12 +8,23 @@ from __future__ import annotations
 
 import asyncio
 import datetime
-import json
 import logging
+import re
 import sys
+import time
 import traceback
-from collections import Counter, deque
-from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, Union
+from collections import Counter
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import aiohttp
 import discord
@@ -22,18 +33,33 @@ import nhentaio
 from discord.ext import commands
 
 import config
-from utils.config import Config
+from utils.buckets import TokenBuckets
+from utils.buffers import BufferRegistry
+from utils.config import Config, PostgresBackend
 from utils.context import Context
+from utils.gateway import GatewayTap
+from utils.intents import apply_profile, compute_profile, missing_intents
+from utils.lag import LagMonitor
+from utils.lazy import find_command_stubs
+from utils.profiler import ListenerProfiler
 
 if TYPE_CHECKING:
     from asyncpg import Pool
 
+    from utils.invalidation import InvalidationBus
+    from utils.metrics import MetricsServer
+
 DESCRIPTION = """
 Hello! I am a bot written by Umbreon#0009 to provide some nice utilities.
 """
 
 LOGGER = logging.getLogger(__name__)
 
+# dispatched for every gateway payload
+_RAW_GATEWAY_EVENTS = frozenset({"socket_raw_receive", "socket_response"})
+
+_INVOKER_REGEX = re.compile(r"\S*")
+
 EXTENSIONS = (
     "jishaku",
     "cogs.admin",
@@ -69,7 +95,35 @@ EXTENSIONS = (
 )
 
 
-def _prefix_callable(bot: Akane, msg: discord.Message) -> Iterable[str]:
+class PrefixMatcher:
+    """Matches the start of a message against a set of prefixes in a single pass.
+
+    The longest matching prefix wins, so ``a!!`` is preferred over ``a!``.
+    """
+
+    __slots__ = ("prefixes", "_pattern")
+
+    def __init__(self, prefixes: Iterable[str]) -> None:
+        self.prefixes = list(prefixes)
+        ordered = sorted(set(self.prefixes), key=len, reverse=True)
+        if ordered:
+            self._pattern = re.compile("|".join(re.escape(p) for p in ordered))
+        else:
+            self._pattern = None
+
+    def __repr__(self) -> str:
+        return f"<PrefixMatcher prefixes={self.prefixes!r}>"
+
+    def match(self, content: str) -> Optional[str]:
+        """Returns the prefix ``content`` starts with, if any."""
+        if self._pattern is None:
+            return None
+
+        match = self._pattern.match(content)
+        return None if match is None else match.group()
+
+
+def _guild_prefixes(bot: Akane, msg: discord.Message) -> List[str]:
     user_id = bot.user.id
     base = [f"<@!{user_id}> ", f"<@{user_id}> "]
     if msg.guild is None:
@@ -80,12 +134,58 @@ def _prefix_callable(bot: Akane, msg: discord.Message) -> Iterable[str]:
     return base
 
 
+def _prefix_callable(bot: Akane, msg: discord.Message) -> Union[str, List[str]]:
+    matcher = bot.get_prefix_matcher(msg.guild)
+    matched = matcher.match(msg.content)
+    if matched is None:
+        # discord.py won't accept an empty list, so give it every prefix
+        # and let it come to the same conclusion.
+        return matcher.prefixes
+    return matched
+
+
+class ExtensionTiming(NamedTuple):
+    imported: float
+    setup: float
+
+    @property
+    def total(self) -> float:
+        return self.imported + self.setup
+
+
+class _TimedLoader:
+    """Wraps the loader of an extension to time how long its import takes."""
+
+    __slots__ = ("loader", "elapsed")
+
+    def __init__(self, loader: Any) -> None:
+        self.loader = loader
+        self.elapsed = 0.0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.loader, name)
+
+    def exec_module(self, module: Any) -> None:
+        module.__loader__ = self.loader
+        start = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+
 class Akane(commands.Bot):
     """The actual robot herself!"""
 
     pool: Pool
-
-    def __init__(self):
+    cache_bus: Optional[InvalidationBus]
+    # started by launcher.py when config.metrics_port is set
+    metrics_server: Optional[MetricsServer]
+    # which process of ``launcher.py cluster`` we are, if any
+    cluster_id: Optional[int] = None
+
+    def __init__(self, **options: Any):
+        # narrowed down to what we need once the extensions are loaded
         intents = discord.Intents.all()
 
         super().__init__(
@@ -94,13 +194,25 @@ class Akane(commands.Bot):
             activity=discord.Game(name="a!help for help."),
             allowed_mentions=discord.AllowedMentions.none(),
             intents=intents,
+            **options,
         )
         self.session = aiohttp.ClientSession()
         self.mb_client = mystbin.Client(session=self.session)
         self.hentai_client = nhentaio.Client()
-        self._prev_events = deque(maxlen=10)
-        self.prefixes = Config("prefixes.json")
-        self.blacklist = Config("blacklist.json")
+        # counts and keeps the last few raw gateway payloads, see dispatch
+        self.gateway_tap = GatewayTap(
+            getattr(config, "gateway_capture_size", 10),
+            sample_rate=getattr(config, "gateway_capture_sample_rate", 1),
+            event_types=[None, *self._connection.parsers],
+        )
+        # guild_id: PrefixMatcher, None is used for DMs
+        self._prefix_matchers: Dict[Optional[int], PrefixMatcher] = {}
+        self.cache_bus = None
+        self.metrics_server = None
+        self.prefixes = self._make_store("prefixes")
+        self.blacklist = self._make_store("blacklist")
+        # another process changed the prefixes
+        self.prefixes.on_remote_change = self._drop_prefix_matcher
 
         self.emoji = {
             True: "<:TickYes:735498312861351937>",
@@ -113,26 +225,194 @@ class Akane(commands.Bot):
             "hsv": (299, 33, 93),
         }
 
-        # in case of even further spam, add a cooldown mapping
-        # for people who excessively spam commands
-        self.spam_control = commands.CooldownMapping.from_cooldown(
-            10, 12.0, commands.BucketType.user
+        # in case of even further spam, rate limit people who
+        # excessively spam commands, keyed by user ID.
+        # Triggering the rate limit 5 times in a row will auto-ban the user
+        # from the bot, the strikes are kept on their bucket.
+        self.spam_control = TokenBuckets(10, 12.0)
+
+        # how late the event loop wakes up, with stack dumps of long stalls
+        self.lag_monitor = LagMonitor(
+            self.loop, threshold=getattr(config, "lag_threshold", 0.5)
+        )
+        self.lag_monitor.start()
+
+        # what each event listener costs, off unless asked for
+        self.listener_profiler = ListenerProfiler(
+            enabled=getattr(config, "profile_listeners", False)
         )
 
-        # A counter to auto-ban frequent spammers
-        # Triggering the rate limit 5 times in a row will auto-ban the user from the bot.
-        self._auto_spam_count = Counter()
+        # batched writes of the cogs, flushed one last time on close
+        self.buffers = BufferRegistry(self.loop)
+
+        # the last hook to run before a command's body, see Context.timer
+        self.before_invoke(self._arguments_converted)
+
+        # How far each message got through process_commands before we stopped
+        self.message_stats = Counter()
+
+        # extension: how long it took to import and set up the last time
+        self.extension_timings: Dict[str, ExtensionTiming] = {}
+        # extension: names of the stub commands standing in for it
+        self._lazy_extensions: Dict[str, List[str]] = {}
 
+        lazy = set(getattr(config, "lazy_extensions", ()))
+        start = time.perf_counter()
         for extension in EXTENSIONS:
+            if extension in lazy and self._register_lazy_extension(extension):
+                continue
             try:
                 self.load_extension(extension)
             except Exception:
                 print(f"Failed to load extension {extension}.", file=sys.stderr)
                 traceback.print_exc()
 
-    async def on_socket_response(self, msg: Any) -> None:
-        """Websocket responses."""
-        self._prev_events.append(msg)
+        self._log_extension_timings(time.perf_counter() - start)
+
+        if getattr(config, "derive_intents", True):
+            intents, flags = compute_profile(
+                self,
+                intent_overrides=getattr(config, "intent_overrides", {}),
+                member_cache_overrides=getattr(config, "member_cache_overrides", {}),
+            )
+            apply_profile(self, intents, flags)
+
+    def _load_from_module_spec(self, spec: Any, key: str) -> None:
+        loader = _TimedLoader(spec.loader)
+        spec.loader = loader
+        start = time.perf_counter()
+        try:
+            super()._load_from_module_spec(spec, key)
+        finally:
+            spec.loader = loader.loader
+
+        elapsed = time.perf_counter() - start
+        self.extension_timings[key] = ExtensionTiming(
+            loader.elapsed, elapsed - loader.elapsed
+        )
+
+    def _log_extension_timings(self, elapsed: float) -> None:
+        timings = sorted(
+            self.extension_timings.items(), key=lambda t: t[1].total, reverse=True
+        )
+        LOGGER.info(
+            "Loaded %d extensions in %.0fms, %d left to load lazily.",
+            len(timings),
+            elapsed * 1000,
+            len(self._lazy_extensions),
+        )
+        for extension, timing in timings:
+            LOGGER.info(
+                "%s: import %.1fms, setup %.1fms",
+                extension,
+                timing.imported * 1000,
+                timing.setup * 1000,
+            )
+
+    def _register_lazy_extension(self, extension: str) -> bool:
+        """Register stub commands that load the extension when first used."""
+        try:
+            stubs = find_command_stubs(extension)
+        except (ImportError, OSError, SyntaxError):
+            stubs = None
+
+        if stubs is None:
+            LOGGER.info("%s can't be loaded lazily, loading it now.", extension)
+            return False
+
+        async def load_and_invoke(ctx: Context) -> None:
+            # process_commands swaps stubs out before invoking them, this is
+            # for the other ways in, like a reinvoke. The real command runs
+            # directly, Bot.invoke already dispatched the events for it.
+            if extension in self._lazy_extensions:
+                self.load_extension(extension)
+            new_ctx = await self.get_context(ctx.message, cls=Context)
+            if new_ctx.command is not None:
+                await new_ctx.command.invoke(new_ctx)
+
+        registered = []
+        for stub in stubs:
+            command = commands.Command(
+                load_and_invoke,
+                name=stub.name,
+                aliases=stub.aliases,
+                hidden=True,
+                help=f"Loads {extension} and runs the real command.",
+            )
+            try:
+                self.add_command(command)
+            except commands.CommandRegistrationError:
+                LOGGER.info("%s clashes with a command, loading it now.", extension)
+                for name in registered:
+                    self.remove_command(name)
+                return False
+            registered.append(stub.name)
+
+        self._lazy_extensions[extension] = registered
+        return True
+
+    def _lazy_extension_for(self, command: commands.Command) -> Optional[str]:
+        """The extension ``command`` is a stub for, if it is one."""
+        if command.cog is not None:
+            return None
+        for (extension, names) in self._lazy_extensions.items():
+            if command.name in names:
+                return extension
+        return None
+
+    def load_extension(self, name: str, *, package: Optional[str] = None) -> None:
+        # the real commands of a lazy extension replace its stubs
+        for command in self._lazy_extensions.pop(name, ()):
+            self.remove_command(command)
+        super().load_extension(name, package=package)
+
+    def add_listener(self, func: Any, name: Optional[str] = None) -> None:
+        super().add_listener(func, name)
+        # extensions loaded after we worked out the intents may need more
+        missing = missing_intents(self, [name or func.__name__])
+        if missing:
+            LOGGER.warning(
+                "%s will not receive events, it needs the %s intents.",
+                func.__qualname__,
+                ", ".join(sorted(missing)),
+            )
+
+    @property
+    def socket_stats(self) -> Counter:
+        """Gateway events received per type."""
+        return self.gateway_tap.counts
+
+    def dispatch(self, event_name: str, *args: Any, **kwargs: Any) -> None:
+        if event_name in _RAW_GATEWAY_EVENTS:
+            if event_name == "socket_response":
+                self.gateway_tap.record(args[0])
+
+            # these fire for every payload, don't pay for them when unused
+            if (
+                f"on_{event_name}" not in self.extra_events
+                and event_name not in self._listeners
+            ):
+                return
+
+        profiler = self.listener_profiler
+        if not profiler.enabled:
+            super().dispatch(event_name, *args, **kwargs)
+            return
+
+        # the fan out to listeners and wait_for checks runs synchronously
+        start = time.perf_counter()
+        try:
+            super().dispatch(event_name, *args, **kwargs)
+        finally:
+            profiler.record(f"dispatch:{event_name}", time.perf_counter() - start)
+
+    def _schedule_event(
+        self, coro: Any, event_name: str, *args: Any, **kwargs: Any
+    ) -> asyncio.Task:
+        # every on_* method and cog listener is run through here
+        if self.listener_profiler.enabled:
+            coro = self.listener_profiler.wrap(coro)
+        return super()._schedule_event(coro, event_name, *args, **kwargs)
 
     async def on_command_error(
         self, ctx: Context, error: commands.CommandError
@@ -152,13 +432,29 @@ class Akane(commands.Bot):
             await ctx.send(error)
 
     def get_guild_prefixes(
-        self, guild: discord.Guild, *, local_inject=_prefix_callable
+        self, guild: discord.Guild, *, local_inject=_guild_prefixes
     ) -> List[str]:
         """Get prefixes per guild."""
         proxy_msg = discord.Object(id=0)
         proxy_msg.guild = guild
         return local_inject(self, proxy_msg)
 
+    def get_prefix_matcher(self, guild: Optional[discord.Guild]) -> PrefixMatcher:
+        """Get the compiled prefix matcher of a guild, or DMs if ``None``."""
+        guild_id = guild and guild.id
+        try:
+            return self._prefix_matchers[guild_id]
+        except KeyError:
+            matcher = PrefixMatcher(self.get_guild_prefixes(guild))
+            self._prefix_matchers[guild_id] = matcher
+            return matcher
+
+    def _drop_prefix_matcher(self, guild_id: Optional[str]) -> None:
+        if guild_id is None:
+            self._prefix_matchers.clear()
+        else:
+            self._prefix_matchers.pop(int(guild_id), None)
+
     def get_raw_guild_prefixes(self, guild_id: int) -> List[str]:
         """The raw prefixes."""
         return self.prefixes.get(guild_id, ["a!", "A!"])
@@ -174,6 +470,8 @@ class Akane(commands.Bot):
         else:
             await self.prefixes.put(guild.id, sorted(set(prefixes), reverse=True))
 
+        self._prefix_matchers.pop(guild.id, None)
+
     async def add_to_blacklist(self, object_id: int) -> None:
         """Add object to blacklist."""
         await self.blacklist.put(object_id, True)
@@ -185,10 +483,44 @@ class Akane(commands.Bot):
         except KeyError:
             pass
 
+    async def _warm_cog_cache(self, cog: commands.Cog, guild_ids: List[int]) -> None:
+        start = time.perf_counter()
+        try:
+            primed = await cog.warm_cache(guild_ids)
+        except Exception:
+            LOGGER.exception("Failed to warm the %s cache.", cog.qualified_name)
+        else:
+            elapsed = (time.perf_counter() - start) * 1000
+            LOGGER.info(
+                "Warmed %s %s cache entries in %.2fms.",
+                primed,
+                cog.qualified_name,
+                elapsed,
+            )
+
+    async def warm_caches(self) -> None:
+        """Bulk loads the per-guild config caches of every cog that supports it.
+
+        This saves every guild a query per cog on its first message after a restart.
+        """
+        guild_ids = [guild.id for guild in self.guilds]
+        cogs = [cog for cog in self.cogs.values() if hasattr(cog, "warm_cache")]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(self._warm_cog_cache(cog, guild_ids) for cog in cogs))
+        elapsed = (time.perf_counter() - start) * 1000
+        LOGGER.info(
+            "Warmed caches of %s cogs for %s guilds in %.2fms.",
+            len(cogs),
+            len(guild_ids),
+            elapsed,
+        )
+
     async def on_ready(self) -> None:
         """When the websocket reports ready."""
         if not hasattr(self, "uptime"):
             self.uptime = datetime.datetime.utcnow()
+            self.loop.create_task(self.warm_caches())
 
         print(f"Ready: {self.user} (ID: {self.user.id})")
 
@@ -240,41 +572,83 @@ class Akane(commands.Bot):
         embed.timestamp = datetime.datetime.utcnow()
         return webhook.send(embed=embed)
 
+    def _reject_message(self, message: discord.Message) -> Optional[str]:
+        """Cheap checks on the raw message before we bother building a Context.
+
+        Returns the reason the message was rejected, if it was.
+        """
+        if message.author.id in self.blacklist:
+            return "blacklisted"
+
+        if message.guild is not None and message.guild.id in self.blacklist:
+            return "blacklisted"
+
+        content = message.content
+        prefix = self.get_prefix_matcher(message.guild).match(content)
+        if prefix is None:
+            return "no_prefix"
+
+        # the same word discord.py would look the command up with
+        invoker = _INVOKER_REGEX.match(content, len(prefix)).group()
+        if invoker not in self.all_commands:
+            return "unknown_command"
+
+        return None
+
     async def process_commands(self, message: discord.Message) -> None:
         """Bot's process command override."""
+        rejected = self._reject_message(message)
+        if rejected is not None:
+            self.message_stats[rejected] += 1
+            return
+
         ctx = await self.get_context(message, cls=Context)
 
         if ctx.command is None:
+            self.message_stats["no_command"] += 1
             return
 
-        if ctx.author.id in self.blacklist:
-            return
-
-        if ctx.guild is not None and ctx.guild.id in self.blacklist:
-            return
+        if self._lazy_extensions:
+            # load the real command first, so only it is invoked and
+            # dispatched rather than its stub as well
+            extension = self._lazy_extension_for(ctx.command)
+            if extension is not None:
+                self.load_extension(extension)
+                ctx = await self.get_context(message, cls=Context)
+                if ctx.command is None:
+                    self.message_stats["no_command"] += 1
+                    return
 
-        bucket = self.spam_control.get_bucket(message)
         current = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
-        retry_after = bucket.update_rate_limit(current)
         author_id = message.author.id
+        retry_after = self.spam_control.update_rate_limit(author_id, current)
         if retry_after and author_id != self.owner_id:
-            self._auto_spam_count[author_id] += 1
-            if self._auto_spam_count[author_id] >= 5:
+            if self.spam_control.strike(author_id) >= 5:
                 await self.add_to_blacklist(author_id)
-                del self._auto_spam_count[author_id]
+                self.spam_control.clear_strikes(author_id)
                 await self.log_spammer(ctx, message, retry_after, autoblock=True)
             else:
                 self.log_spammer(ctx, message, retry_after)
+            self.message_stats["rate_limited"] += 1
             return
         else:
-            self._auto_spam_count.pop(author_id, None)
+            self.spam_control.clear_strikes(author_id)
 
+        self.message_stats["invoked"] += 1
+
+        ctx.timer.start()
         try:
             await self.invoke(ctx)
         finally:
+            ctx.timer.stop()
             # Just in case we have any outstanding DB connections
             await ctx.release()
 
+    async def _arguments_converted(self, ctx: Context) -> None:
+        # the command and cog before_invoke hooks ran just before this,
+        # they count towards the converters
+        ctx.timer.mark("converters")
+
     async def on_message(self, message: discord.Message) -> None:
         """Fires when a message is received."""
         if message.author.bot:
@@ -294,8 +668,36 @@ class Akane(commands.Bot):
         if guild.id in self.blacklist:
             await guild.leave()
 
+    async def on_guild_remove(self, guild: discord.Guild) -> None:
+        self._prefix_matchers.pop(guild.id, None)
+
+    @staticmethod
+    def _make_store(name: str) -> Config:
+        """Create a config store using the backend chosen in the config."""
+        if getattr(config, "config_backend", "json") == "postgresql":
+            return Config(name, backend=PostgresBackend(name))
+        return Config(f"{name}.json")
+
+    async def load_stores(self) -> None:
+        """Load the config stores that need the connection pool."""
+        await asyncio.gather(self.prefixes.load(), self.blacklist.load())
+
     async def close(self) -> None:
         """When the bot closes."""
+        self.lag_monitor.stop()
+        if self.cache_bus is not None:
+            await self.cache_bus.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+
+        # write out anything still waiting to be flushed, while we still
+        # have the pool and the HTTP session
+        await asyncio.gather(
+            self.buffers.drain(getattr(config, "shutdown_timeout", 10.0)),
+            self.prefixes.close(),
+            self.blacklist.close(),
+        )
+
         await asyncio.gather(
             super().close(),
             self.session.close(),
@@ -308,16 +710,31 @@ class Akane(commands.Bot):
         try:
             super().run(config.token, reconnect=True)
         finally:
-            with open("prev_events.log", "w", encoding="utf-8") as file_path:
-                for data in self._prev_events:
-                    try:
-                        last_log = json.dumps(data, ensure_ascii=True, indent=4)
-                    except Exception:
-                        file_path.write(f"{data}\n")
-                    else:
-                        file_path.write(f"{last_log}\n")
+            if self.cluster_id is None:
+                path = "prev_events.log"
+            else:
+                path = f"prev_events-{self.cluster_id}.log"
+
+            with open(path, "w", encoding="utf-8") as file_path:
+                self.gateway_tap.dump(file_path)
 
     @property
     def config(self):
         """Bot's config."""
         return __import__("config")
+
+
+class ShardedAkane(Akane, commands.AutoShardedBot):
+    """Akane running a range of shards, one per process of ``launcher.py cluster``.
+
+    Every process keeps its own caches, cooldowns and spam counters. The
+    prefixes and the blacklist are shared through the ``config_store`` table
+    when ``config.config_backend`` is ``"postgresql"``, and changes to them
+    reach the other processes through the cache invalidation bus.
+    """
+
+    def __init__(
+        self, *, cluster_id: int, shard_ids: List[int], shard_count: int, **options: Any
+    ):
+        super().__init__(shard_ids=shard_ids, shard_count=shard_count, **options)
+        self.cluster_id = cluster_id
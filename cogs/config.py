@@ -281,7 +281,7 @@ class Config(commands.Cog):
 
         return not is_plonked
 
-    @cache.cache()
+    @cache.cache(maxsize=8192, strategy=cache.Strategy.lru_ttl, ttl=3600.0)
     async def get_command_permissions(
         self, guild_id: int, *, connection: Optional[asyncpg.Connection] = None
     ) -> ResolvedCommandPermissions:
@@ -294,6 +294,30 @@ class Config(commands.Cog):
         records = await connection.fetch(query, guild_id)
         return ResolvedCommandPermissions(guild_id, records)
 
+    async def warm_cache(
+        self,
+        guild_ids: List[int],
+        *,
+        connection: Optional[asyncpg.Connection] = None,
+    ) -> int:
+        """ Fills the command permission cache for every given guild. """
+        connection = connection or self.bot.pool
+        query = """SELECT guild_id, name, channel_id, whitelist
+                   FROM command_config
+                   WHERE guild_id = ANY($1::bigint[]);
+                """
+
+        records = await connection.fetch(query, guild_ids)
+        grouped = defaultdict(list)
+        for guild_id, name, channel_id, whitelist in records:
+            grouped[guild_id].append((name, channel_id, whitelist))
+
+        primed = 0
+        for guild_id in guild_ids:
+            resolved = ResolvedCommandPermissions(guild_id, grouped.get(guild_id, []))
+            primed += self.get_command_permissions.prime(self, guild_id, value=resolved)
+        return primed
+
     async def bot_check(self, ctx: Context) -> bool:
         if ctx.guild is None:
             return True
@@ -327,8 +351,9 @@ class Config(commands.Cog):
                     "plonks", columns=("guild_id", "entity_id"), records=to_insert
                 )
 
-                # invalidate the cache for this guild
-                self.is_plonked.invalidate_containing(f"{ctx.guild.id!r}:")
+        # invalidate the cache for this guild once committed, or other
+        # processes could re-fetch the old rows
+        self.is_plonked.invalidate_containing(ctx.guild.id)
 
     async def cog_command_error(
         self, ctx: Context, error: commands.CommandError
@@ -361,7 +386,7 @@ class Config(commands.Cog):
             await ctx.db.execute(query, ctx.guild.id, ctx.channel.id)
 
             # invalidate the cache for this guild
-            self.is_plonked.invalidate_containing(f"{ctx.guild.id!r}:")
+            self.is_plonked.invalidate_containing(ctx.guild.id)
         else:
             await self._bulk_ignore_entries(ctx, entities)
 
@@ -417,7 +442,7 @@ class Config(commands.Cog):
 
         query = "DELETE FROM plonks WHERE guild_id=$1;"
         await ctx.db.execute(query, ctx.guild.id)
-        self.is_plonked.invalidate_containing(f"{ctx.guild.id!r}:")
+        self.is_plonked.invalidate_containing(ctx.guild.id)
         await ctx.send("Successfully cleared all ignores.")
 
     @config.group(pass_context=True, invoke_without_command=True)
@@ -438,7 +463,7 @@ class Config(commands.Cog):
             entities = [c.id for c in entities]
             await ctx.db.execute(query, ctx.guild.id, entities)
 
-        self.is_plonked.invalidate_containing(f"{ctx.guild.id!r}:")
+        self.is_plonked.invalidate_containing(ctx.guild.id)
         await ctx.send(ctx.tick(True))
 
     @unignore.command(name="all")
@@ -467,9 +492,6 @@ class Config(commands.Cog):
         whitelist: bool = True,
     ) -> None:
         """ Toggles the passed command. """
-        # clear the cache
-        self.get_command_permissions.invalidate(self, guild_id)
-
         if channel_id is None:
             subcheck = "channel_id IS NULL"
             args = (guild_id, name)
@@ -496,6 +518,10 @@ class Config(commands.Cog):
                 )
                 raise RuntimeError(msg)
 
+        # clear the cache, only once committed so other processes don't
+        # re-fetch the old permissions before the transaction is done
+        self.get_command_permissions.invalidate(self, guild_id)
+
     @channel.command(name="disable")
     async def channel_disable(self, ctx: Context, *, command: CommandName) -> None:
         """Disables a command for this channel."""
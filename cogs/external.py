@@ -155,7 +155,9 @@ class External(commands.Cog):
             error.handled = True
             return await ctx.send("That package doesn't exist on PyPi.")
 
-    @cache.cache()
+    @cache.cache(
+        maxsize=1024, strategy=cache.Strategy.lru_ttl, ttl=3600.0, soft_ttl=300.0
+    )
     async def get_feeds(self, channel_id, *, connection=None):
         con = connection or self.bot.pool
         query = "SELECT name, role_id FROM feeds WHERE channel_id=$1;"
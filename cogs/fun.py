@@ -13,6 +13,7 @@ import random
 import re
 import textwrap
 import time
+from collections import Counter
 from functools import partial
 from string import ascii_lowercase
 from textwrap import fill
@@ -110,20 +111,24 @@ class SpoilerCache:
 class Fun(commands.Cog):
     """Some fun stuff, not fleshed out yet."""
 
+    # scatter reads Member.voice
+    required_intents = ("voice_states",)
+
     def __init__(self, bot: Akane):
         self.bot = bot
-        self.lock = asyncio.Lock()
-        self.message_deletes = 0
-        self.bulk_message_deletes = 0
-        self.message_edits = 0
-        self.bans = 0
-        self.unbans = 0
-        self.channel_deletes = 0
-        self.channel_creates = 0
-        self.command_count = 0
+        # event: count since the last update, kept on the bot so a
+        # reload doesn't lose them
+        batch = bot.buffers.get("fun.statistics", Counter)
+        self.counts = batch.data
+        self.lock = batch.lock
+        bot.buffers.register("fun.statistics", self.flush)
         self.bulk_update.start()
         self.translator = googletrans.Translator()
 
+    def cog_unload(self):
+        self.bulk_update.stop()
+        self.bot.buffers.unregister("fun.statistics")
+
     # @commands.Cog.listener("on_message")
     async def quote(self, message: discord.Message) -> None:
         """ """
@@ -236,7 +241,7 @@ class Fun(commands.Cog):
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload):
         async with self.lock:
-            self.message_deletes += 1
+            self.counts["message_deletes"] += 1
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -268,41 +273,39 @@ class Fun(commands.Cog):
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload):
         async with self.lock:
-            self.bulk_message_deletes += 1
+            self.counts["bulk_message_deletes"] += 1
 
     @commands.Cog.listener()
     async def on_raw_message_edit(self, payload):
         async with self.lock:
-            self.message_edits += 1
+            self.counts["message_edits"] += 1
 
     @commands.Cog.listener()
     async def on_member_ban(self, guild, user):
         async with self.lock:
-            self.bans += 1
+            self.counts["bans"] += 1
 
     @commands.Cog.listener()
     async def on_member_unban(self, guild, user):
         async with self.lock:
-            self.unbans += 1
+            self.counts["unbans"] += 1
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
         async with self.lock:
-            self.channel_deletes += 1
+            self.counts["channel_deletes"] += 1
 
     @commands.Cog.listener()
     async def on_guild_channel_create(self, channel):
         async with self.lock:
-            self.channel_creates += 1
+            self.counts["channel_creates"] += 1
 
     @commands.Cog.listener()
     async def on_command(self, ctx):
         async with self.lock:
-            self.command_count += 1
+            self.counts["command_count"] += 1
 
-    @tasks.loop(minutes=10)
-    async def bulk_update(self):
-        await self.bot.wait_until_ready()
+    async def flush(self):
         query = """ UPDATE statistics
                     SET message_deletes = message_deletes + $1,
                     bulk_message_deletes = bulk_message_deletes + $2,
@@ -315,25 +318,27 @@ class Fun(commands.Cog):
                     WHERE id = 1;
                 """
         async with self.lock:
+            if not self.counts:
+                return
+
+            counts = self.counts
             await self.bot.pool.execute(
                 query,
-                self.message_deletes,
-                self.bulk_message_deletes,
-                self.message_edits,
-                self.bans,
-                self.unbans,
-                self.channel_deletes,
-                self.channel_creates,
-                self.command_count,
+                counts["message_deletes"],
+                counts["bulk_message_deletes"],
+                counts["message_edits"],
+                counts["bans"],
+                counts["unbans"],
+                counts["channel_deletes"],
+                counts["channel_creates"],
+                counts["command_count"],
             )
-            self.message_deletes = 0
-            self.bulk_message_deletes = 0
-            self.message_edits = 0
-            self.bans = 0
-            self.unbans = 0
-            self.channel_deletes = 0
-            self.channel_creates = 0
-            self.command_count = 0
+            counts.clear()
+
+    @tasks.loop(minutes=10)
+    async def bulk_update(self):
+        await self.bot.wait_until_ready()
+        await self.flush()
 
     @commands.command()
     @commands.cooldown(1, 60, commands.BucketType.guild)
@@ -342,16 +347,22 @@ class Fun(commands.Cog):
         query = "SELECT * FROM statistics LIMIT 1;"
         stat_record = await self.bot.pool.fetchrow(query)
 
-        message_deletes = stat_record["message_deletes"] + self.message_deletes
+        message_deletes = (
+            stat_record["message_deletes"] + self.counts["message_deletes"]
+        )
         bulk_message_deletes = (
-            stat_record["bulk_message_deletes"] + self.bulk_message_deletes
+            stat_record["bulk_message_deletes"] + self.counts["bulk_message_deletes"]
+        )
+        message_edits = stat_record["message_edits"] + self.counts["message_edits"]
+        bans = stat_record["bans"] + self.counts["bans"]
+        unbans = stat_record["unbans"] + self.counts["unbans"]
+        channel_deletes = (
+            stat_record["channel_deletes"] + self.counts["channel_deletes"]
+        )
+        channel_creates = (
+            stat_record["channel_creates"] + self.counts["channel_creates"]
         )
-        message_edits = stat_record["message_edits"] + self.message_edits
-        bans = stat_record["bans"] + self.bans
-        unbans = stat_record["unbans"] + self.unbans
-        channel_deletes = stat_record["channel_deletes"] + self.channel_deletes
-        channel_creates = stat_record["channel_creates"] + self.channel_creates
-        command_count = stat_record["command_count"] + self.command_count
+        command_count = stat_record["command_count"] + self.counts["command_count"]
 
         embed = discord.Embed(title="Akane Stats")
         embed.description = (
@@ -182,7 +182,7 @@ class Lewd(commands.Cog):
                 f"Stop being horny. You're on cooldown for {error.retry_after:.02f}s."
             )
 
-    @cache.cache()
+    @cache.cache(maxsize=8192, strategy=cache.Strategy.lru_ttl, ttl=3600.0)
     async def get_booru_config(
         self,
         guild_id: int,
@@ -194,6 +194,22 @@ class Lewd(commands.Cog):
         record = await connection.fetchrow(query, guild_id)
         return BooruConfig(guild_id=guild_id, bot=self.bot, record=record)
 
+    async def warm_cache(
+        self, guild_ids: List[int], *, connection: Union[Pool, Connection] = None
+    ) -> int:
+        connection = connection or self.bot.pool
+        query = """ SELECT * FROM gelbooru_config WHERE guild_id = ANY($1::bigint[]); """
+        records = await connection.fetch(query, guild_ids)
+        found = {record["guild_id"]: record for record in records}
+
+        primed = 0
+        for guild_id in guild_ids:
+            config = BooruConfig(
+                guild_id=guild_id, bot=self.bot, record=found.get(guild_id)
+            )
+            primed += self.get_booru_config.prime(self, guild_id, value=config)
+        return primed
+
     def _gen_gelbooru_embeds(
         self, payloads: list, config: BooruConfig
     ) -> List[Optional[discord.Embed]]:
@@ -43,6 +43,9 @@ class FetchedUser(commands.Converter):
 class Meta(commands.Cog):
     """Commands for utilities related to Discord or the Bot itself."""
 
+    # userinfo reads Member.voice
+    required_intents = ("voice_states",)
+
     def __init__(self, bot):
         self.bot = bot
 
@@ -21,6 +21,7 @@ from black import E
 from discord.ext import commands, tasks
 
 from utils import cache, checks, db, time
+from utils.buckets import TokenBuckets
 from utils.context import Context
 from utils.formats import plural
 
@@ -188,11 +189,6 @@ def safe_reason_append(base, to_append):
     return appended
 
 
-class CooldownByContent(commands.CooldownMapping):
-    def _bucket_key(self, message):
-        return (message.channel.id, message.content)
-
-
 class SpamChecker:
     """This spam checker does a few things.
 
@@ -208,21 +204,21 @@ class SpamChecker:
     """
 
     def __init__(self):
-        self.by_content = CooldownByContent.from_cooldown(
-            15, 17.0, commands.BucketType.member
-        )
-        self.by_user = commands.CooldownMapping.from_cooldown(
-            10, 12.0, commands.BucketType.user
-        )
+        # keyed by (channel_id, content)
+        self.by_content = TokenBuckets(15, 17.0)
+        # keyed by user ID
+        self.by_user = TokenBuckets(10, 12.0)
         self.last_join = None
-        self.new_user = commands.CooldownMapping.from_cooldown(
-            30, 35.0, commands.BucketType.channel
-        )
+        # keyed by channel ID
+        self.new_user = TokenBuckets(30, 35.0)
 
         self.fast_joiners = cache.ExpiringCache(seconds=1800.0)
-        self.hit_and_run = commands.CooldownMapping.from_cooldown(
-            10, 12, commands.BucketType.channel
-        )
+        # keyed by channel ID
+        self.hit_and_run = TokenBuckets(10, 12.0)
+
+    @property
+    def buckets(self):
+        return (self.by_content, self.by_user, self.new_user, self.hit_and_run)
 
     def is_new(self, member):
         now = datetime.datetime.utcnow()
@@ -236,22 +232,20 @@ class SpamChecker:
 
         current = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
 
+        channel_id = message.channel.id
         if message.author.id in self.fast_joiners:
-            bucket = self.hit_and_run.get_bucket(message)
-            if bucket.update_rate_limit(current):
+            if self.hit_and_run.update_rate_limit(channel_id, current):
                 return True
 
         if self.is_new(message.author):
-            new_bucket = self.new_user.get_bucket(message)
-            if new_bucket.update_rate_limit(current):
+            if self.new_user.update_rate_limit(channel_id, current):
                 return True
 
-        user_bucket = self.by_user.get_bucket(message)
-        if user_bucket.update_rate_limit(current):
+        if self.by_user.update_rate_limit(message.author.id, current):
             return True
 
-        content_bucket = self.by_content.get_bucket(message)
-        if content_bucket.update_rate_limit(current):
+        content_key = (channel_id, message.content)
+        if self.by_content.update_rate_limit(content_key, current):
             return True
 
         return False
@@ -310,16 +304,21 @@ class Mod(commands.Cog):
         # guild_id: List[(member_id, insertion)]
         # A batch of data for bulk inserting mute role changes
         # True - insert, False - remove
-        self._data_batch = defaultdict(list)
-        self._batch_lock = asyncio.Lock(loop=bot.loop)
+        # Both batches are kept on the bot so a reload doesn't lose them
+        batch = bot.buffers.get("mod.mutes", lambda: defaultdict(list))
+        self._data_batch = batch.data
+        self._batch_lock = batch.lock
         self._disable_lock = asyncio.Lock(loop=bot.loop)
+        bot.buffers.register("mod.mutes", self.flush_mutes)
         self.batch_updates.add_exception_type(asyncpg.PostgresConnectionError)
         self.batch_updates.start()
 
         # (guild_id, channel_id): List[str]
         # A batch list of message content for message
-        self.message_batches = defaultdict(list)
-        self._batch_message_lock = asyncio.Lock(loop=bot.loop)
+        batch = bot.buffers.get("mod.messages", lambda: defaultdict(list))
+        self.message_batches = batch.data
+        self._batch_message_lock = batch.lock
+        bot.buffers.register("mod.messages", self.flush_messages)
         self.bulk_send_messages.start()
 
         self._recently_blocked = set()
@@ -330,6 +329,8 @@ class Mod(commands.Cog):
     def cog_unload(self):
         self.batch_updates.stop()
         self.bulk_send_messages.stop()
+        self.bot.buffers.unregister("mod.mutes")
+        self.bot.buffers.unregister("mod.messages")
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
@@ -369,18 +370,26 @@ class Mod(commands.Cog):
                 func(member_id)
 
             final_data.append({"guild_id": guild_id, "result_array": list(as_set)})
-            self.get_guild_config.invalidate(self, guild_id)
 
         await self.bot.pool.execute(query, final_data)
+        # only now that the update is in, otherwise the old rows get cached again
+        for guild_id in self._data_batch:
+            self.get_guild_config.invalidate(self, guild_id)
         self._data_batch.clear()
 
-    @tasks.loop(seconds=15.0)
-    async def batch_updates(self):
+    async def flush_mutes(self):
         async with self._batch_lock:
             await self.bulk_insert()
 
+    @tasks.loop(seconds=15.0)
+    async def batch_updates(self):
+        await self.flush_mutes()
+
     @tasks.loop(seconds=10.0)
     async def bulk_send_messages(self):
+        await self.flush_messages()
+
+    async def flush_messages(self):
         async with self._batch_message_lock:
             for ((guild_id, channel_id), messages) in self.message_batches.items():
                 guild = self.bot.get_guild(guild_id)
@@ -397,7 +406,11 @@ class Mod(commands.Cog):
                     except discord.HTTPException:
                         pass
 
-    @cache.cache()
+            self.message_batches.clear()
+
+    @cache.cache(
+        maxsize=8192, strategy=cache.Strategy.lru_ttl, ttl=3600.0, negative_ttl=600.0
+    )
     async def get_guild_config(self, guild_id):
         query = """SELECT * FROM guild_mod_config WHERE id=$1;"""
         async with self.bot.pool.acquire() as con:
@@ -406,6 +419,19 @@ class Mod(commands.Cog):
                 return await ModConfig.from_record(record, self.bot)
             return None
 
+    async def warm_cache(self, guild_ids, *, connection=None):
+        connection = connection or self.bot.pool
+        query = """SELECT * FROM guild_mod_config WHERE id = ANY($1::bigint[]);"""
+        records = await connection.fetch(query, guild_ids)
+        found = {record["id"]: record for record in records}
+
+        primed = 0
+        for guild_id in guild_ids:
+            record = found.get(guild_id)
+            config = record and await ModConfig.from_record(record, self.bot)
+            primed += self.get_guild_config.prime(self, guild_id, value=config)
+        return primed
+
     async def check_raid(self, config, guild_id, member, message):
         if config.raid_mode != RaidMode.strict.value:
             return
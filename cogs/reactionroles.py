@@ -10,7 +10,7 @@ import discord
 from discord.ext import commands
 
 from utils import db
-from utils.cache import ExpiringCache, cache
+from utils.cache import ExpiringCache, Strategy, cache
 
 if TYPE_CHECKING:
     from bot import Akane
@@ -34,7 +34,7 @@ class NonLocalEmoji(Exception):
 class ReactionRoleConfig:
     """ """
 
-    __slots__ = ("id", "bot", "data")
+    __slots__ = ("guild_id", "bot", "data")
     accepted = ("role", "approval_channel", "emoji")
 
     bot: Akane
@@ -92,7 +92,7 @@ class ReactionRoles(commands.Cog):
     def __init__(self, bot: Akane) -> None:
         self.bot = bot
 
-    @cache()
+    @cache(maxsize=8192, strategy=Strategy.lru_ttl, ttl=3600.0, negative_ttl=600.0)
     async def get_reaction_role_config(self, guild_id: int) -> ReactionRoleConfig:
         query = """
                 --begin-sql
@@ -106,6 +106,27 @@ class ReactionRoles(commands.Cog):
             return await ReactionRoleConfig.from_record(record, self.bot)
         return None
 
+    async def warm_cache(
+        self, guild_ids: List[int], *, connection: Optional[asyncpg.Connection] = None
+    ) -> int:
+        connection = connection or self.bot.pool
+        query = """
+                --begin-sql
+                SELECT *
+                FROM reaction_roles
+                WHERE guild_id = ANY($1::bigint[]);
+                """
+
+        records = await connection.fetch(query, guild_ids)
+        found = {record["guild_id"]: record for record in records}
+
+        primed = 0
+        for guild_id in guild_ids:
+            record = found.get(guild_id)
+            config = record and await ReactionRoleConfig.from_record(record, self.bot)
+            primed += self.get_reaction_role_config.prime(self, guild_id, value=config)
+        return primed
+
     async def verify_emoji(self, guild: discord.Guild, item: int) -> bool:
         if not (emoji := discord.utils.get(guild.emojis, id=item)):
             try:
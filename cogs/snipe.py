@@ -4,7 +4,6 @@ License, v. 2.0. If a copy of the MPL was not distributed with this
 file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """
 
-import asyncio
 import datetime
 import difflib
 import typing
@@ -105,15 +104,18 @@ class Snipe(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.snipe_deletes = []
-        self.snipe_edits = []
-        self._snipe_lock = asyncio.Lock(loop=bot.loop)
+        # kept on the bot so a reload doesn't lose what was not inserted yet
+        batch = bot.buffers.get("snipe", lambda: ([], []))
+        self.snipe_deletes, self.snipe_edits = batch.data
+        self._snipe_lock = batch.lock
+        bot.buffers.register("snipe", self.flush)
         self.snipe_delete_update.start()
         self.snipe_edit_update.start()
 
     def cog_unload(self):
         self.snipe_delete_update.stop()
         self.snipe_edit_update.stop()
+        self.bot.buffers.unregister("snipe")
 
     async def cog_command_error(self, ctx, error):
         error = getattr(error, "original", error)
@@ -129,13 +131,27 @@ class Snipe(commands.Cog):
                 """
         return await self.bot.pool.execute(query, guild.id)
 
-    @cache.cache()
+    @cache.cache(maxsize=8192, strategy=cache.Strategy.lru_ttl, ttl=3600.0)
     async def get_snipe_config(self, guild_id, *, connection=None):
         connection = connection or self.bot.pool
         query = """ SELECT * FROM snipe_config WHERE id=$1 """
         record = await connection.fetchrow(query, guild_id)
         return SnipeConfig(guild_id=guild_id, bot=self.bot, record=record)
 
+    async def warm_cache(self, guild_ids, *, connection=None):
+        connection = connection or self.bot.pool
+        query = """ SELECT * FROM snipe_config WHERE id = ANY($1::bigint[]) """
+        records = await connection.fetch(query, guild_ids)
+        found = {record["id"]: record for record in records}
+
+        primed = 0
+        for guild_id in guild_ids:
+            config = SnipeConfig(
+                guild_id=guild_id, bot=self.bot, record=found.get(guild_id)
+            )
+            primed += self.get_snipe_config.prime(self, guild_id, value=config)
+        return primed
+
     def _gen_delete_embeds(
         self, records: typing.List[typing.Dict[str, typing.Any]]
     ) -> typing.List[discord.Embed]:
@@ -511,10 +527,11 @@ class Snipe(commands.Cog):
 
         return await ctx.message.add_reaction(self.bot.emoji[True])
 
-    @tasks.loop(minutes=1)
-    async def snipe_delete_update(self):
-        """Batch updates for the snipes."""
-        await self.bot.wait_until_ready()
+    async def flush(self):
+        await self.flush_deletes()
+        await self.flush_edits()
+
+    async def flush_deletes(self):
         query = """
                 INSERT INTO snipe_deletes (user_id, guild_id, channel_id, message_id, message_content, attachment_urls, delete_time)
                 SELECT x.user_id, x.guild_id, x.channel_id, x.message_id, x.message_content, x.attachment_urls, x.delete_time
@@ -523,13 +540,11 @@ class Snipe(commands.Cog):
                 """
 
         async with self._snipe_lock:
-            await self.bot.pool.execute(query, self.snipe_deletes)
-            self.snipe_deletes.clear()
+            if self.snipe_deletes:
+                await self.bot.pool.execute(query, self.snipe_deletes)
+                self.snipe_deletes.clear()
 
-    @tasks.loop(minutes=1)
-    async def snipe_edit_update(self):
-        """Batch updates for the snipes."""
-        await self.bot.wait_until_ready()
+    async def flush_edits(self):
         query = """
                 INSERT INTO snipe_edits (user_id, guild_id, channel_id, message_id, before_content, after_content, edited_time, jump_url)
                 SELECT x.user_id, x.guild_id, x.channel_id, x.message_id, x.before_content, x.after_content, x.edited_time, x.jump_url
@@ -538,8 +553,21 @@ class Snipe(commands.Cog):
                 """
 
         async with self._snipe_lock:
-            await self.bot.pool.execute(query, self.snipe_edits)
-            self.snipe_edits.clear()
+            if self.snipe_edits:
+                await self.bot.pool.execute(query, self.snipe_edits)
+                self.snipe_edits.clear()
+
+    @tasks.loop(minutes=1)
+    async def snipe_delete_update(self):
+        """Batch updates for the snipes."""
+        await self.bot.wait_until_ready()
+        await self.flush_deletes()
+
+    @tasks.loop(minutes=1)
+    async def snipe_edit_update(self):
+        """Batch updates for the snipes."""
+        await self.bot.wait_until_ready()
+        await self.flush_edits()
 
     @show_snipes.error
     @show_edit_snipes.error
@@ -159,13 +159,29 @@ class Stars(commands.Cog):
     async def clean_message_cache(self):
         self._message_cache.clear()
 
-    @cache.cache()
+    @cache.cache(
+        maxsize=8192, strategy=cache.Strategy.lru_ttl, ttl=900.0, soft_ttl=60.0
+    )
     async def get_starboard(self, guild_id, *, connection=None):
         connection = connection or self.bot.pool
         query = "SELECT * FROM starboard WHERE id=$1;"
         record = await connection.fetchrow(query, guild_id)
         return StarboardConfig(guild_id=guild_id, bot=self.bot, record=record)
 
+    async def warm_cache(self, guild_ids, *, connection=None):
+        connection = connection or self.bot.pool
+        query = "SELECT * FROM starboard WHERE id = ANY($1::bigint[]);"
+        records = await connection.fetch(query, guild_ids)
+        found = {record["id"]: record for record in records}
+
+        primed = 0
+        for guild_id in guild_ids:
+            config = StarboardConfig(
+                guild_id=guild_id, bot=self.bot, record=found.get(guild_id)
+            )
+            primed += self.get_starboard.prime(self, guild_id, value=config)
+        return primed
+
     def star_emoji(self, stars):
         if 5 > stars >= 0:
             return "\N{WHITE MEDIUM STAR}"
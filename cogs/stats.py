@@ -20,14 +20,14 @@ import traceback
 import typing
 from collections import Counter, defaultdict
 
-import asyncpg
 import discord
 import pkg_resources
 import psutil
 import pygit2
 from discord.ext import commands, tasks
 
-from utils import db, formats, time
+from utils import cache, db, formats, time
+from utils.latency import PHASES, Histogram, merge_histograms
 
 log = logging.getLogger(__name__)
 
@@ -50,18 +50,156 @@ class GatewayHandler(logging.Handler):
         self.cog.add_record(record)
 
 
-class Commands(db.Table):
+class Commands(db.Table, partition_by=db.RangePartition("used", interval="month")):
     id = db.PrimaryKeyColumn()
 
     guild_id = db.Column(db.Integer(big=True), index=True)
     channel_id = db.Column(db.Integer(big=True))
     author_id = db.Column(db.Integer(big=True), index=True)
-    used = db.Column(db.Datetime, index=True)
+    # rows are inserted in order of use, which is what BRIN is good at
+    used = db.Column(db.Datetime, index="brin")
     prefix = db.Column(db.String)
     command = db.Column(db.String, index=True)
     failed = db.Column(db.Boolean, index=True)
 
 
+# Command usage rolled up per hour and per day, kept up to date as commands
+# are inserted. DMs use a guild_id of 0 since these are part of the key.
+class CommandsHourly(db.Table, table_name="commands_hourly"):
+    bucket = db.Column(db.Datetime, primary_key=True)
+    guild_id = db.Column(db.Integer(big=True), primary_key=True)
+    author_id = db.Column(db.Integer(big=True), primary_key=True)
+    command = db.Column(db.String, primary_key=True)
+    uses = db.Column(db.Integer, nullable=False)
+    failed = db.Column(db.Integer, nullable=False)
+
+    @classmethod
+    def create_table(cls, *, exists_ok=True):
+        # roll up whatever was recorded before this table existed
+        backfill = """INSERT INTO commands_hourly (bucket, guild_id, author_id, command, uses, failed)
+                      SELECT date_trunc('hour', used),
+                             COALESCE(guild_id, 0),
+                             author_id,
+                             command,
+                             COUNT(*),
+                             COUNT(*) FILTER (WHERE failed)
+                      FROM commands
+                      GROUP BY 1, 2, 3, 4
+                      ON CONFLICT DO NOTHING;
+                   """
+        return f"{super().create_table(exists_ok=exists_ok)}\n{backfill}"
+
+
+class CommandsDaily(db.Table, table_name="commands_daily"):
+    bucket = db.Column(db.Date, primary_key=True)
+    guild_id = db.Column(db.Integer(big=True), primary_key=True, index=True)
+    author_id = db.Column(db.Integer(big=True), primary_key=True)
+    command = db.Column(db.String, primary_key=True)
+    uses = db.Column(db.Integer, nullable=False)
+    failed = db.Column(db.Integer, nullable=False)
+    first_used = db.Column(db.Datetime, nullable=False)
+
+    @classmethod
+    def create_table(cls, *, exists_ok=True):
+        backfill = """INSERT INTO commands_daily (bucket, guild_id, author_id, command, uses, failed, first_used)
+                      SELECT used::date,
+                             COALESCE(guild_id, 0),
+                             author_id,
+                             command,
+                             COUNT(*),
+                             COUNT(*) FILTER (WHERE failed),
+                             MIN(used)
+                      FROM commands
+                      GROUP BY 1, 2, 3, 4
+                      ON CONFLICT DO NOTHING;
+                   """
+        return f"{super().create_table(exists_ok=exists_ok)}\n{backfill}"
+
+
+# How long commands took, per hour and phase. counts has an entry for each
+# bucket of utils.latency.BOUNDS and total is the sum of the durations in ms.
+class CommandLatencyHourly(db.Table, table_name="command_latency_hourly"):
+    bucket = db.Column(db.Datetime, primary_key=True)
+    command = db.Column(db.String, primary_key=True)
+    phase = db.Column(db.String, primary_key=True)
+    counts = db.Column(db.Array(db.Integer(big=True)), nullable=False)
+    total = db.Column(db.Float, nullable=False)
+
+
+class CommandRecord(typing.NamedTuple):
+    # in the order COPY sends the columns
+    guild_id: typing.Optional[int]
+    channel_id: int
+    author_id: int
+    used: datetime.datetime
+    prefix: str
+    command: str
+    failed: bool
+
+
+HOURLY_UPSERT = """INSERT INTO commands_hourly (bucket, guild_id, author_id, command, uses, failed)
+                   SELECT * FROM unnest($1::timestamp[], $2::bigint[], $3::bigint[], $4::text[], $5::int[], $6::int[])
+                   ON CONFLICT (bucket, guild_id, author_id, command)
+                   DO UPDATE SET uses = commands_hourly.uses + EXCLUDED.uses,
+                                 failed = commands_hourly.failed + EXCLUDED.failed;
+                """
+
+DAILY_UPSERT = """INSERT INTO commands_daily (bucket, guild_id, author_id, command, uses, failed, first_used)
+                  SELECT * FROM unnest($1::date[], $2::bigint[], $3::bigint[], $4::text[], $5::int[], $6::int[], $7::timestamp[])
+                  ON CONFLICT (bucket, guild_id, author_id, command)
+                  DO UPDATE SET uses = commands_daily.uses + EXCLUDED.uses,
+                                failed = commands_daily.failed + EXCLUDED.failed,
+                                first_used = LEAST(commands_daily.first_used, EXCLUDED.first_used);
+               """
+
+
+# the histograms are added up bucket by bucket
+LATENCY_UPSERT = """INSERT INTO command_latency_hourly (bucket, command, phase, counts, total)
+                    VALUES (date_trunc('hour', now() AT TIME ZONE 'utc'), $1, $2, $3, $4)
+                    ON CONFLICT (bucket, command, phase)
+                    DO UPDATE SET counts = ARRAY(
+                                      SELECT COALESCE(a, 0) + COALESCE(b, 0)
+                                      FROM unnest(command_latency_hourly.counts, EXCLUDED.counts)
+                                           WITH ORDINALITY AS t(a, b, n)
+                                      ORDER BY n
+                                  ),
+                                  total = command_latency_hourly.total + EXCLUDED.total;
+                 """
+
+
+def rollup_commands(records):
+    """Totals up command records into rows for the hourly and daily rollups."""
+    hourly = {}
+    daily = {}
+    for record in records:
+        used = record.used
+        guild_id = record.guild_id or 0
+        failed = int(bool(record.failed))
+
+        hour = used.replace(minute=0, second=0, microsecond=0)
+        key = (hour, guild_id, record.author_id, record.command)
+        entry = hourly.get(key)
+        if entry is None:
+            hourly[key] = [1, failed]
+        else:
+            entry[0] += 1
+            entry[1] += failed
+
+        key = (used.date(), guild_id, record.author_id, record.command)
+        entry = daily.get(key)
+        if entry is None:
+            daily[key] = [1, failed, used]
+        else:
+            entry[0] += 1
+            entry[1] += failed
+            entry[2] = min(entry[2], used)
+
+    return (
+        [(*key, *totals) for key, totals in hourly.items()],
+        [(*key, *totals) for key, totals in daily.items()],
+    )
+
+
 _INVITE_REGEX = re.compile(
     r"(?:https?:\/\/)?discord(?:\.gg|\.com|app\.com\/invite)?\/[A-Za-z0-9]+"
 )
@@ -85,13 +223,31 @@ def object_at(addr):
 class Stats(commands.Cog):
     """Bot usage statistics."""
 
+    # commands waiting before a flush is started early
+    BATCH_SIZE = 500
+    # commands kept while the database is unreachable, the rest are dropped
+    MAX_BUFFERED = 50_000
+
     def __init__(self, bot):
         self.bot = bot
         self.process = psutil.Process()
-        self._batch_lock = asyncio.Lock(loop=bot.loop)
-        self._data_batch = []
-        self.bulk_insert_loop.add_exception_type(asyncpg.PostgresConnectionError)
+        # kept on the bot so a reload doesn't lose what was not inserted yet
+        batch = bot.buffers.get("stats.commands", list)
+        self._batch_lock = batch.lock
+        self._data_batch = batch.data
+        bot.buffers.register("stats.commands", self.flush)
+        # (command, phase): Histogram, since the last flush
+        latency = bot.buffers.get("stats.latency", dict)
+        self._latency_lock = latency.lock
+        self._latency = latency.data
+        bot.buffers.register("stats.latency", self.flush_latency)
+        # commands that didn't fit in the buffer
+        self.dropped_commands = 0
+        self._early_flush = None
+        # whether the last insert worked, we don't flush early otherwise
+        self._insert_failing = False
         self.bulk_insert_loop.start()
+        self.partition_maintenance.start()
         self._gateway_queue = asyncio.Queue(loop=bot.loop)
         self.gateway_worker.start()
 
@@ -112,39 +268,121 @@ class Stats(commands.Cog):
                 del dates[index]
 
     async def bulk_insert(self):
-        query = """INSERT INTO commands (guild_id, channel_id, author_id, used, prefix, command, failed)
-                   SELECT x.guild, x.channel, x.author, x.used, x.prefix, x.command, x.failed
-                   FROM jsonb_to_recordset($1::jsonb) AS
-                   x(guild BIGINT, channel BIGINT, author BIGINT, used TIMESTAMP, prefix TEXT, command TEXT, failed BOOLEAN)
-                """
+        if not self._data_batch:
+            return
+
+        # commands used while this runs go into the next batch
+        records = self._data_batch[:]
+        del self._data_batch[:]
+        hourly, daily = rollup_commands(records)
+        try:
+            async with self.bot.pool.acquire() as con, con.transaction():
+                await con.copy_records_to_table(
+                    "commands", records=records, columns=CommandRecord._fields
+                )
+                await con.execute(HOURLY_UPSERT, *zip(*hourly))
+                await con.execute(DAILY_UPSERT, *zip(*daily))
+        except Exception:
+            # put them back for the next attempt, if that is too many
+            # then the newest ones are dropped
+            self._data_batch[:0] = records
+            overflow = len(self._data_batch) - self.MAX_BUFFERED
+            if overflow > 0:
+                del self._data_batch[self.MAX_BUFFERED :]
+                self.dropped_commands += overflow
+
+            self._insert_failing = True
+            log.exception("Could not insert %s commands.", len(records))
+            return
+
+        self._insert_failing = False
+        if len(records) > 1:
+            log.info("Registered %s commands to the database.", len(records))
+
+    async def flush(self):
+        async with self._batch_lock:
+            await self.bulk_insert()
 
-        if self._data_batch:
-            await self.bot.pool.execute(query, self._data_batch)
-            total = len(self._data_batch)
-            if total > 1:
-                log.info("Registered %s commands to the database.", total)
-            self._data_batch.clear()
+    async def flush_latency(self):
+        async with self._latency_lock:
+            if not self._latency:
+                return
+
+            histograms = self._latency.copy()
+            self._latency.clear()
+            rows = [
+                (command, phase, histogram.counts, histogram.total)
+                for ((command, phase), histogram) in histograms.items()
+            ]
+            try:
+                async with self.bot.pool.acquire() as con, con.transaction():
+                    await con.executemany(LATENCY_UPSERT, rows)
+            except Exception:
+                # there's one per command and phase, so keeping them is fine
+                for (key, histogram) in histograms.items():
+                    current = self._latency.get(key)
+                    if current is None:
+                        self._latency[key] = histogram
+                    else:
+                        current.merge(histogram)
+                log.exception("Could not insert %s latency histograms.", len(rows))
 
     def cog_unload(self):
         self.bulk_insert_loop.stop()
+        self.partition_maintenance.cancel()
         self.gateway_worker.cancel()
+        self.bot.buffers.unregister("stats.commands")
+        self.bot.buffers.unregister("stats.latency")
 
     @tasks.loop(seconds=10.0)
     async def bulk_insert_loop(self):
-        async with self._batch_lock:
-            await self.bulk_insert()
+        await self.flush()
+        await self.flush_latency()
+
+    @tasks.loop(hours=12.0)
+    async def partition_maintenance(self):
+        # the rollups keep the totals of whatever is dropped here
+        retention = getattr(self.bot.config, "commands_retention_days", None)
+        try:
+            async with self.bot.pool.acquire() as con:
+                await Commands.create_partitions(ahead=2, connection=con)
+                if retention is None:
+                    return
+
+                cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=retention)
+                dropped = await Commands.drop_partitions(cutoff, connection=con)
+        except Exception:
+            log.exception("Could not maintain the commands partitions.")
+            return
+
+        if dropped:
+            log.info("Dropped old commands partitions: %s", ", ".join(dropped))
 
     @tasks.loop(seconds=0.0)
     async def gateway_worker(self):
         record = await self._gateway_queue.get()
         await self.notify_gateway_status(record)
 
+    def register_latency(self, ctx, command):
+        timer = ctx.timer
+        # only commands invoked through process_commands are timed
+        if timer.total is None:
+            return
+
+        for (phase, elapsed) in timer.timings().items():
+            key = (command, phase)
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+            histogram.add(elapsed)
+
     async def register_command(self, ctx):
         if ctx.command is None:
             return
 
         command = ctx.command.qualified_name
         self.bot.command_stats[command] += 1
+        self.register_latency(ctx, command)
         message = ctx.message
         destination = None
         if ctx.guild is None:
@@ -157,27 +395,35 @@ class Stats(commands.Cog):
         log.info(
             f"{message.created_at}: {message.author} in {destination}: {message.content}"
         )
-        async with self._batch_lock:
-            self._data_batch.append(
-                {
-                    "guild": guild_id,
-                    "channel": ctx.channel.id,
-                    "author": ctx.author.id,
-                    "used": message.created_at.isoformat(),
-                    "prefix": ctx.prefix,
-                    "command": command,
-                    "failed": ctx.command_failed,
-                }
+        if len(self._data_batch) >= self.MAX_BUFFERED:
+            self.dropped_commands += 1
+            return
+
+        self._data_batch.append(
+            CommandRecord(
+                guild_id,
+                ctx.channel.id,
+                ctx.author.id,
+                message.created_at,
+                ctx.prefix,
+                command,
+                ctx.command_failed,
             )
+        )
+
+        # don't wait for the timer when there's a lot to insert, unless the
+        # database is down and the timer is what retries
+        if (
+            len(self._data_batch) >= self.BATCH_SIZE
+            and not self._insert_failing
+            and (self._early_flush is None or self._early_flush.done())
+        ):
+            self._early_flush = self.bot.loop.create_task(self.flush())
 
     @commands.Cog.listener()
     async def on_command_completion(self, ctx):
         await self.register_command(ctx)
 
-    @commands.Cog.listener()
-    async def on_socket_response(self, msg):
-        self.bot.socket_stats[msg.get("t")] += 1
-
     @property
     def webhook(self):
         wh = self.bot.config.stat_webhook
@@ -225,6 +471,84 @@ class Stats(commands.Cog):
 
         await ctx.send(f"```\n{output}\n```")
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def latency(
+        self, ctx, hours: typing.Optional[int] = 24, *, command: str = None
+    ):
+        """Shows how long commands took over the last few hours, in milliseconds.
+
+        Without a command this lists the slowest ones by p95. With one, it
+        shows how its time splits into checks, converters, database and body.
+        """
+        query = """SELECT command, phase, counts, total
+                   FROM command_latency_hourly
+                   WHERE bucket >= date_trunc('hour', (now() AT TIME ZONE 'utc') - $1::interval)
+                """
+        args = [datetime.timedelta(hours=hours)]
+        if command is not None:
+            query += " AND command = $2"
+            args.append(command)
+
+        records = await ctx.db.fetch(query, *args)
+        rows = [
+            ((record["command"], record["phase"]), record["counts"], record["total"])
+            for record in records
+        ]
+        # and what wasn't flushed yet
+        rows.extend(
+            (key, histogram.counts, histogram.total)
+            for (key, histogram) in self._latency.items()
+            if command is None or key[0] == command
+        )
+        histograms = merge_histograms(rows)
+        if not histograms:
+            return await ctx.send("No command latency recorded.")
+
+        table = formats.TabularData()
+        if command is None:
+            table.set_columns(["Command", "Uses", "p50", "p95", "p99", "Mean"])
+            totals = [
+                (name, histogram)
+                for ((name, phase), histogram) in histograms.items()
+                if phase == "total"
+            ]
+            totals.sort(key=lambda t: t[1].percentile(95), reverse=True)
+            for (name, histogram) in totals:
+                table.add_row(
+                    (
+                        name,
+                        histogram.count,
+                        f"{histogram.percentile(50):.1f}",
+                        f"{histogram.percentile(95):.1f}",
+                        f"{histogram.percentile(99):.1f}",
+                        f"{histogram.total / histogram.count:.1f}",
+                    )
+                )
+        else:
+            table.set_columns(["Phase", "p50", "p95", "p99", "Mean"])
+            for phase in PHASES:
+                histogram = histograms.get((command, phase))
+                if histogram is None:
+                    continue
+                table.add_row(
+                    (
+                        phase,
+                        f"{histogram.percentile(50):.1f}",
+                        f"{histogram.percentile(95):.1f}",
+                        f"{histogram.percentile(99):.1f}",
+                        f"{histogram.total / histogram.count:.1f}",
+                    )
+                )
+
+        fmt = f"Last {hours} hour(s):\n```\n{table.render()}\n```"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode("utf-8"))
+            file = discord.File(fp, "latency.txt")
+            await ctx.send("Too many commands...", file=file)
+        else:
+            await ctx.send(fmt)
+
     @commands.command(hidden=True)
     async def socketstats(self, ctx):
         """Show data on the received socketstats since uptime."""
@@ -233,7 +557,7 @@ class Stats(commands.Cog):
         total = sum(self.bot.socket_stats.values())
         cpm = total / minutes
         await ctx.send(
-            f"{total} socket events observed ({cpm:.2f}/minute):\n{self.bot.socket_stats}"
+            f"{total} socket events observed ({cpm:.2f}/minute):\n{+self.bot.socket_stats}"
         )
 
     def get_bot_uptime(self, *, brief=False):
@@ -373,17 +697,19 @@ class Stats(commands.Cog):
         )
 
         # total command uses
-        query = "SELECT COUNT(*), MIN(used) FROM commands WHERE guild_id=$1;"
+        query = (
+            "SELECT SUM(uses), MIN(first_used) FROM commands_daily WHERE guild_id=$1;"
+        )
         count = await ctx.db.fetchrow(query, ctx.guild.id)
 
-        embed.description = f"{count[0]} commands used."
+        embed.description = f"{count[0] or 0} commands used."
         embed.set_footer(text="Tracking command usage since").timestamp = (
             count[1] or datetime.datetime.utcnow()
         )
 
         query = """SELECT command,
-                          COUNT(*) as "uses"
-                   FROM commands
+                          SUM(uses) as "uses"
+                   FROM commands_daily
                    WHERE guild_id=$1
                    GROUP BY command
                    ORDER BY "uses" DESC
@@ -403,10 +729,10 @@ class Stats(commands.Cog):
         embed.add_field(name="Top Commands", value=value, inline=True)
 
         query = """SELECT command,
-                          COUNT(*) as "uses"
-                   FROM commands
+                          SUM(uses) as "uses"
+                   FROM commands_hourly
                    WHERE guild_id=$1
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                   AND bucket >= date_trunc('hour', (now() AT TIME ZONE 'utc') - INTERVAL '1 day')
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -425,8 +751,8 @@ class Stats(commands.Cog):
         embed.add_field(name="\u200b", value="\u200b", inline=True)
 
         query = """SELECT author_id,
-                          COUNT(*) AS "uses"
-                   FROM commands
+                          SUM(uses) AS "uses"
+                   FROM commands_daily
                    WHERE guild_id=$1
                    GROUP BY author_id
                    ORDER BY "uses" DESC
@@ -446,10 +772,10 @@ class Stats(commands.Cog):
         embed.add_field(name="Top Command Users", value=value, inline=True)
 
         query = """SELECT author_id,
-                          COUNT(*) AS "uses"
-                   FROM commands
+                          SUM(uses) AS "uses"
+                   FROM commands_hourly
                    WHERE guild_id=$1
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                   AND bucket >= date_trunc('hour', (now() AT TIME ZONE 'utc') - INTERVAL '1 day')
                    GROUP BY author_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -481,17 +807,17 @@ class Stats(commands.Cog):
         embed.set_author(name=str(member), icon_url=member.avatar_url)
 
         # total command uses
-        query = "SELECT COUNT(*), MIN(used) FROM commands WHERE guild_id=$1 AND author_id=$2;"
+        query = "SELECT SUM(uses), MIN(first_used) FROM commands_daily WHERE guild_id=$1 AND author_id=$2;"
         count = await ctx.db.fetchrow(query, ctx.guild.id, member.id)
 
-        embed.description = f"{count[0]} commands used."
+        embed.description = f"{count[0] or 0} commands used."
         embed.set_footer(text="First command used").timestamp = (
             count[1] or datetime.datetime.utcnow()
         )
 
         query = """SELECT command,
-                          COUNT(*) as "uses"
-                   FROM commands
+                          SUM(uses) as "uses"
+                   FROM commands_daily
                    WHERE guild_id=$1 AND author_id=$2
                    GROUP BY command
                    ORDER BY "uses" DESC
@@ -511,11 +837,11 @@ class Stats(commands.Cog):
         embed.add_field(name="Most Used Commands", value=value, inline=False)
 
         query = """SELECT command,
-                          COUNT(*) as "uses"
-                   FROM commands
+                          SUM(uses) as "uses"
+                   FROM commands_hourly
                    WHERE guild_id=$1
                    AND author_id=$2
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                   AND bucket >= date_trunc('hour', (now() AT TIME ZONE 'utc') - INTERVAL '1 day')
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -550,11 +876,11 @@ class Stats(commands.Cog):
     async def stats_global(self, ctx):
         """Global all time command statistics."""
 
-        query = "SELECT COUNT(*) FROM commands;"
+        query = "SELECT SUM(uses) FROM commands_daily;"
         total = await ctx.db.fetchrow(query)
 
         e = discord.Embed(title="Command Stats", colour=discord.Colour.blurple())
-        e.description = f"{total[0]} commands used."
+        e.description = f"{total[0] or 0} commands used."
 
         lookup = (
             "\N{FIRST PLACE MEDAL}",
@@ -564,8 +890,8 @@ class Stats(commands.Cog):
             "\N{SPORTS MEDAL}",
         )
 
-        query = """SELECT command, COUNT(*) AS "uses"
-                   FROM commands
+        query = """SELECT command, SUM(uses) AS "uses"
+                   FROM commands_daily
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -578,8 +904,8 @@ class Stats(commands.Cog):
         )
         e.add_field(name="Top Commands", value=value, inline=False)
 
-        query = """SELECT guild_id, COUNT(*) AS "uses"
-                   FROM commands
+        query = """SELECT NULLIF(guild_id, 0), SUM(uses) AS "uses"
+                   FROM commands_daily
                    GROUP BY guild_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -600,8 +926,8 @@ class Stats(commands.Cog):
 
         e.add_field(name="Top Guilds", value="\n".join(value), inline=False)
 
-        query = """SELECT author_id, COUNT(*) AS "uses"
-                   FROM commands
+        query = """SELECT author_id, SUM(uses) AS "uses"
+                   FROM commands_daily
                    GROUP BY author_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -624,25 +950,17 @@ class Stats(commands.Cog):
     async def stats_today(self, ctx):
         """Global command statistics for the day."""
 
-        query = "SELECT failed, COUNT(*) FROM commands WHERE used > (CURRENT_TIMESTAMP - INTERVAL '1 day') GROUP BY failed;"
-        total = await ctx.db.fetch(query)
-        failed = 0
-        success = 0
-        question = 0
-        for state, count in total:
-            if state is False:
-                success += count
-            elif state is True:
-                failed += count
-            else:
-                question += count
+        query = "SELECT SUM(uses), SUM(failed) FROM commands_hourly WHERE bucket >= date_trunc('hour', (now() AT TIME ZONE 'utc') - INTERVAL '1 day');"
+        total, failed = await ctx.db.fetchrow(query)
+        total = total or 0
+        failed = failed or 0
 
         e = discord.Embed(
             title="Last 24 Hour Command Stats", colour=discord.Colour.blurple()
         )
         e.description = (
-            f"{failed + success + question} commands used today. "
-            f"({success} succeeded, {failed} failed, {question} unknown)"
+            f"{total} commands used today. "
+            f"({total - failed} succeeded, {failed} failed)"
         )
 
         lookup = (
@@ -653,9 +971,9 @@ class Stats(commands.Cog):
             "\N{SPORTS MEDAL}",
         )
 
-        query = """SELECT command, COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT command, SUM(uses) AS "uses"
+                   FROM commands_hourly
+                   WHERE bucket >= date_trunc('hour', (now() AT TIME ZONE 'utc') - INTERVAL '1 day')
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -668,9 +986,9 @@ class Stats(commands.Cog):
         )
         e.add_field(name="Top Commands", value=value, inline=False)
 
-        query = """SELECT guild_id, COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT NULLIF(guild_id, 0), SUM(uses) AS "uses"
+                   FROM commands_hourly
+                   WHERE bucket >= date_trunc('hour', (now() AT TIME ZONE 'utc') - INTERVAL '1 day')
                    GROUP BY guild_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -690,9 +1008,9 @@ class Stats(commands.Cog):
 
         e.add_field(name="Top Guilds", value="\n".join(value), inline=False)
 
-        query = """SELECT author_id, COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT author_id, SUM(uses) AS "uses"
+                   FROM commands_hourly
+                   WHERE bucket >= date_trunc('hour', (now() AT TIME ZONE 'utc') - INTERVAL '1 day')
                    GROUP BY author_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
@@ -859,13 +1177,24 @@ class Stats(commands.Cog):
         )
 
         spam_control = self.bot.spam_control
-        being_spammed = [
-            str(key) for key, value in spam_control._cache.items() if value._tokens == 0
-        ]
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        being_spammed = [str(key) for key in spam_control.limited(now)]
 
         description.append(
             f'Current Spammers: {", ".join(being_spammed) if being_spammed else "None"}'
         )
+
+        spam_buckets = [spam_control]
+        mod = self.bot.get_cog("Mod")
+        if mod is not None:
+            for checker in mod._spam_check.values():
+                spam_buckets.extend(checker.buckets)
+
+        bucket_memory = sum(b.memory_usage() for b in spam_buckets) / 1024
+        description.append(
+            f"Spam Buckets: {sum(map(len, spam_buckets))} ({bucket_memory:.1f} KiB), "
+            f"Swept: {sum(b.swept for b in spam_buckets)}"
+        )
         description.append(f"Questionable Connections: {questionable_connections}")
 
         total_warnings += questionable_connections
@@ -902,7 +1231,8 @@ class Stats(commands.Cog):
         command_waiters = len(self._data_batch)
         is_locked = self._batch_lock.locked()
         description.append(
-            f"Commands Waiting: {command_waiters}, Batch Locked: {is_locked}"
+            f"Commands Waiting: {command_waiters}, Batch Locked: {is_locked}, "
+            f"Dropped: {self.dropped_commands}"
         )
 
         memory_usage = self.process.memory_full_info().uss / 1024 ** 2
@@ -913,6 +1243,39 @@ class Stats(commands.Cog):
             inline=False,
         )
 
+        lag = self.bot.lag_monitor
+
+        def ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.1f}ms"
+
+        # a stall long ago says nothing about how the bot is doing now
+        recent_stalls = lag.recent_stalls(15 * 60.0)
+        lag_value = [
+            f"Mean: {ms(lag.mean)}, p50: {ms(lag.percentile(50))}, "
+            f"p99: {ms(lag.percentile(99))}, Max: {ms(lag.max)}",
+            f"Stalls over {ms(lag.threshold)}: {len(lag.stalls)} "
+            f"({len(recent_stalls)} in the last 15 minutes)",
+        ]
+        if lag.stalls:
+            last = lag.stalls[-1]
+            lag_value.append(
+                f"Last: {ms(last.duration)} {time.human_timedelta(last.when)}"
+            )
+        if recent_stalls:
+            total_warnings += 1
+            embed.colour = WARNING
+        embed.add_field(name="Event Loop Lag", value="\n".join(lag_value), inline=False)
+
+        message_stats = self.bot.message_stats
+        rejected = sum(v for k, v in message_stats.items() if k != "invoked")
+        description.append(
+            f"Messages Invoked: {message_stats['invoked']}, Rejected: {rejected} "
+            f"(no prefix: {message_stats['no_prefix']}, "
+            f"unknown command: {message_stats['unknown_command']}, "
+            f"blacklisted: {message_stats['blacklisted']}, "
+            f"rate limited: {message_stats['rate_limited']})"
+        )
+
         global_rate_limit = not self.bot.http._global_over.is_set()
         description.append(f"Global Rate Limit: {global_rate_limit}")
 
@@ -927,6 +1290,151 @@ class Stats(commands.Cog):
         embed.description = "\n".join(description)
         await ctx.send(embed=embed)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def cachestats(self, ctx):
+        """Shows the statistics of every cached function."""
+
+        def ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+        table = formats.TabularData()
+        table.set_columns(
+            [
+                "Name",
+                "Size",
+                "Hits",
+                "Misses",
+                "Hit %",
+                "Evictions",
+                "In-Flight",
+                "p50 (ms)",
+                "p95 (ms)",
+                "p99 (ms)",
+            ]
+        )
+
+        all_stats = sorted(cache.all_stats(), key=lambda s: s.misses, reverse=True)
+        for stats in all_stats:
+            table.add_row(
+                (
+                    stats.name.replace("cogs.", "", 1),
+                    stats.size,
+                    stats.hits,
+                    stats.misses,
+                    f"{stats.hit_ratio:.1%}",
+                    stats.evictions,
+                    stats.in_flight,
+                    ms(stats.latency_percentile(50)),
+                    ms(stats.latency_percentile(95)),
+                    ms(stats.latency_percentile(99)),
+                )
+            )
+
+        render = table.render()
+        fmt = f"```\n{render}\n```"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode("utf-8"))
+            await ctx.send("Too many caches...", file=discord.File(fp, "caches.txt"))
+        else:
+            await ctx.send(fmt)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def startup(self, ctx):
+        """Shows how long each extension took to import and set up."""
+        table = formats.TabularData()
+        table.set_columns(["Extension", "Import (ms)", "Setup (ms)"])
+
+        timings = sorted(
+            self.bot.extension_timings.items(), key=lambda t: t[1].total, reverse=True
+        )
+        for extension, timing in timings:
+            table.add_row(
+                (
+                    extension,
+                    f"{timing.imported * 1000:.1f}",
+                    f"{timing.setup * 1000:.1f}",
+                )
+            )
+        for extension in self.bot._lazy_extensions:
+            table.add_row((extension, "not loaded", "not loaded"))
+
+        render = table.render()
+        fmt = f"```\n{render}\n```"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode("utf-8"))
+            file = discord.File(fp, "startup.txt")
+            await ctx.send("Too many extensions...", file=file)
+        else:
+            await ctx.send(fmt)
+
+    @commands.group(hidden=True, invoke_without_command=True)
+    @commands.is_owner()
+    async def listeners(self, ctx):
+        """Shows what each event listener costs, busiest first.
+
+        Busy is the time spent running on the event loop, while wall time
+        also includes whatever the listener was waiting on.
+        """
+        profiler = self.bot.listener_profiler
+        if not profiler.stats:
+            state = "on" if profiler.enabled else "off"
+            return await ctx.send(f"No listener stats yet, profiling is {state}.")
+
+        table = formats.TabularData()
+        table.set_columns(
+            [
+                "Listener",
+                "Calls",
+                "Busy (ms)",
+                "Max Busy (ms)",
+                "Wall (ms)",
+                "Max Wall (ms)",
+                "Running",
+                "Errors",
+            ]
+        )
+        for entry in profiler.sorted_stats():
+            table.add_row(
+                (
+                    entry.name,
+                    entry.calls,
+                    f"{entry.busy * 1000:.1f}",
+                    f"{entry.busy_max * 1000:.1f}",
+                    f"{entry.total * 1000:.1f}",
+                    f"{entry.max * 1000:.1f}",
+                    entry.in_flight,
+                    entry.errors,
+                )
+            )
+
+        since = time.human_timedelta(profiler.started, brief=True)
+        state = "on" if profiler.enabled else "off"
+        fmt = f"Profiling is {state}, started {since}.\n```\n{table.render()}\n```"
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode("utf-8"))
+            file = discord.File(fp, "listeners.txt")
+            await ctx.send("Too many listeners...", file=file)
+        else:
+            await ctx.send(fmt)
+
+    @listeners.command(name="toggle")
+    @commands.is_owner()
+    async def listeners_toggle(self, ctx):
+        """Turns listener profiling on or off."""
+        profiler = self.bot.listener_profiler
+        profiler.enabled = not profiler.enabled
+        state = "on" if profiler.enabled else "off"
+        await ctx.send(f"Listener profiling is now {state}.")
+
+    @listeners.command(name="reset")
+    @commands.is_owner()
+    async def listeners_reset(self, ctx):
+        """Clears the listener stats."""
+        self.bot.listener_profiler.reset()
+        await ctx.send(ctx.tick(True))
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def gateway(self, ctx):
@@ -1058,12 +1566,12 @@ class Stats(commands.Cog):
 
         query = """SELECT *, t.success + t.failed AS "total"
                    FROM (
-                       SELECT guild_id,
-                              SUM(CASE WHEN failed THEN 0 ELSE 1 END) AS "success",
-                              SUM(CASE WHEN failed THEN 1 ELSE 0 END) AS "failed"
-                       FROM commands
+                       SELECT NULLIF(guild_id, 0) AS "guild_id",
+                              SUM(uses - failed) AS "success",
+                              SUM(failed) AS "failed"
+                       FROM commands_daily
                        WHERE command=$1
-                       AND used > (CURRENT_TIMESTAMP - $2::interval)
+                       AND bucket > ((now() AT TIME ZONE 'utc')::date - $2::interval)
                        GROUP BY guild_id
                    ) AS t
                    ORDER BY "total" DESC
@@ -1116,9 +1624,9 @@ class Stats(commands.Cog):
     async def command_history_log(self, ctx, days=7):
         """Command history log for the last N days."""
 
-        query = """SELECT command, COUNT(*)
-                   FROM commands
-                   WHERE used > (CURRENT_TIMESTAMP - $1::interval)
+        query = """SELECT command, SUM(uses)
+                   FROM commands_daily
+                   WHERE bucket > ((now() AT TIME ZONE 'utc')::date - $1::interval)
                    GROUP BY command
                    ORDER BY 2 DESC
                 """
@@ -1173,11 +1681,11 @@ class Stats(commands.Cog):
             query = """SELECT *, t.success + t.failed AS "total"
                        FROM (
                            SELECT command,
-                                  SUM(CASE WHEN failed THEN 0 ELSE 1 END) AS "success",
-                                  SUM(CASE WHEN failed THEN 1 ELSE 0 END) AS "failed"
-                           FROM commands
+                                  SUM(uses - failed) AS "success",
+                                  SUM(failed) AS "failed"
+                           FROM commands_daily
                            WHERE command = any($1::text[])
-                           AND used > (CURRENT_TIMESTAMP - $2::interval)
+                           AND bucket > ((now() AT TIME ZONE 'utc')::date - $2::interval)
                            GROUP BY command
                        ) AS t
                        ORDER BY "total" DESC
@@ -1191,10 +1699,10 @@ class Stats(commands.Cog):
         query = """SELECT *, t.success + t.failed AS "total"
                    FROM (
                        SELECT command,
-                              SUM(CASE WHEN failed THEN 0 ELSE 1 END) AS "success",
-                              SUM(CASE WHEN failed THEN 1 ELSE 0 END) AS "failed"
-                       FROM commands
-                       WHERE used > (CURRENT_TIMESTAMP - $1::interval)
+                              SUM(uses - failed) AS "success",
+                              SUM(failed) AS "failed"
+                       FROM commands_daily
+                       WHERE bucket > ((now() AT TIME ZONE 'utc')::date - $1::interval)
                        GROUP BY command
                    ) AS t;
                 """
@@ -1259,9 +1767,6 @@ def setup(bot):
     if not hasattr(bot, "command_stats"):
         bot.command_stats = Counter()
 
-    if not hasattr(bot, "socket_stats"):
-        bot.socket_stats = Counter()
-
     cog = Stats(bot)
     bot.add_cog(cog)
     bot._stats_cog_gateway_handler = handler = GatewayHandler(cog)
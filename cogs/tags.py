@@ -566,12 +566,12 @@ class Tags(commands.Cog):
 
         # tag users
         query = """SELECT
-                       COUNT(*) AS tag_uses,
+                       SUM(uses) AS tag_uses,
                        author_id
-                   FROM commands
+                   FROM commands_daily
                    WHERE guild_id=$1 AND command='tag'
                    GROUP BY author_id
-                   ORDER BY COUNT(*) DESC
+                   ORDER BY SUM(uses) DESC
                    LIMIT 3;
                 """
 
@@ -622,8 +622,8 @@ class Tags(commands.Cog):
         e.set_author(name=str(member), icon_url=member.avatar_url)
         e.set_footer(text="These statistics are server-specific.")
 
-        query = """SELECT COUNT(*)
-                   FROM commands
+        query = """SELECT COALESCE(SUM(uses), 0)
+                   FROM commands_daily
                    WHERE guild_id=$1 AND command='tag' AND author_id=$2
                 """
 
@@ -115,7 +115,9 @@ class Twitch(commands.Cog):
         expire_date = datetime.datetime.now() + datetime.timedelta(seconds=expire_secs)
         return await self.bot.pool.execute(query, auth_token, now, expire_date)
 
-    @cache.cache()
+    @cache.cache(
+        maxsize=1, strategy=cache.Strategy.lru_ttl, ttl=3600.0, soft_ttl=300.0
+    )
     async def _gen_headers(self) -> Dict[str, str]:
         """Let's use this to create the Headers."""
         base = self.bot.config.twitch_headers
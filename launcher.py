@@ -6,20 +6,32 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import asyncio
 import contextlib
+import datetime
 import importlib
 import logging
+import multiprocessing
+import os
+import signal
 import sys
+import time
 import traceback
+from typing import List, Optional
 
 import click
+import discord
 
 import config
-from bot import EXTENSIONS, Akane
+from bot import EXTENSIONS, Akane, ShardedAkane
 from utils.db import Table
+from utils.invalidation import InvalidationBus
+from utils.microbench import bench_expiring_cache, bench_prefixes
+from utils.metrics import MetricsServer
+from utils.mockdiscord import MockDiscord
+from utils.replay import iter_report, read_event_log, replay, synthetic_events
 
 
 @contextlib.contextmanager
-def setup_logging():
+def setup_logging(filename="Akane.log"):
     try:
         # __enter__
         logging.getLogger("discord").setLevel(logging.INFO)
@@ -27,7 +39,7 @@ def setup_logging():
 
         log = logging.getLogger()
         log.setLevel(logging.INFO)
-        handler = logging.FileHandler(filename="Akane.log", encoding="utf-8", mode="w")
+        handler = logging.FileHandler(filename=filename, encoding="utf-8", mode="w")
         dt_fmt = "%Y-%m-%d %H:%M:%S"
         fmt = logging.Formatter(
             "[{asctime}] [{levelname:<7}] {name}: {message}", dt_fmt, style="{"
@@ -44,7 +56,21 @@ def setup_logging():
             log.removeHandler(hdlr)
 
 
-def run_bot():
+def install_loop_policy():
+    """Switches to uvloop when ``config.use_uvloop`` is set."""
+    if not getattr(config, "use_uvloop", False):
+        return
+
+    try:
+        import uvloop
+    except ImportError:
+        click.echo("use_uvloop is set but uvloop isn't installed.", err=True)
+        return
+
+    uvloop.install()
+
+
+def run_bot(*, cluster_id=None, shard_ids=None, shard_count=None):
     loop = asyncio.get_event_loop()
     log = logging.getLogger()
 
@@ -61,20 +87,315 @@ def run_bot():
         log.exception("Could not set up PostgreSQL. Exiting.")
         return
 
-    bot = Akane()
+    if shard_ids is None:
+        bot = Akane()
+    else:
+        bot = ShardedAkane(
+            cluster_id=cluster_id, shard_ids=shard_ids, shard_count=shard_count
+        )
     bot.pool = pool
+    if getattr(config, "config_backend", "json") == "postgresql":
+        loop.run_until_complete(bot.load_stores())
+    bot.cache_bus = InvalidationBus(pool)
+    loop.run_until_complete(bot.cache_bus.start())
+
+    metrics_port = getattr(config, "metrics_port", None)
+    if metrics_port is not None:
+        # every cluster process gets the next port
+        bot.metrics_server = MetricsServer(
+            bot,
+            host=getattr(config, "metrics_host", "127.0.0.1"),
+            port=metrics_port + (cluster_id or 0),
+        )
+        try:
+            loop.run_until_complete(bot.metrics_server.start())
+        except OSError:
+            log.exception(
+                "Could not serve metrics on port %s.", bot.metrics_server.port
+            )
+            bot.metrics_server = None
+
     bot.run()
 
 
+async def fetch_shard_count() -> int:
+    """Asks Discord how many shards we should be running."""
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(config.token, bot=True)
+        shard_count, _ = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shard_count
+
+
+def split_shards(shard_count: int, clusters: int) -> List[List[int]]:
+    """Splits the shards into contiguous ranges, one per cluster."""
+    per_cluster, extra = divmod(shard_count, clusters)
+    ranges = []
+    start = 0
+    for index in range(clusters):
+        end = start + per_cluster + (index < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return [shard_ids for shard_ids in ranges if shard_ids]
+
+
+def run_worker(cluster_id, shard_ids, shard_count, api_base):
+    if api_base is not None:
+        discord.http.Route.BASE = api_base
+
+    # the supervisor handles Ctrl+C for us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    install_loop_policy()
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    with setup_logging(f"Akane-{cluster_id}.log"):
+        run_bot(cluster_id=cluster_id, shard_ids=shard_ids, shard_count=shard_count)
+
+
+class Cluster:
+    """A worker process running a range of shards, restarted when it crashes."""
+
+    # a worker that stayed up this long is considered healthy again
+    STABLE_AFTER = 60.0
+
+    def __init__(self, cluster_id, shard_ids, shard_count, *, api_base=None):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.api_base = api_base
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at = 0.0
+        self.restart_at: Optional[float] = None
+        self.failures = 0
+        self.finished = False
+
+    def __repr__(self):
+        first, last = self.shard_ids[0], self.shard_ids[-1]
+        return f"<Cluster id={self.cluster_id} shards={first}-{last}>"
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self.process = context.Process(
+            target=run_worker,
+            args=(self.cluster_id, self.shard_ids, self.shard_count, self.api_base),
+            name=f"Akane-{self.cluster_id}",
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        click.echo(f"Started cluster {self.cluster_id} (pid {self.process.pid}).")
+
+    def poll(self, now):
+        """Restarts the worker if it died and its backoff has passed."""
+        if self.finished:
+            return
+
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                self.start()
+            return
+
+        if self.process.is_alive():
+            return
+
+        code = self.process.exitcode
+        if code == 0:
+            click.echo(f"Cluster {self.cluster_id} shut down cleanly.")
+            self.finished = True
+            return
+
+        if now - self.started_at >= self.STABLE_AFTER:
+            self.failures = 0
+        self.failures += 1
+        delay = min(2.0 ** self.failures, 300.0)
+        self.restart_at = now + delay
+        click.echo(
+            f"Cluster {self.cluster_id} exited with {code}, "
+            f"restarting in {delay:.0f}s.",
+            err=True,
+        )
+
+    def stop(self, timeout=30.0):
+        process = self.process
+        self.finished = True
+        if process is None or not process.is_alive():
+            return
+
+        # discord.py closes the bot gracefully on SIGTERM
+        process.terminate()
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+def supervise(clusters: List[Cluster], *, identify_delay=5.0):
+    stopping = False
+
+    def request_stop(*args):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    try:
+        for cluster in clusters:
+            if stopping:
+                break
+            cluster.start()
+            # IDENTIFYs are global to the bot, so wait for this cluster's
+            # shards to connect before the next one starts identifying
+            deadline = time.monotonic() + identify_delay * len(cluster.shard_ids)
+            while not stopping and time.monotonic() < deadline:
+                time.sleep(0.5)
+
+        while not stopping and not all(c.finished for c in clusters):
+            now = time.monotonic()
+            for cluster in clusters:
+                cluster.poll(now)
+            time.sleep(1.0)
+    finally:
+        for cluster in clusters:
+            cluster.stop()
+
+
 @click.group(invoke_without_command=True, options_metavar="[options]")
 @click.pass_context
 def main(ctx):
     """Launches the bot."""
     if ctx.invoked_subcommand is None:
+        install_loop_policy()
         with setup_logging():
             run_bot()
 
 
+@main.command(short_help="runs the bot over several processes")
+@click.option(
+    "-c", "--clusters", type=int, help="number of processes, defaults to the CPU count"
+)
+@click.option("-s", "--shards", type=int, help="total shards, defaults to Discord's")
+@click.option("--api-base", help="API to connect to instead of Discord's, for testing")
+def cluster(clusters, shards, api_base):
+    """Runs the bot as several processes, each handling a range of shards.
+
+    Caches, cooldowns and spam counters are kept per process. The prefixes and
+    the blacklist are only shared when ``config_backend`` is ``"postgresql"``.
+    """
+    if getattr(config, "config_backend", "json") != "postgresql":
+        click.echo(
+            "config_backend is not postgresql, prefix and blacklist changes "
+            "will not be shared between processes.",
+            err=True,
+        )
+
+    if api_base is not None:
+        discord.http.Route.BASE = api_base
+
+    if shards is None:
+        shards = asyncio.get_event_loop().run_until_complete(fetch_shard_count())
+
+    clusters = min(clusters or os.cpu_count() or 1, shards)
+    workers = [
+        Cluster(index, shard_ids, shards, api_base=api_base)
+        for index, shard_ids in enumerate(split_shards(shards, clusters))
+    ]
+    click.echo(f"Running {shards} shards over {len(workers)} processes.")
+    supervise(workers)
+
+
+@main.command(short_help="serves a fake Discord API for testing clusters")
+@click.option("--host", default="127.0.0.1", help="address to listen on")
+@click.option("-p", "--port", default=8080, help="port to listen on")
+@click.option("-s", "--shards", default=4, help="shard count to hand out")
+@click.option("-g", "--guilds", default=10, help="guilds per shard")
+@click.option("--rate", default=0.0, help="messages per second per shard")
+def mockapi(host, port, shards, guilds, rate):
+    """Serves just enough of Discord's API and gateway for the bot to start.
+
+    Point ``cluster --api-base`` at the URL it prints. The token is never
+    checked and nothing reaches Discord.
+    """
+    loop = asyncio.get_event_loop()
+    server = MockDiscord(host=host, port=port, shards=shards, guilds=guilds, rate=rate)
+    with setup_logging("mockapi.log"):
+        loop.run_until_complete(server.start())
+        click.echo(f"Run: launcher.py cluster --api-base {server.api_base}")
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(server.close())
+
+        for (shard_id, count) in sorted(server.identified.items()):
+            click.echo(f"Shard {shard_id} identified {count} time(s).")
+
+
+@main.command(short_help="benchmarks the bot by replaying gateway events")
+@click.option(
+    "-f",
+    "--file",
+    "path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="a prev_events.log to replay instead of synthetic events",
+)
+@click.option("-n", "--events", default=5000, help="how many synthetic events")
+@click.option("-r", "--repeat", default=1, help="how many times to replay the file")
+@click.option("--allocations", is_flag=True, help="trace allocations, much slower")
+@click.option("--postgres", help="PostgreSQL URI, defaults to config.postgresql")
+@click.option("--cache", is_flag=True, help="benchmark ExpiringCache instead")
+@click.option(
+    "--prefixes", is_flag=True, help="benchmark prefix matching over 100k messages"
+)
+def bench(path, events, repeat, allocations, postgres, cache, prefixes):
+    """Replays gateway events through every listener and reports their cost.
+
+    Discord's HTTP API is faked, but the database is real, so point this at
+    a local PostgreSQL. The micro-benchmarks need neither.
+    """
+    if cache or prefixes:
+        if cache:
+            for line in bench_expiring_cache():
+                click.echo(line)
+        if prefixes:
+            for line in bench_prefixes():
+                click.echo(line)
+        return
+
+    install_loop_policy()
+    loop = asyncio.get_event_loop()
+    try:
+        pool = loop.run_until_complete(
+            Table.create_pool(postgres or config.postgresql, command_timeout=60)
+        )
+    except Exception:
+        click.echo(
+            f"Could not create PostgreSQL connection pool.\n{traceback.format_exc()}",
+            err=True,
+        )
+        return
+
+    if path is not None:
+        payloads = read_event_log(path) * repeat
+    else:
+        payloads = synthetic_events(events)
+
+    bot = Akane()
+    bot.pool = pool
+    try:
+        report = loop.run_until_complete(
+            replay(bot, payloads, trace_allocations=allocations)
+        )
+    finally:
+        loop.run_until_complete(bot.close())
+        loop.run_until_complete(pool.close())
+
+    for line in iter_report(report):
+        click.echo(line)
+
+
 @main.group(short_help="database stuff", options_metavar="[options]")
 def db():
     pass
@@ -202,6 +523,103 @@ async def apply_migration(cog, quiet, index, *, downgrade=False):
             await tr.commit()
 
 
+async def bench_ingestion(pool, records, batch_size):
+    # the way Stats used to insert commands
+    jsonb_query = """INSERT INTO bench_commands (guild_id, channel_id, author_id, used, prefix, command, failed)
+                     SELECT x.guild, x.channel, x.author, x.used, x.prefix, x.command, x.failed
+                     FROM jsonb_to_recordset($1::jsonb) AS
+                     x(guild BIGINT, channel BIGINT, author BIGINT, used TIMESTAMP, prefix TEXT, command TEXT, failed BOOLEAN)
+                  """
+
+    async def jsonb(con, batch):
+        data = [
+            {
+                "guild": r.guild_id,
+                "channel": r.channel_id,
+                "author": r.author_id,
+                "used": r.used.isoformat(),
+                "prefix": r.prefix,
+                "command": r.command,
+                "failed": r.failed,
+            }
+            for r in batch
+        ]
+        await con.execute(jsonb_query, data)
+
+    async def copy(con, batch):
+        await con.copy_records_to_table(
+            "bench_commands", records=batch, columns=type(batch[0])._fields
+        )
+
+    results = {}
+    async with pool.acquire() as con:
+        # a temporary copy of commands with the same indexes, gone afterwards
+        await con.execute(
+            """CREATE TEMPORARY TABLE bench_commands (LIKE commands INCLUDING INDEXES);
+               CREATE TEMPORARY SEQUENCE bench_commands_id_seq OWNED BY bench_commands.id;
+               ALTER TABLE bench_commands
+               ALTER COLUMN id SET DEFAULT nextval('bench_commands_id_seq');
+            """
+        )
+        try:
+            for name, insert in (("jsonb_to_recordset", jsonb), ("COPY", copy)):
+                await con.execute("TRUNCATE bench_commands;")
+                start = time.perf_counter()
+                for index in range(0, len(records), batch_size):
+                    await insert(con, records[index : index + batch_size])
+                results[name] = time.perf_counter() - start
+        finally:
+            await con.execute("DROP TABLE bench_commands;")
+
+    return results
+
+
+@db.command(name="bench-ingest", short_help="benchmarks command usage ingestion")
+@click.option("-n", "--rows", default=50_000, help="how many commands to insert")
+@click.option("-b", "--batch", default=500, help="commands per insert")
+def bench_ingest(rows, batch):
+    """Compares the old jsonb_to_recordset insert of commands with COPY.
+
+    This inserts into a temporary copy of the commands table.
+    """
+    from cogs.stats import CommandRecord
+
+    run = asyncio.get_event_loop().run_until_complete
+    try:
+        pool = run(Table.create_pool(config.postgresql))
+    except Exception:
+        click.echo(
+            f"Could not create PostgreSQL connection pool.\n{traceback.format_exc()}",
+            err=True,
+        )
+        return
+
+    now = datetime.datetime.utcnow()
+    records = [
+        CommandRecord(
+            index % 100 or None,
+            index % 1000,
+            index % 5000,
+            now - datetime.timedelta(seconds=index),
+            "a!",
+            f"command{index % 50}",
+            index % 10 == 0,
+        )
+        for index in range(rows)
+    ]
+    try:
+        results = run(bench_ingestion(pool, records, batch))
+    finally:
+        run(pool.close())
+
+    baseline = results["jsonb_to_recordset"]
+    for name, elapsed in results.items():
+        click.echo(
+            f"{name:<20} {elapsed:.2f}s {rows / elapsed:,.0f} rows/s "
+            f"({baseline / elapsed:.2f}x)"
+        )
+
+
 @db.command(short_help="upgrades from a migration")
 @click.argument("cog", nargs=1, metavar="[cog]")
 @click.option("-q", "--quiet", help="less verbose output", is_flag=True)
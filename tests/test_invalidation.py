@@ -0,0 +1,115 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Runs two invalidation buses with their own pools against one PostgreSQL,
+# the way two processes sharing a database would. Both live in this process
+# and share its caches, so the receiving side re-fetches what it is told
+# about straight away, like a busy process would. Set AKANE_TEST_DSN to a
+# database it may create the command_config table in to run it.
+
+import asyncio
+import os
+import types
+import unittest
+
+from cogs.config import CommandConfig, Config
+from utils import cache
+from utils.db import Table
+from utils.invalidation import InvalidationBus
+
+DSN = os.environ.get("AKANE_TEST_DSN")
+
+GUILD_ID = 1
+CHANNEL_ID = 2
+COMMAND = "invalidation-test"
+
+
+class ReloadingBus(InvalidationBus):
+    """Calls ``reload`` after applying every invalidation it receives."""
+
+    def __init__(self, pool, **kwargs):
+        super().__init__(pool, **kwargs)
+        self.reload = None
+        self.reloaded = asyncio.Queue()
+
+    def _on_notification(self, connection, pid, channel, payload):
+        super()._on_notification(connection, pid, channel, payload)
+        if self.reload is not None:
+            task = asyncio.ensure_future(self.reload())
+            task.add_done_callback(lambda t: self.reloaded.put_nowait(t.result()))
+
+
+@unittest.skipUnless(DSN, "AKANE_TEST_DSN is not set")
+class InvalidationBusTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.first = await Table.create_pool(DSN, min_size=1, max_size=2)
+        self.second = await Table.create_pool(DSN, min_size=1, max_size=2)
+        await self.first.execute(CommandConfig.create_table())
+        await self.first.execute(
+            "DELETE FROM command_config WHERE guild_id=$1;", GUILD_ID
+        )
+
+        channel = f"akane_test_{os.getpid()}"
+        self.publisher = InvalidationBus(self.first, channel=channel)
+        self.receiver = ReloadingBus(self.second, channel=channel)
+        await self.publisher.start()
+        await self.receiver.start()
+        # otherwise both would publish every invalidation
+        cache.remove_invalidation_listener(self.receiver.publish)
+
+        self.applied = asyncio.get_running_loop().create_future()
+
+        def invalidator(kind, part):
+            if kind != "all" and not self.applied.done():
+                self.applied.set_result((kind, part))
+
+        cache.register_invalidator("test.config", invalidator)
+
+    async def asyncTearDown(self):
+        cache.unregister_invalidator("test.config")
+        self.receiver.reload = None
+        await self.receiver.close()
+        await self.publisher.close()
+        await self.first.execute(
+            "DELETE FROM command_config WHERE guild_id=$1;", GUILD_ID
+        )
+        await self.first.close()
+        await self.second.close()
+
+    async def test_other_pool_receives(self):
+        cache.notify_invalidation("test.config", "key", ["test.config", 1])
+        kind, part = await asyncio.wait_for(self.applied, timeout=5.0)
+
+        self.assertEqual(kind, "key")
+        self.assertEqual(part, ["test.config", 1])
+        self.assertEqual(self.receiver.received, 1)
+        # a process ignores its own invalidations
+        self.assertEqual(self.publisher.received, 0)
+
+    async def test_config_write_reaches_other_pool(self):
+        # the cog reads through the second pool, writes go through the first
+        cog = Config(types.SimpleNamespace(pool=self.second))
+        self.receiver.reload = lambda: cog.get_command_permissions(GUILD_ID)
+
+        before = await cog.get_command_permissions(GUILD_ID)
+        self.assertFalse(before.is_command_blocked(COMMAND, CHANNEL_ID))
+
+        async with self.first.acquire() as connection:
+            await cog.command_toggle(
+                connection, GUILD_ID, None, COMMAND, whitelist=False
+            )
+
+        # re-fetched as soon as the invalidation arrived, so it would be
+        # stale if that happened before the transaction committed
+        reloaded = await asyncio.wait_for(self.receiver.reloaded.get(), timeout=5.0)
+        self.assertTrue(reloaded.is_command_blocked(COMMAND, CHANNEL_ID))
+
+        cached = await cog.get_command_permissions(GUILD_ID)
+        self.assertTrue(cached.is_command_blocked(COMMAND, CHANNEL_ID))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Which extensions find_command_stubs lets the bot load lazily. Only the
+# source is parsed, so none of the extensions' dependencies are needed.
+
+import os
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from utils.lazy import CommandStub, find_command_stubs
+
+COG = """
+from discord.ext import commands
+
+class Example(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+{body}
+    @commands.command(aliases=["ex"])
+    async def example(self, ctx):
+        pass
+
+def setup(bot):
+{setup}
+    bot.add_cog(Example(bot))
+"""
+
+
+class FindCommandStubsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        sys.path.insert(0, self.directory.name)
+        self.count = 0
+
+    def tearDown(self):
+        sys.path.remove(self.directory.name)
+        self.directory.cleanup()
+
+    def stubs(self, body="", setup=""):
+        self.count += 1
+        name = f"lazy_example_{self.count}"
+        source = COG.format(
+            body=textwrap.indent(textwrap.dedent(body), "    "),
+            setup=textwrap.indent(textwrap.dedent(setup), "    "),
+        )
+        with open(os.path.join(self.directory.name, f"{name}.py"), "w") as fp:
+            fp.write(source)
+        return find_command_stubs(name)
+
+    def test_commands_only(self):
+        self.assertEqual(self.stubs(), [CommandStub("example", ["ex"])])
+
+    def test_listener(self):
+        body = """
+        @commands.Cog.listener()
+        async def on_message(self, message):
+            pass
+        """
+        self.assertIsNone(self.stubs(body))
+
+    def test_global_checks(self):
+        for hook in ("bot_check", "bot_check_once"):
+            with self.subTest(hook=hook):
+                body = f"""
+                async def {hook}(self, ctx):
+                    return True
+                """
+                self.assertIsNone(self.stubs(body))
+
+    def test_bot_hooks(self):
+        for setup in (
+            "bot.add_check(lambda ctx: True)",
+            "bot.before_invoke(None)",
+            "bot.help_command = None",
+        ):
+            with self.subTest(setup=setup):
+                self.assertIsNone(self.stubs(setup=setup))
+
+    def test_command_hooks_stay_lazy(self):
+        body = """
+        @commands.command()
+        async def other(self, ctx):
+            pass
+
+        @other.before_invoke
+        async def before_other(self, ctx):
+            pass
+
+        async def cog_command_error(self, ctx, error):
+            pass
+        """
+        stubs = self.stubs(body)
+        self.assertEqual([stub.name for stub in stubs], ["other", "example"])
+
+    def test_config_is_loaded_eagerly(self):
+        # it holds the blacklist, plonks and command permissions
+        self.assertIsNone(find_command_stubs("cogs.config"))
+
+
+if __name__ == "__main__":
+    unittest.main()
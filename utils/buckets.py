@@ -0,0 +1,152 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# A leaner replacement for CooldownMapping in the spam checks. Buckets are
+# small __slots__ records and idle ones are swept every so often, rather than
+# scanning the whole mapping on every lookup or never at all.
+
+from __future__ import annotations
+
+import sys
+from typing import Dict, Hashable, List, Optional
+
+__all__ = ("TokenBuckets",)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "window", "last", "strikes")
+
+    def __init__(self, tokens: int) -> None:
+        self.tokens = tokens
+        self.window = 0.0
+        self.last = 0.0
+        self.strikes = 0
+
+
+class TokenBuckets:
+    """Rate limits keys to ``rate`` uses every ``per`` seconds.
+
+    This behaves like :class:`discord.ext.commands.Cooldown`, one per key.
+
+    Parameters
+    -----------
+    rate: int
+        How many uses are allowed per window.
+    per: float
+        How long a window lasts, in seconds.
+    strike_ttl: float
+        How long an idle bucket with strikes is kept around.
+    sweep_every: float
+        How often idle buckets are removed, in seconds.
+    """
+
+    __slots__ = (
+        "rate",
+        "per",
+        "strike_ttl",
+        "sweep_every",
+        "swept",
+        "_buckets",
+        "_next_sweep",
+    )
+
+    def __init__(
+        self,
+        rate: int,
+        per: float,
+        *,
+        strike_ttl: float = 3600.0,
+        sweep_every: float = 60.0,
+    ) -> None:
+        self.rate = rate
+        self.per = per
+        self.strike_ttl = strike_ttl
+        self.sweep_every = sweep_every
+        self.swept = 0
+        self._buckets: Dict[Hashable, _Bucket] = {}
+        self._next_sweep = 0.0
+
+    def __repr__(self) -> str:
+        return f"<TokenBuckets rate={self.rate} per={self.per} size={len(self)}>"
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def update_rate_limit(self, key: Hashable, current: float) -> Optional[float]:
+        """Uses a token, returning how long to wait if there were none left."""
+        if current >= self._next_sweep:
+            self.sweep(current)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.rate)
+
+        tokens = bucket.tokens
+        if current > bucket.window + self.per:
+            tokens = self.rate
+
+        bucket.last = current
+
+        # first token used means that we start a new rate limit window
+        if tokens == self.rate:
+            bucket.window = current
+
+        if tokens == 0:
+            bucket.tokens = 0
+            return self.per - (current - bucket.window)
+
+        tokens -= 1
+        # rate limited by this use, so the window restarts now
+        if tokens == 0:
+            bucket.window = current
+        bucket.tokens = tokens
+        return None
+
+    def strike(self, key: Hashable) -> int:
+        """Adds a strike to an existing bucket and returns how many it has."""
+        bucket = self._buckets[key]
+        bucket.strikes += 1
+        return bucket.strikes
+
+    def clear_strikes(self, key: Hashable) -> None:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.strikes = 0
+
+    def limited(self, current: float) -> List[Hashable]:
+        """Returns the keys that are currently out of tokens."""
+        return [
+            key
+            for key, bucket in self._buckets.items()
+            if bucket.tokens == 0 and current <= bucket.window + self.per
+        ]
+
+    def sweep(self, current: float) -> int:
+        """Removes the buckets that have been idle for a whole window.
+
+        Buckets with strikes are kept for ``strike_ttl`` instead.
+        """
+        self._next_sweep = current + self.sweep_every
+        per, strike_ttl = self.per, self.strike_ttl
+        dead = [
+            key
+            for key, bucket in self._buckets.items()
+            if current - bucket.last > (strike_ttl if bucket.strikes else per)
+        ]
+        for key in dead:
+            del self._buckets[key]
+
+        self.swept += len(dead)
+        return len(dead)
+
+    def memory_usage(self) -> int:
+        """Roughly how many bytes the buckets and their keys take up."""
+        size = sys.getsizeof(self._buckets)
+        for key, bucket in self._buckets.items():
+            size += sys.getsizeof(key) + sys.getsizeof(bucket)
+            if isinstance(key, tuple):
+                size += sum(sys.getsizeof(part) for part in key)
+        return size
@@ -0,0 +1,125 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Cogs batch up writes and flush them on a timer. The batches live here on the
+# bot instead of on the cog, so reloading a cog doesn't throw them away, and
+# on shutdown every registered flush gets a last chance to run before the
+# connection pool goes away.
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Generic, Set, TypeVar
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+__all__ = ("Buffer", "BufferRegistry")
+
+
+class Buffer(Generic[T]):
+    """Batched data and the lock guarding it."""
+
+    __slots__ = ("name", "data", "lock")
+
+    def __init__(self, name: str, data: T, *, loop: asyncio.AbstractEventLoop):
+        self.name = name
+        self.data = data
+        self.lock = asyncio.Lock(loop=loop)
+
+    def __repr__(self) -> str:
+        return f"<Buffer name={self.name!r} size={len(self)}>"
+
+    def __len__(self) -> int:
+        try:
+            return len(self.data)  # type: ignore
+        except TypeError:
+            return 0
+
+
+class BufferRegistry:
+    """Keeps the buffers and how to flush them.
+
+    Parameters
+    -----------
+    loop: asyncio.AbstractEventLoop
+        The loop the flushes run on.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self._buffers: Dict[str, Buffer] = {}
+        self._flushers: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        # final flushes of unregistered buffers
+        self._pending: Set[asyncio.Task] = set()
+
+    def __repr__(self) -> str:
+        return f"<BufferRegistry buffers={len(self._buffers)} flushers={len(self._flushers)}>"
+
+    def __iter__(self):
+        return iter(self._buffers.values())
+
+    def get(self, name: str, factory: Callable[[], T]) -> Buffer[T]:
+        """Returns the buffer with this name, creating it if it doesn't exist.
+
+        A reloaded cog gets back whatever its previous instance left behind.
+        """
+        try:
+            return self._buffers[name]
+        except KeyError:
+            buffer = self._buffers[name] = Buffer(name, factory(), loop=self.loop)
+            return buffer
+
+    def register(self, name: str, flush: Callable[[], Awaitable[Any]]) -> None:
+        """Sets the coroutine function that writes out the named buffer.
+
+        It has to take the buffer's lock itself.
+        """
+        self._flushers[name] = flush
+
+    def unregister(self, name: str) -> None:
+        """Removes a flush, running it once more in the background."""
+        flush = self._flushers.pop(name, None)
+        if flush is None:
+            return
+
+        task = self.loop.create_task(self._run(name, flush))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _run(self, name: str, flush: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            await flush()
+        except Exception:
+            log.exception("Flushing the %s buffer failed.", name)
+
+    async def drain(self, timeout: float) -> bool:
+        """Flushes every buffer, giving up after ``timeout`` seconds.
+
+        Returns whether everything finished in time.
+        """
+        tasks = {
+            self.loop.create_task(self._run(name, flush)): name
+            for name, flush in self._flushers.items()
+        }
+        waiting = set(tasks) | self._pending
+        if not waiting:
+            return True
+
+        _, pending = await asyncio.wait(waiting, timeout=timeout)
+        if not pending:
+            return True
+
+        for task in pending:
+            task.cancel()
+
+        names = sorted(tasks.get(task, "an unloaded cog") for task in pending)
+        log.warning(
+            "Gave up flushing buffers after %.1fs: %s", timeout, ", ".join(names)
+        )
+        return False
@@ -7,18 +7,93 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 import asyncio
 import enum
 import inspect
+import logging
 import time
+from collections import deque
 from functools import wraps
-from typing import Any, Dict, Tuple
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from lru import LRU
 
+log = logging.getLogger(__name__)
 
-def _wrap_and_store_coroutine(cache, key, coro):
+
+def _wrap_and_store_coroutine(store, pending, key, coro, stats, retry=None):
     async def func():
-        value = await coro
-        cache[key] = value
-        return value
+        # the future is only registered once we actually run, a coroutine
+        # that is never awaited would keep everyone else waiting otherwise.
+        # several calls can be created before any of them runs, as with
+        # gather, so the later ones still wait on whoever started first
+        existing = pending.get(key)
+        if existing is not None and not existing.done():
+            coro.close()
+            # a background refresh, the running call stores a fresh value
+            if retry is None:
+                return None
+            stats.coalesced += 1
+            return await _wait_for_pending(existing, retry)
+
+        future = asyncio.get_event_loop().create_future()
+        pending[key] = future
+        start = time.perf_counter()
+        try:
+            value = await coro
+        except Exception as exc:
+            future.set_exception(exc)
+            # mark it as retrieved, there may have been nobody else waiting
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            stats.add_latency(time.perf_counter() - start)
+            # if we were invalidated mid-flight then the value may be stale
+            if pending.get(key) is future:
+                store(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            if pending.get(key) is future:
+                del pending[key]
+
+    return func()
+
+
+# keeps strong references to the background refreshes of soft_ttl caches
+_background_refreshes: Set[asyncio.Task] = set()
+
+
+def _refresh_done(task: asyncio.Task) -> None:
+    _background_refreshes.discard(task)
+    if task.cancelled():
+        return
+
+    exc = task.exception()
+    if exc is not None:
+        log.error("Background cache refresh failed.", exc_info=exc)
+
+
+def _wait_for_pending(future, retry):
+    async def func():
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # the caller that was doing the actual work got cancelled, not us
+            if future.cancelled():
+                return await retry()
+            raise
 
     return func()
 
@@ -30,19 +105,91 @@ def _wrap_new_coroutine(value):
     return new_coroutine()
 
 
+_SIMPLE_KEY_TYPES = frozenset((int, str, float, bool, type(None)))
+
+
+class _Unindexed(str):
+    """A key part that invalidate_containing can't match, and isn't indexed."""
+
+    __slots__ = ()
+
+
+def _key_part(o: Any) -> Hashable:
+    # tagged with the type so True, 1 and 1.0 stay different keys
+    if type(o) in _SIMPLE_KEY_TYPES:
+        return (type(o).__name__, o)
+
+    # we do care what 'self' parameter is when we __repr__ it
+    # so anything with the default repr is keyed by its type
+    cls = o.__class__
+    if cls.__repr__ is object.__repr__:
+        return _Unindexed(f"<{cls.__module__}.{cls.__name__}>")
+    return repr(o)
+
+
+def _index_parts(key: Tuple[Any, ...]) -> Iterator[Hashable]:
+    # the first part is the function's name
+    for part in key[1:]:
+        if not isinstance(part, _Unindexed):
+            yield part
+
+
+def _thaw(part: Any) -> Any:
+    """Turns the lists JSON made out of key parts back into tuples."""
+    if isinstance(part, list):
+        return tuple(_thaw(p) for p in part)
+    return part
+
+
 class ExpiringCache(dict):
-    def __init__(self, seconds: float):
+    """A dict whose entries expire ``seconds`` after they were last set.
+
+    Since every entry shares the same TTL, the order entries were set in is
+    also the order they expire in. That order is kept in a deque so expiry
+    only ever looks at the front of it, rather than scanning every entry.
+
+    If ``maxsize`` is given, the oldest entries are evicted once it is exceeded.
+    ``callback`` is called with the key and value of every entry that expires
+    or gets evicted, the same as :class:`lru.LRU` does.
+    """
+
+    def __init__(
+        self,
+        seconds: float,
+        maxsize: Optional[int] = None,
+        *,
+        callback: Optional[Callable[[Any, Any], None]] = None,
+    ):
         self.__ttl = seconds
+        self.__maxsize = maxsize
+        self.__callback = callback
+        self.__order: Deque[Tuple[float, Any]] = deque()
         super().__init__()
 
-    def __verify_cache_integrity(self):
-        # Have to do this in two steps...
-        current_time = time.monotonic()
-        to_remove = [
-            k for (k, (v, t)) in self.items() if current_time > (t + self.__ttl)
-        ]
-        for k in to_remove:
-            del self[k]
+    def __pop_front(self) -> None:
+        timestamp, key = self.__order.popleft()
+        try:
+            (value, current) = super().__getitem__(key)
+        except KeyError:
+            return
+
+        # the key was set again after this entry was queued, so it's stale
+        if current == timestamp:
+            super().__delitem__(key)
+            if self.__callback is not None:
+                self.__callback(key, value)
+
+    def __verify_cache_integrity(self) -> None:
+        cutoff = time.monotonic() - self.__ttl
+        order = self.__order
+        while order and order[0][0] < cutoff:
+            self.__pop_front()
+
+    def __compact(self) -> None:
+        # re-setting keys leaves stale entries behind in the deque
+        # so every now and again we rebuild it from the live entries
+        live = sorted(((t, k) for (k, (_, t)) in self.items()), key=lambda e: e[0])
+        self.__order = deque(live)
 
     def __contains__(self, key: Any) -> bool:
         self.__verify_cache_integrity()
@@ -50,47 +197,307 @@ class ExpiringCache(dict):
 
     def __getitem__(self, key: Any) -> Any:
         self.__verify_cache_integrity()
-        return super().__getitem__(key)
+        return super().__getitem__(key)[0]
 
     def __setitem__(self, key: Any, value: Any) -> None:
-        super().__setitem__(key, (value, time.monotonic()))
+        now = time.monotonic()
+        super().__setitem__(key, (value, now))
+        self.__order.append((now, key))
+        self.__verify_cache_integrity()
+
+        if self.__maxsize is not None:
+            while len(self) > self.__maxsize:
+                self.__pop_front()
+
+        if len(self.__order) > 2 * len(self) + 16:
+            self.__compact()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self) -> None:
+        super().clear()
+        self.__order.clear()
+
+
+class ExpiringLRU:
+    """An LRU mapping whose entries also expire after a given number of seconds.
+
+    The size bound is enforced by :class:`lru.LRU` and expiry is checked lazily
+    when an entry is looked up, so entries can have their own TTL via :meth:`set`.
+    ``callback`` is called with the key and value of every entry that expires
+    or gets evicted.
+    """
+
+    __slots__ = ("ttl", "_lru", "_callback")
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        *,
+        callback: Optional[Callable[[Any, Any], None]] = None,
+    ):
+        self.ttl = ttl
+        self._callback = callback
+        if callback is None:
+            self._lru = LRU(maxsize)
+        else:
+            self._lru = LRU(maxsize, callback=lambda k, v: callback(k, v[0]))
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def __iter__(self):
+        return iter(self._lru.keys())
+
+    def __contains__(self, key: Any) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key: Any) -> Tuple[Any, float]:
+        """Returns the value for ``key`` along with how many seconds ago it was set."""
+        value, stored, expires = self._lru[key]
+        now = time.monotonic()
+        if now > expires:
+            del self._lru[key]
+            if self._callback is not None:
+                self._callback(key, value)
+            raise KeyError(key)
+        return value, now - stored
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.set(key, value)
+
+    def __delitem__(self, key: Any) -> None:
+        del self._lru[key]
+
+    def set(self, key: Any, value: Any, *, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        self._lru[key] = (value, now, now + ttl)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> List[Any]:
+        return self._lru.keys()
+
+    def clear(self) -> None:
+        self._lru.clear()
 
 
 class Strategy(enum.Enum):
     lru = 1
     raw = 2
     timed = 3
+    lru_ttl = 4
+
+
+class CacheStats:
+    """Runtime statistics of a single function wrapped by :func:`cache`.
+
+    Every wrapped function registers one of these, see :func:`all_stats`.
+    """
+
+    __slots__ = (
+        "name",
+        "strategy",
+        "hits",
+        "misses",
+        "coalesced",
+        "evictions",
+        "refreshes",
+        "_cache",
+        "_pending",
+        "_latencies",
+    )
+
+    def __init__(self, name: str, strategy: Strategy, cache: Any, pending: Dict):
+        self.name = name
+        self.strategy = strategy
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self._cache = cache
+        self._pending = pending
+        # only the most recent loads, this is a rough picture after all
+        self._latencies: Deque[float] = deque(maxlen=1024)
+
+    def __repr__(self) -> str:
+        return (
+            f"<CacheStats name={self.name!r} size={self.size} hits={self.hits} "
+            f"misses={self.misses} evictions={self.evictions}>"
+        )
+
+    @property
+    def size(self) -> int:
+        return len(self._cache)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def add_latency(self, seconds: float) -> None:
+        self._latencies.append(seconds)
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """The given percentile of recent miss-load times, in seconds."""
+        if not self._latencies:
+            return None
+
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+
+# qualified function name: CacheStats
+_registry: Dict[str, CacheStats] = {}
+
+
+def all_stats() -> List[CacheStats]:
+    """Returns the statistics of every function wrapped by :func:`cache`."""
+    return list(_registry.values())
+
+
+# qualified function name: callable applying an invalidation locally
+_invalidators: Dict[str, Callable[[str, Any], None]] = {}
+
+# callables run with (qualified function name, kind, part) whenever
+# one of our cached functions is explicitly invalidated
+_invalidation_listeners: List[Callable[[str, str, Any], None]] = []
+
+
+def add_invalidation_listener(listener: Callable[[str, str, Any], None]) -> None:
+    """Registers a callable to be told about every explicit invalidation.
+
+    It is called with the qualified name of the cached function, the kind of
+    invalidation (``"key"`` or ``"containing"``) and the key or argument.
+    """
+    _invalidation_listeners.append(listener)
+
+
+def remove_invalidation_listener(listener: Callable[[str, str, Any], None]) -> None:
+    try:
+        _invalidation_listeners.remove(listener)
+    except ValueError:
+        pass
+
+
+def notify_invalidation(name: str, kind: str, part: Any) -> None:
+    """Tells every invalidation listener about an invalidation of ``name``."""
+    for listener in _invalidation_listeners:
+        try:
+            listener(name, kind, part)
+        except Exception:
+            log.exception("Invalidation listener %r failed for %s.", listener, name)
+
+
+def register_invalidator(name: str, invalidator: Callable[[str, Any], None]) -> None:
+    """Registers something other than a cached function to receive invalidations.
+
+    ``invalidator`` is called with the kind and part given to
+    :func:`apply_invalidation`, and with ``("all", None)`` by :func:`clear_all`.
+    """
+    _invalidators[name] = invalidator
+
+
+def unregister_invalidator(name: str) -> None:
+    """Removes an invalidator added with :func:`register_invalidator`."""
+    _invalidators.pop(name, None)
+
+
+def apply_invalidation(name: str, kind: str, part: Any) -> bool:
+    """Applies an invalidation that happened elsewhere, without notifying listeners.
+
+    ``kind`` is one of ``"key"``, ``"containing"`` or ``"all"``.
+    Returns ``False`` if no cached function has the given name.
+    """
+    try:
+        invalidator = _invalidators[name]
+    except KeyError:
+        return False
+
+    invalidator(kind, part)
+    return True
+
+
+def clear_all() -> None:
+    """Empties every cache, without notifying listeners."""
+    for invalidator in _invalidators.values():
+        invalidator("all", None)
 
 
 def cache(
-    maxsize: int = 128, strategy: Strategy = Strategy.lru, ignore_kwargs: bool = False
+    maxsize: int = 128,
+    strategy: Strategy = Strategy.lru,
+    ignore_kwargs: bool = False,
+    *,
+    ttl: Optional[float] = None,
+    negative_ttl: Optional[float] = None,
+    soft_ttl: Optional[float] = None,
 ):
-    def decorator(func):
-        if strategy is Strategy.lru:
-            _internal_cache = LRU(maxsize)
-            _stats = _internal_cache.get_stats
-        elif strategy is Strategy.raw:
-            _internal_cache = {}
+    """Caches the results of the decorated function, keyed by its arguments.
 
-            def _stats():
-                return (0, 0)
+    ``maxsize`` is the number of entries for :attr:`Strategy.lru` and
+    :attr:`Strategy.lru_ttl`, and the number of seconds entries live for
+    with :attr:`Strategy.timed`.
 
-        elif strategy is Strategy.timed:
-            _internal_cache = ExpiringCache(maxsize)
+    :attr:`Strategy.lru_ttl` also expires entries ``ttl`` seconds after they were
+    stored. ``None`` results are not cached with it unless ``negative_ttl`` is
+    given, in which case they are cached for that many seconds instead.
+
+    Coroutine functions using :attr:`Strategy.lru_ttl` can also give a
+    ``soft_ttl``. Entries older than that are still returned straight away, but
+    a single refresh is started in the background. Only entries past ``ttl``
+    make callers wait on a fresh call.
+    """
+    if strategy is Strategy.lru_ttl and ttl is None:
+        raise TypeError("Strategy.lru_ttl requires a ttl.")
+
+    if negative_ttl is not None and strategy is not Strategy.lru_ttl:
+        raise TypeError("negative_ttl is only supported by Strategy.lru_ttl.")
 
-            def _stats():
-                return (0, 0)
+    if soft_ttl is not None:
+        if strategy is not Strategy.lru_ttl:
+            raise TypeError("soft_ttl is only supported by Strategy.lru_ttl.")
+        if soft_ttl >= ttl:
+            raise ValueError("soft_ttl must be lower than ttl.")
 
-        def _make_key(args: Tuple[Any, ...], kwargs: Dict[Any, Any]) -> str:
-            # this is a bit of a cluster fuck
-            # we do care what 'self' parameter is when we __repr__ it
-            def _true_repr(o):
-                if o.__class__.__repr__ is object.__repr__:
-                    return f"<{o.__class__.__module__}.{o.__class__.__name__}>"
-                return repr(o)
+    def decorator(func):
+        if soft_ttl is not None and not asyncio.iscoroutinefunction(func):
+            raise TypeError("soft_ttl requires a coroutine function.")
+
+        # key: Future of the in-flight call for that key
+        _pending: Dict[Tuple[Any, ...], asyncio.Future] = {}
+        # keys with a background refresh scheduled or running
+        _refreshing: Set[Tuple[Any, ...]] = set()
 
-            key = [f"{func.__module__}.{func.__name__}"]
-            key.extend(_true_repr(o) for o in args)
+        # part: keys containing that part
+        # this lets us invalidate by argument without scanning every key
+        _index: Dict[Hashable, Set[Tuple[Any, ...]]] = {}
+
+        def _make_key(args: Tuple[Any, ...], kwargs: Dict[Any, Any]) -> Tuple[Any, ...]:
+            key = (name, *(_key_part(o) for o in args))
             if not ignore_kwargs:
                 for k, v in kwargs.items():
                     # note: this only really works for this use case in particular
@@ -100,53 +507,175 @@ def cache(
                     if k == "connection":
                         continue
 
-                    key.append(_true_repr(k))
-                    key.append(_true_repr(v))
+                    key += (_Unindexed(k), _key_part(v))
+
+            return key
+
+        def _store(key: Tuple[Any, ...], value: Any) -> None:
+            if strategy is Strategy.lru_ttl and value is None:
+                if negative_ttl is None:
+                    return
+                _internal_cache.set(key, value, ttl=negative_ttl)
+            else:
+                _internal_cache[key] = value
+
+            for part in _index_parts(key):
+                _index.setdefault(part, set()).add(key)
 
-            return ":".join(key)
+        def _evicted(key: Tuple[Any, ...], _value: Any) -> None:
+            _stats.evictions += 1
+            _unindex(key)
+
+        def _unindex(key: Tuple[Any, ...]) -> None:
+            for part in _index_parts(key):
+                keys = _index.get(part)
+                if keys is None:
+                    continue
+                keys.discard(key)
+                if not keys:
+                    del _index[part]
+
+        if strategy is Strategy.lru:
+            _internal_cache = LRU(maxsize, callback=_evicted)
+        elif strategy is Strategy.raw:
+            _internal_cache = {}
+        elif strategy is Strategy.timed:
+            _internal_cache = ExpiringCache(maxsize, callback=_evicted)
+        elif strategy is Strategy.lru_ttl:
+            _internal_cache = ExpiringLRU(maxsize, ttl, callback=_evicted)
+
+        name = f"{func.__module__}.{func.__qualname__}"
+        _stats = CacheStats(name, strategy, _internal_cache, _pending)
+        # reloading an extension replaces the old entry
+        _registry[name] = _stats
+
+        def _refresh(key: Tuple[Any, ...], args, kwargs) -> None:
+            # the caller's connection will probably be released long
+            # before we're done, so let the function use the pool instead
+            kwargs = {k: v for k, v in kwargs.items() if k != "connection"}
+            coro = func(*args, **kwargs)
+            _stats.refreshes += 1
+            task = asyncio.ensure_future(
+                _wrap_and_store_coroutine(_store, _pending, key, coro, _stats)
+            )
+            _background_refreshes.add(task)
+            _refreshing.add(key)
+            task.add_done_callback(_refresh_done)
+            task.add_done_callback(lambda _: _refreshing.discard(key))
 
         @wraps(func)
         def wrapper(*args, **kwargs) -> Any:
             key = _make_key(args, kwargs)
             try:
-                value = _internal_cache[key]
+                if soft_ttl is None:
+                    value = _internal_cache[key]
+                else:
+                    value, age = _internal_cache.get_entry(key)
+                    if (
+                        age > soft_ttl
+                        and key not in _pending
+                        and key not in _refreshing
+                    ):
+                        _refresh(key, args, kwargs)
             except KeyError:
+                _stats.misses += 1
+                # someone is already fetching this, so share their result
+                future = _pending.get(key)
+                if future is not None:
+                    _stats.coalesced += 1
+                    return _wait_for_pending(future, lambda: wrapper(*args, **kwargs))
+
+                start = time.perf_counter()
                 value = func(*args, **kwargs)
 
                 if inspect.isawaitable(value):
-                    return _wrap_and_store_coroutine(_internal_cache, key, value)
-
-                _internal_cache[key] = value
+                    return _wrap_and_store_coroutine(
+                        _store,
+                        _pending,
+                        key,
+                        value,
+                        _stats,
+                        lambda: wrapper(*args, **kwargs),
+                    )
+
+                _stats.add_latency(time.perf_counter() - start)
+                _store(key, value)
                 return value
             else:
+                _stats.hits += 1
                 if asyncio.iscoroutinefunction(func):
                     return _wrap_new_coroutine(value)
                 return value
 
-        def _invalidate(*args, **kwargs) -> bool:
+        def _drop_key(key: Tuple[Any, ...]) -> bool:
+            _pending.pop(key, None)
             try:
-                del _internal_cache[_make_key(args, kwargs)]
+                del _internal_cache[key]
             except KeyError:
                 return False
             else:
+                _unindex(key)
                 return True
 
-        def _invalidate_containing(key) -> None:
-            to_remove = []
-            for k in _internal_cache.keys():
-                if key in k:
-                    to_remove.append(k)
-            for k in to_remove:
+        def _drop_containing(part: Hashable) -> None:
+            for k in [k for k in _pending if part in k]:
+                del _pending[k]
+
+            for k in _index.pop(part, ()):
                 try:
                     del _internal_cache[k]
                 except KeyError:
                     continue
+                else:
+                    _unindex(k)
+
+        def _apply_invalidation(kind: str, part: Any) -> None:
+            if kind == "key":
+                _drop_key(_thaw(part))
+            elif kind == "containing":
+                _drop_containing(_thaw(part))
+            elif kind == "all":
+                _pending.clear()
+                _internal_cache.clear()
+                _index.clear()
+
+        def _invalidate(*args, **kwargs) -> bool:
+            key = _make_key(args, kwargs)
+            notify_invalidation(name, "key", key)
+            return _drop_key(key)
+
+        def _invalidate_containing(part: Any) -> None:
+            """Invalidates every entry that was called with ``part`` as an argument.
+
+            This compares whole arguments, ``invalidate_containing(1)`` doesn't
+            match a call with ``12``. Arguments keyed by their type because
+            they have the default repr, such as ``self``, never match.
+            """
+            part = _key_part(part)
+            notify_invalidation(name, "containing", part)
+            _drop_containing(part)
+
+        def _prime(*args, value: Any, **kwargs) -> bool:
+            """Stores ``value`` as the result of calling with these arguments.
+
+            Entries that are already cached or being fetched are left alone.
+            """
+            key = _make_key(args, kwargs)
+            if key in _pending or key in _internal_cache:
+                return False
+
+            _store(key, value)
+            return True
+
+        _invalidators[name] = _apply_invalidation
 
         wrapper.cache = _internal_cache
         wrapper.get_key = lambda *args, **kwargs: _make_key(args, kwargs)
         wrapper.invalidate = _invalidate
-        wrapper.get_stats = _stats
+        wrapper.get_stats = lambda: (_stats.hits, _stats.misses)
+        wrapper.stats = _stats
         wrapper.invalidate_containing = _invalidate_containing
+        wrapper.prime = _prime
         return wrapper
 
     return decorator
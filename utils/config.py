@@ -0,0 +1,309 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# A small key-value store for bot-wide settings (prefixes, the blacklist).
+# Everything lives in an in-memory dict so reads are plain dict lookups,
+# writes are coalesced and flushed to the backend in the background.
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from utils import cache, db
+
+log = logging.getLogger(__name__)
+
+
+class ConfigStore(db.Table, table_name="config_store"):
+    namespace = db.Column(db.String, primary_key=True)
+    key = db.Column(db.String, primary_key=True)
+    value = db.Column(db.JSON, default="'null'::jsonb", nullable=False)
+
+
+class JSONBackend:
+    """Stores the whole config in a JSON file, replaced atomically on every flush."""
+
+    # whether other processes can see what we write
+    shared = False
+
+    def __init__(self, name: str, *, object_hook=None, encoder=None) -> None:
+        self.name = name
+        self.object_hook = object_hook
+        self.encoder = encoder
+
+    def __repr__(self) -> str:
+        return f"<JSONBackend name={self.name!r}>"
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.name, "r", encoding="utf-8") as fp:
+                return json.load(fp, object_hook=self.object_hook)
+        except FileNotFoundError:
+            return {}
+
+    def _dump(self, data: Dict[str, Any]) -> None:
+        temp = "%s-%s.tmp" % (uuid.uuid4(), self.name)
+        with open(temp, "w", encoding="utf-8") as tmp:
+            json.dump(
+                data, tmp, ensure_ascii=True, cls=self.encoder, separators=(",", ":")
+            )
+
+        # atomically move the file
+        os.replace(temp, self.name)
+
+    async def load(self) -> Dict[str, Any]:
+        return await asyncio.get_event_loop().run_in_executor(None, self._load)
+
+    async def write(
+        self, snapshot: Dict[str, Any], changed: Set[str], removed: Set[str]
+    ) -> None:
+        await asyncio.get_event_loop().run_in_executor(None, self._dump, snapshot)
+
+
+class PostgresBackend:
+    """Stores the config as rows of the ``config_store`` table.
+
+    Only the keys that changed since the last flush are written.
+    """
+
+    shared = True
+
+    def __init__(self, namespace: str) -> None:
+        self.namespace = namespace
+
+    def __repr__(self) -> str:
+        return f"<PostgresBackend namespace={self.namespace!r}>"
+
+    async def load(self) -> Dict[str, Any]:
+        query = "SELECT key, value FROM config_store WHERE namespace=$1;"
+        async with ConfigStore.acquire_connection(None) as con:
+            records = await con.fetch(query, self.namespace)
+        return {key: value for key, value in records}
+
+    async def fetch(self, key: str) -> Tuple[bool, Any]:
+        query = "SELECT value FROM config_store WHERE namespace=$1 AND key=$2;"
+        async with ConfigStore.acquire_connection(None) as con:
+            record = await con.fetchrow(query, self.namespace, key)
+        if record is None:
+            return False, None
+        return True, record["value"]
+
+    async def write(
+        self, snapshot: Dict[str, Any], changed: Set[str], removed: Set[str]
+    ) -> None:
+        upsert = """INSERT INTO config_store (namespace, key, value)
+                    SELECT $1, x.key, x.value
+                    FROM jsonb_each($2::jsonb) AS x(key, value)
+                    ON CONFLICT (namespace, key)
+                    DO UPDATE SET value = EXCLUDED.value;
+                 """
+        delete = "DELETE FROM config_store WHERE namespace=$1 AND key=ANY($2::text[]);"
+
+        async with ConfigStore.acquire_connection(None) as con:
+            async with con.transaction():
+                if changed:
+                    values = {key: snapshot[key] for key in changed}
+                    await con.execute(upsert, self.namespace, values)
+                if removed:
+                    await con.execute(delete, self.namespace, list(removed))
+
+
+class Config:
+    """The "database" object.
+
+    Reads are served from memory. Writes update memory straight away and are
+    flushed to the backend at most every ``flush_interval`` seconds.
+
+    Parameters
+    -----------
+    name: str
+        The JSON file to use when no ``backend`` is given.
+    backend: Optional[Union[JSONBackend, PostgresBackend]]
+        Where the data is persisted.
+    load_later: bool
+        Whether to load a JSON file in the background instead of right now.
+        Other backends are only loaded once :meth:`load` is awaited, since
+        they usually need a connection pool first.
+    flush_interval: float
+        How long to wait after a write before flushing it.
+
+    When the backend is shared between processes, every flushed key is
+    published through :func:`utils.cache.notify_invalidation` under the name
+    ``config.<name>``. The other processes re-read those keys when the
+    invalidation reaches them, and then call :attr:`on_remote_change` with
+    the key, or ``None`` if everything was reloaded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        backend=None,
+        load_later: bool = False,
+        flush_interval: float = 5.0,
+        object_hook=None,
+        encoder=None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> None:
+        self.name = name
+        self.backend = backend or JSONBackend(
+            name, object_hook=object_hook, encoder=encoder
+        )
+        self.flush_interval = flush_interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.lock = asyncio.Lock()
+        self._db: Dict[str, Any] = {}
+        self._changed: Set[str] = set()
+        self._removed: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._reloads: Set[asyncio.Task] = set()
+        self.on_remote_change: Optional[Callable[[Optional[str]], None]] = None
+
+        if self.backend.shared:
+            cache.register_invalidator(self.invalidation_name, self._apply_invalidation)
+
+        if isinstance(self.backend, JSONBackend):
+            if load_later:
+                self.loop.create_task(self.load())
+            else:
+                self._db = self.backend._load()
+
+    def __repr__(self) -> str:
+        return f"<Config name={self.name!r} backend={self.backend!r} size={len(self)}>"
+
+    async def load(self) -> None:
+        async with self.lock:
+            data = await self.backend.load()
+            # anything written before we finished loading takes priority
+            for key in self._removed:
+                data.pop(key, None)
+            for key in self._changed:
+                data[key] = self._db[key]
+            self._db = data
+
+    @property
+    def invalidation_name(self) -> str:
+        return f"config.{self.name}"
+
+    def _apply_invalidation(self, kind: str, part: Any) -> None:
+        if kind == "all":
+            coro = self._reload_all()
+        else:
+            coro = self._reload(str(part))
+
+        task = self.loop.create_task(coro)
+        self._reloads.add(task)
+        task.add_done_callback(self._reloads.discard)
+
+    async def _reload_all(self) -> None:
+        await self.load()
+        if self.on_remote_change is not None:
+            self.on_remote_change(None)
+
+    async def _reload(self, key: str) -> None:
+        async with self.lock:
+            found, value = await self.backend.fetch(key)
+            if key in self._changed or key in self._removed:
+                # our own pending write wins, it will be flushed soon
+                return
+
+            if found:
+                self._db[key] = value
+            else:
+                self._db.pop(key, None)
+
+        if self.on_remote_change is not None:
+            self.on_remote_change(key)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._changed or self._removed)
+
+    def _mark(self, key: str, *, removed: bool) -> None:
+        if removed:
+            self._changed.discard(key)
+            self._removed.add(key)
+        else:
+            self._removed.discard(key)
+            self._changed.add(key)
+
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(
+                self.flush_interval, self._schedule_flush
+            )
+
+    def _schedule_flush(self) -> None:
+        self._flush_handle = None
+        self._flush_task = self.loop.create_task(self.flush())
+
+    async def flush(self) -> None:
+        """Writes every pending change to the backend."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        async with self.lock:
+            if not self.dirty:
+                return
+
+            changed, self._changed = self._changed, set()
+            removed, self._removed = self._removed, set()
+            try:
+                await self.backend.write(self._db.copy(), changed, removed)
+            except Exception:
+                # put them back so the next flush tries again
+                self._changed |= changed - self._removed
+                self._removed |= removed - self._changed
+                log.exception("Could not flush %s, retrying later.", self.name)
+                if self._flush_handle is None:
+                    self._flush_handle = self.loop.call_later(
+                        self.flush_interval, self._schedule_flush
+                    )
+            else:
+                if self.backend.shared:
+                    for key in changed | removed:
+                        cache.notify_invalidation(self.invalidation_name, "key", key)
+
+    # compatibility with the old API where every write saved straight away
+    save = flush
+
+    async def close(self) -> None:
+        """Flushes any pending changes."""
+        await self.flush()
+
+    def get(self, key: Any, *args: Any) -> Any:
+        """Retrieves a config entry."""
+        return self._db.get(str(key), *args)
+
+    async def put(self, key: Any, value: Any, *args: Any) -> None:
+        """Edits a config entry."""
+        key = str(key)
+        self._db[key] = value
+        self._mark(key, removed=False)
+
+    async def remove(self, key: Any) -> None:
+        """Removes a config entry."""
+        key = str(key)
+        del self._db[key]
+        self._mark(key, removed=True)
+
+    def __contains__(self, item: Any) -> bool:
+        return str(item) in self._db
+
+    def __getitem__(self, item: Any) -> Any:
+        return self._db[str(item)]
+
+    def __len__(self) -> int:
+        return len(self._db)
+
+    def all(self) -> Dict[str, Any]:
+        return self._db
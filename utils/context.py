@@ -13,9 +13,26 @@ import aiohttp
 import asyncpg
 from discord.ext import commands
 
+from utils.latency import CommandTimer
+
 if TYPE_CHECKING:
     from bot import Akane
 
+# the methods of a connection or pool that go to the database
+_QUERY_METHODS = frozenset(
+    (
+        "execute",
+        "executemany",
+        "fetch",
+        "fetchrow",
+        "fetchval",
+        "copy_from_query",
+        "copy_from_table",
+        "copy_records_to_table",
+        "copy_to_table",
+    )
+)
+
 
 class _ContextDBAcquire:
     __slots__ = ("ctx", "timeout")
@@ -35,11 +52,33 @@ class _ContextDBAcquire:
         await self.ctx.release()
 
 
+class _TimedDB:
+    """Forwards to a connection or the pool, timing the queries made."""
+
+    __slots__ = ("_target", "_timer")
+
+    def __init__(self, target: Any, timer: CommandTimer) -> None:
+        self._target = target
+        self._timer = timer
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        if name not in _QUERY_METHODS:
+            return attr
+
+        def timed(*args, **kwargs):
+            return self._timer.time_db(attr(*args, **kwargs))
+
+        return timed
+
+
 class Context(commands.Context):
 
     bot: Akane
 
     def __init__(self, **kwargs) -> None:
+        # see args, this has to exist before discord.py sets them
+        self.timer = CommandTimer()
         super().__init__(**kwargs)
         self.pool = self.bot.pool
         self._db: Optional[asyncpg.Connection] = None
@@ -48,6 +87,19 @@ class Context(commands.Context):
         # we need this for our cache key strategy
         return "<Context>"
 
+    @property
+    def args(self) -> list:
+        return self._args
+
+    @args.setter
+    def args(self, value: list) -> None:
+        # discord.py sets these once the checks passed, right before
+        # converting the arguments, which makes it where the checks end.
+        # It happens again for every subcommand, the timer only takes
+        # the first one.
+        self.timer.mark("checks")
+        self._args = value
+
     @property
     def session(self) -> aiohttp.ClientSession:
         return self.bot.session
@@ -193,11 +245,12 @@ class Context(commands.Context):
 
     @property
     def db(self) -> asyncpg.Connection:
-        return self._db if self._db else self.pool
+        # queries are timed for the command's latency stats
+        return _TimedDB(self._db if self._db else self.pool, self.timer)  # type: ignore
 
     async def _acquire(self, timeout: int) -> asyncpg.Connection:
         if self._db is None:
-            self._db = await self.pool.acquire(timeout=timeout)
+            self._db = await self.timer.time_db(self.pool.acquire(timeout=timeout))
         return self._db
 
     def acquire(self, *, timeout=None) -> _ContextDBAcquire:
@@ -413,6 +413,185 @@ class PrimaryKeyColumn(Column):
         super().__init__(Integer(auto_increment=True), primary_key=True)
 
 
+def _index_sql(table, column, index_name, index):
+    # index is either True or the index method to use, e.g. "brin"
+    using = "" if index is True else " USING %s" % index
+    return "CREATE INDEX IF NOT EXISTS {0} ON {1}{2} ({3});".format(
+        index_name, table, using, column
+    )
+
+
+class RangePartition:
+    """Declares a table as range partitioned on a timestamp column.
+
+    Partitions are named after the table and the start of the range they
+    hold, e.g. ``commands_2021_04`` for monthly partitions.
+
+    Parameters
+    -----------
+    column: str
+        The name of the timestamp column to partition on.
+    interval: str
+        How much time every partition holds, one of ``day``, ``month``
+        or ``year``.
+    """
+
+    # interval: to_char format of the partition name suffix
+    SUFFIXES = {"day": "YYYY_MM_DD", "month": "YYYY_MM", "year": "YYYY"}
+
+    def __init__(self, column, *, interval="month"):
+        if interval not in self.SUFFIXES:
+            raise SchemaError("Unsupported partition interval %r." % interval)
+
+        self.column = column
+        self.interval = interval
+
+    def __repr__(self):
+        return "<RangePartition column=%r interval=%r>" % (self.column, self.interval)
+
+    def __eq__(self, other):
+        return isinstance(other, RangePartition) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def to_dict(self):
+        return {"column": self.column, "interval": self.interval}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data is None:
+            return None
+        return cls(data["column"], interval=data["interval"])
+
+    def create_sql(self, table, start, end):
+        """Generates the SQL creating every partition between two timestamps.
+
+        ``start`` and ``end`` are SQL expressions, and may be NULL.
+        """
+        step = "INTERVAL '1 %s'" % self.interval
+        return """DO $$
+                  DECLARE
+                      start_at TIMESTAMP;
+                  BEGIN
+                      FOR start_at IN
+                          SELECT generate_series(
+                              date_trunc('{1}', COALESCE({2}, {3})),
+                              date_trunc('{1}', COALESCE({3}, {2})),
+                              {4}
+                          )
+                      LOOP
+                          EXECUTE format(
+                              'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                              '{0}_' || to_char(start_at, '{5}'),
+                              '{0}',
+                              start_at,
+                              start_at + {4}
+                          );
+                      END LOOP;
+                  END
+                  $$;""".format(
+            table, self.interval, start, end, step, self.SUFFIXES[self.interval]
+        )
+
+    def expired_sql(self, table):
+        """Generates the query listing the partitions that end before $1."""
+        return """SELECT c.relname
+                  FROM pg_inherits i
+                  INNER JOIN pg_class c ON c.oid = i.inhrelid
+                  WHERE i.inhparent = '{0}'::regclass
+                  AND to_timestamp(substr(c.relname, {1}), '{2}')::timestamp
+                      + INTERVAL '1 {3}' <= $1
+                  ORDER BY c.relname;
+               """.format(
+            table, len(table) + 2, self.SUFFIXES[self.interval], self.interval
+        )
+
+
+# the current time in UTC, which is what our TIMESTAMP columns hold
+_NOW = "(now() AT TIME ZONE 'utc')"
+
+
+def _repartition_sql(table, partition):
+    """Moves a table's rows into a new table partitioned the given way.
+
+    PostgreSQL can't turn an existing table into a partitioned one (or back),
+    so the table is renamed, recreated like the old one and filled from it.
+    """
+    name = table.__tablename__
+    old = "%s_unpartitioned" % name
+    primary_keys = [c.name for c in table.columns if c.primary_key]
+    statements = ["ALTER TABLE {0} RENAME TO {1};".format(name, old)]
+
+    if partition is None:
+        statements.append(
+            "CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);".format(
+                name, old
+            )
+        )
+    else:
+        if partition.column not in primary_keys:
+            primary_keys.append(partition.column)
+
+        statements.append(
+            "CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            "PARTITION BY RANGE ({2});".format(name, old, partition.column)
+        )
+        # a NULL has no partition to go in and can't be part of the primary
+        # key either, so those rows are given the oldest value there is and
+        # end up in the first partition rather than aborting the copy
+        statements.append(
+            "UPDATE {1} SET {0} = COALESCE((SELECT MIN({0}) FROM {1}), {2}) "
+            "WHERE {0} IS NULL;".format(partition.column, old, _NOW)
+        )
+        # everything the old rows need, and the current range, so every row
+        # has a partition to go in
+        start = "(SELECT MIN({0}) FROM {1})".format(partition.column, old)
+        end = "GREATEST((SELECT MAX({0}) FROM {1}), {2})".format(
+            partition.column, old, _NOW
+        )
+        statements.append(partition.create_sql(name, start, end))
+
+    statements.append("INSERT INTO {0} SELECT * FROM {1};".format(name, old))
+
+    # SERIAL sequences belong to the old table, hand them over so that
+    # dropping it doesn't take them along
+    statements.append(
+        """DO $$
+           DECLARE
+               col TEXT;
+               seq TEXT;
+           BEGIN
+               FOR col IN
+                   SELECT attname FROM pg_attribute
+                   WHERE attrelid = '{1}'::regclass AND attnum > 0 AND NOT attisdropped
+               LOOP
+                   seq := pg_get_serial_sequence('{1}', col);
+                   IF seq IS NOT NULL THEN
+                       EXECUTE format('ALTER SEQUENCE %s OWNED BY %I.%I', seq, '{0}', col);
+                   END IF;
+               END LOOP;
+           END
+           $$;""".format(
+            name, old
+        )
+    )
+    statements.append("DROP TABLE {0};".format(old))
+
+    # the primary key and the indexes went with the old table, their
+    # names were taken until now
+    statements.append(
+        "ALTER TABLE {0} ADD PRIMARY KEY ({1});".format(name, ", ".join(primary_keys))
+    )
+    for column in table.columns:
+        if column.index:
+            statements.append(
+                _index_sql(name, column.name, column.index_name, column.index)
+            )
+
+    return "\n".join(statements)
+
+
 class SchemaDiff:
     __slots__ = ("table", "upgrade", "downgrade")
 
@@ -485,8 +664,25 @@ class SchemaDiff:
             statements.append("DROP INDEX IF EXISTS {0[index]};".format(dropped))
 
         for added in path.get("add_index", []):
-            fmt = "CREATE INDEX IF NOT EXISTS {0[index]} ON {1.__tablename__} ({0[name]});"
-            statements.append(fmt.format(added, self.table))
+            statements.append(
+                _index_sql(
+                    self.table.__tablename__,
+                    added["name"],
+                    added["index"],
+                    added.get("using", True),
+                )
+            )
+
+        # recreating the table rebuilds its indexes as the current class has
+        # them, so upgrades do it once everything else is in place and
+        # downgrades do it before anything is undone
+        if "partition" in path:
+            partition = RangePartition.from_dict(path["partition"])
+            sql = _repartition_sql(self.table, partition)
+            if downgrade:
+                statements.insert(0, sql)
+            else:
+                statements.append(sql)
 
         return "\n".join(statements)
 
@@ -523,6 +719,8 @@ class TableMeta(type):
             table_name = name.lower()
 
         dct["__tablename__"] = table_name
+        partition = kwargs.get("partition_by")
+        dct["__partition__"] = partition
 
         for elem, value in dct.items():
             if isinstance(value, Column):
@@ -534,6 +732,13 @@ class TableMeta(type):
 
                 columns.append(value)
 
+        if partition is not None and not any(
+            column.name == partition.column for column in columns
+        ):
+            raise SchemaError(
+                "Cannot partition on a missing column %r." % partition.column
+            )
+
         dct["columns"] = columns
         return super().__new__(cls, name, parents, dct)
 
@@ -585,6 +790,59 @@ class Table(metaclass=TableMeta):
     def acquire_connection(cls, connection):
         return MaybeAcquire(connection, pool=cls._pool)
 
+    @classmethod
+    async def create_partitions(cls, *, ahead=1, connection=None):
+        """Creates the partitions for now and the next few ranges.
+
+        Parameters
+        -----------
+        ahead: int
+            How many ranges after the current one to create.
+        connection: Optional[asyncpg.Connection]
+            The connection to use, if not provided will acquire one from
+            the internal pool.
+        """
+        partition = cls.__partition__
+        if partition is None:
+            raise SchemaError("%s is not partitioned." % cls.__tablename__)
+
+        end = "%s + %d * INTERVAL '1 %s'" % (_NOW, ahead, partition.interval)
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            await con.execute(partition.create_sql(cls.__tablename__, _NOW, end))
+
+    @classmethod
+    async def drop_partitions(cls, before, *, connection=None):
+        """Drops the partitions that only hold rows older than ``before``.
+
+        Parameters
+        -----------
+        before: datetime.datetime
+            The cut off, in UTC.
+        connection: Optional[asyncpg.Connection]
+            The connection to use, if not provided will acquire one from
+            the internal pool.
+
+        Returns
+        --------
+        List[str]
+            The names of the dropped partitions.
+        """
+        partition = cls.__partition__
+        if partition is None:
+            raise SchemaError("%s is not partitioned." % cls.__tablename__)
+
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            names = [
+                record[0]
+                for record in await con.fetch(
+                    partition.expired_sql(cls.__tablename__), before
+                )
+            ]
+            for name in names:
+                await con.execute('DROP TABLE "%s";' % name)
+
+        return names
+
     @classmethod
     def write_migration(cls, *, directory="migrations"):
         """Writes the migration diff into the data file.
@@ -852,17 +1110,29 @@ class Table(metaclass=TableMeta):
             if col.primary_key:
                 primary_keys.append(col.name)
 
+        partition = cls.__partition__
+        # the partition column has to be a part of the primary key
+        if partition is not None and partition.column not in primary_keys:
+            primary_keys.append(partition.column)
+
         column_creations.append("PRIMARY KEY (%s)" % ", ".join(primary_keys))
         builder.append("(%s)" % ", ".join(column_creations))
+        if partition is not None:
+            builder.append("PARTITION BY RANGE (%s)" % partition.column)
         statements.append(" ".join(builder) + ";")
 
         # handle the index creations
         for column in cls.columns:
             if column.index:
-                fmt = "CREATE INDEX IF NOT EXISTS {1.index_name} ON {0} ({1.name});".format(
-                    cls.__tablename__, column
+                statements.append(
+                    _index_sql(
+                        cls.__tablename__, column.name, column.index_name, column.index
+                    )
                 )
-                statements.append(fmt)
+
+        # so that rows can be inserted right away
+        if partition is not None:
+            statements.append(partition.create_sql(cls.__tablename__, _NOW, _NOW))
 
         return "\n".join(statements)
 
@@ -907,6 +1177,8 @@ class Table(metaclass=TableMeta):
         # nb: columns is ordered due to the ordered dict usage
         #     this is used to help detect renames
         x["columns"] = [a._to_dict() for a in cls.columns]
+        if cls.__partition__ is not None:
+            x["partition"] = cls.__partition__.to_dict()
         return x
 
     @classmethod
@@ -921,6 +1193,7 @@ class Table(metaclass=TableMeta):
         self = cls()
         self.__tablename__ = data["name"]
         self.columns = [Column.from_dict(a) for a in data["columns"]]
+        self.__partition__ = RangePartition.from_dict(data.get("partition"))
         return self
 
     @classmethod
@@ -970,7 +1243,21 @@ class Table(metaclass=TableMeta):
         downgrade = {}
 
         def check_index_diff(a, b):
-            if a.index != b.index:
+            if a.index and b.index and a.index != b.index:
+                # only the index method changed, so rebuild it
+                upgrade.setdefault("drop_index", []).append(
+                    {"name": a.name, "index": b.index_name}
+                )
+                upgrade.setdefault("add_index", []).append(
+                    {"name": a.name, "index": a.index_name, "using": a.index}
+                )
+                downgrade.setdefault("drop_index", []).append(
+                    {"name": a.name, "index": a.index_name}
+                )
+                downgrade.setdefault("add_index", []).append(
+                    {"name": b.name, "index": b.index_name, "using": b.index}
+                )
+            elif a.index != b.index:
                 # Let's assume we have {name: thing, index: True}
                 # and we're going to { name: foo, index: False }
                 # This is a 'dropped' column when we upgrade with a rename
@@ -984,12 +1271,12 @@ class Table(metaclass=TableMeta):
                     )
                     # if we want to roll back, we need to re-add the old index to the old column name
                     downgrade.setdefault("add_index", []).append(
-                        {"name": b.name, "index": b.index_name}
+                        {"name": b.name, "index": b.index_name, "using": b.index}
                     )
                 else:
                     # we're not dropping an index, instead we're adding one
                     upgrade.setdefault("add_index", []).append(
-                        {"name": a.name, "index": a.index_name}
+                        {"name": a.name, "index": a.index_name, "using": a.index}
                     )
                     downgrade.setdefault("drop_index", []).append(
                         {"name": a.name, "index": a.index_name}
@@ -1081,7 +1368,11 @@ class Table(metaclass=TableMeta):
                 remove.append(as_dict)
                 if column.index:
                     upgrade.setdefault("add_index", []).append(
-                        {"name": column.name, "index": column.index_name}
+                        {
+                            "name": column.name,
+                            "index": column.index_name,
+                            "using": column.index,
+                        }
                     )
                     downgrade.setdefault("drop_index", []).append(
                         {"name": column.name, "index": column.index_name}
@@ -1106,6 +1397,11 @@ class Table(metaclass=TableMeta):
             upgrade.setdefault("remove_columns", []).extend(removed)
             downgrade.setdefault("add_columns", []).extend(removed)
 
+        if self.__partition__ != before.__partition__:
+            after_partition, before_partition = self.__partition__, before.__partition__
+            upgrade["partition"] = after_partition and after_partition.to_dict()
+            downgrade["partition"] = before_partition and before_partition.to_dict()
+
         return SchemaDiff(self, upgrade, downgrade)
 
 
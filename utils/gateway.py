@@ -0,0 +1,79 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Counts every gateway payload we receive and remembers the last few of them,
+# without going through a listener. Payloads are only serialised when dumped.
+
+from __future__ import annotations
+
+import json
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, TextIO
+
+__all__ = ("GatewayTap",)
+
+
+class GatewayTap:
+    """Counts gateway events by type and keeps the last ``size`` payloads.
+
+    Parameters
+    -----------
+    size: int
+        How many payloads to keep.
+    sample_rate: int
+        Only keep every ``sample_rate``-th payload. Counting is never sampled.
+    event_types: Iterable[Optional[str]]
+        Event types to pre-size the counter with, so counting them never
+        has to insert a new key.
+    """
+
+    __slots__ = ("counts", "sample_rate", "_ring", "_index", "_seen")
+
+    def __init__(
+        self,
+        size: int = 10,
+        *,
+        sample_rate: int = 1,
+        event_types: Iterable[Optional[str]] = (),
+    ) -> None:
+        if size < 1:
+            raise ValueError("size must be at least 1.")
+        if sample_rate < 1:
+            raise ValueError("sample_rate must be at least 1.")
+
+        self.counts: Counter = Counter(dict.fromkeys(event_types, 0))
+        self.sample_rate = sample_rate
+        self._ring: List[Optional[Dict[str, Any]]] = [None] * size
+        self._index = 0
+        self._seen = 0
+
+    def __repr__(self) -> str:
+        return f"<GatewayTap seen={self._seen} size={len(self._ring)}>"
+
+    def record(self, payload: Dict[str, Any]) -> None:
+        self.counts[payload.get("t")] += 1
+        self._seen += 1
+        if self._seen % self.sample_rate:
+            return
+
+        # this only stores a reference to the already decoded payload
+        self._ring[self._index] = payload
+        self._index = (self._index + 1) % len(self._ring)
+
+    def recent(self) -> List[Dict[str, Any]]:
+        """Returns the kept payloads, oldest first."""
+        ordered = self._ring[self._index :] + self._ring[: self._index]
+        return [payload for payload in ordered if payload is not None]
+
+    def dump(self, fp: TextIO) -> None:
+        """Writes the kept payloads to a file, oldest first."""
+        for payload in self.recent():
+            try:
+                data = json.dumps(payload, ensure_ascii=True, indent=4)
+            except Exception:
+                fp.write(f"{payload}\n")
+            else:
+                fp.write(f"{data}\n")
@@ -0,0 +1,176 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Works out the gateway intents and member cache we actually need from the
+# listeners registered by the loaded extensions, instead of asking for all of
+# them. Presence and typing events are by far the noisiest, and we only pay
+# for them when something listens to them.
+
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Mapping, Set, Tuple
+
+import discord
+
+if TYPE_CHECKING:
+    from discord.ext import commands
+
+log = logging.getLogger(__name__)
+
+# Intents we always want. Commands come in through messages, and menus and
+# prompts wait for reactions through ``wait_for``, which has no listener.
+BASE_INTENTS: Tuple[str, ...] = (
+    "guilds",
+    "guild_messages",
+    "dm_messages",
+    "guild_reactions",
+    "dm_reactions",
+)
+
+_MESSAGES = ("guild_messages", "dm_messages")
+_REACTIONS = ("guild_reactions", "dm_reactions")
+
+# event: intents that have to be enabled for it to be dispatched
+EVENT_INTENTS: Dict[str, Tuple[str, ...]] = {
+    "on_message": _MESSAGES,
+    "on_message_edit": _MESSAGES,
+    "on_message_delete": _MESSAGES,
+    "on_bulk_message_delete": _MESSAGES,
+    "on_raw_message_edit": _MESSAGES,
+    "on_raw_message_delete": _MESSAGES,
+    "on_raw_bulk_message_delete": _MESSAGES,
+    "on_reaction_add": _REACTIONS,
+    "on_reaction_remove": _REACTIONS,
+    "on_reaction_clear": _REACTIONS,
+    "on_reaction_clear_emoji": _REACTIONS,
+    "on_raw_reaction_add": _REACTIONS,
+    "on_raw_reaction_remove": _REACTIONS,
+    "on_raw_reaction_clear": _REACTIONS,
+    "on_raw_reaction_clear_emoji": _REACTIONS,
+    "on_typing": ("guild_typing", "dm_typing"),
+    "on_member_join": ("members",),
+    "on_member_remove": ("members",),
+    # status and activity changes also come through these two, but they
+    # need ``presences`` which has to be asked for with an override
+    "on_member_update": ("members",),
+    "on_user_update": ("members",),
+    "on_member_ban": ("bans",),
+    "on_member_unban": ("bans",),
+    "on_guild_emojis_update": ("emojis",),
+    "on_guild_integrations_update": ("integrations",),
+    "on_webhooks_update": ("webhooks",),
+    "on_invite_create": ("invites",),
+    "on_invite_delete": ("invites",),
+    "on_voice_state_update": ("voice_states",),
+}
+
+
+def _listened_events(bot: commands.Bot) -> Dict[str, List[str]]:
+    """Returns every event something listens to, with who listens to it."""
+    events: Dict[str, List[str]] = {}
+    for name in dir(type(bot)):
+        if name.startswith("on_"):
+            events.setdefault(name, []).append(type(bot).__name__)
+
+    for name, listeners in bot.extra_events.items():
+        for listener in listeners:
+            events.setdefault(name, []).append(listener.__qualname__)
+
+    return events
+
+
+def _cog_requirements(bot: commands.Bot) -> Dict[str, List[str]]:
+    """Returns the intents cogs ask for through ``required_intents``.
+
+    This covers what no listener gives away, such as a command reading
+    ``Member.voice``.
+    """
+    required: Dict[str, List[str]] = {}
+    for name, cog in bot.cogs.items():
+        for intent in getattr(cog, "required_intents", ()):
+            required.setdefault(intent, []).append(name)
+    return required
+
+
+def compute_profile(
+    bot: commands.Bot,
+    *,
+    intent_overrides: Mapping[str, bool] = {},
+    member_cache_overrides: Mapping[str, bool] = {},
+) -> Tuple[discord.Intents, discord.MemberCacheFlags]:
+    """Builds the smallest intents and member cache the loaded extensions need.
+
+    Overrides are applied last, e.g. ``{"presences": True}``.
+    """
+    wanted: Dict[str, List[str]] = {intent: ["base"] for intent in BASE_INTENTS}
+    for event, listeners in _listened_events(bot).items():
+        for intent in EVENT_INTENTS.get(event, ()):
+            wanted.setdefault(intent, []).extend(listeners)
+
+    for intent, cogs in _cog_requirements(bot).items():
+        wanted.setdefault(intent, []).extend(cogs)
+
+    intents = discord.Intents.none()
+    for intent, reasons in wanted.items():
+        setattr(intents, intent, True)
+        log.debug("Enabling the %s intent for %s.", intent, ", ".join(reasons))
+
+    for intent, value in intent_overrides.items():
+        setattr(intents, intent, value)
+
+    flags = discord.MemberCacheFlags.from_intents(intents)
+    for flag, value in member_cache_overrides.items():
+        setattr(flags, flag, value)
+
+    # raises a ValueError if an override asks for something impossible
+    flags._verify_intents(intents)
+    return intents, flags
+
+
+def _disabled(everything: Any, chosen: Any) -> List[str]:
+    valid = type(everything).VALID_FLAGS
+    return [
+        name
+        for name, value in everything
+        # skip the flags that combine others, like ``messages``
+        if value and not getattr(chosen, name) and bin(valid[name]).count("1") == 1
+    ]
+
+
+def apply_profile(
+    bot: commands.Bot, intents: discord.Intents, flags: discord.MemberCacheFlags
+) -> None:
+    """Replaces the intents and member cache of a bot that has not connected yet.
+
+    This has to redo what :class:`discord.state.ConnectionState` decided
+    from the intents it was created with.
+    """
+    state = bot._connection
+    state._intents = intents
+    state.member_cache_flags = flags
+    state._chunk_guilds = intents.members
+    if not intents.members or flags._empty:
+        state.store_user = state.store_user_no_intents
+
+    disabled_intents = _disabled(discord.Intents.all(), intents)
+    disabled_flags = _disabled(discord.MemberCacheFlags.all(), flags)
+    log.info(
+        "Disabled intents: %s. Disabled member cache: %s.",
+        ", ".join(disabled_intents) or "none",
+        ", ".join(disabled_flags) or "none",
+    )
+
+
+def missing_intents(bot: commands.Bot, events: Iterable[str]) -> Set[str]:
+    """Returns the intents the given events need that the bot did not ask for."""
+    intents = bot._connection._intents
+    return {
+        intent
+        for event in events
+        for intent in EVENT_INTENTS.get(event, ())
+        if not getattr(intents, intent)
+    }
@@ -0,0 +1,147 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Keeps the caches of every process sharing our database coherent.
+# Explicit invalidations are published with NOTIFY and every other
+# process applies them when it hears about them over LISTEN.
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any, Optional, Set
+
+import asyncpg
+
+from utils import cache
+
+log = logging.getLogger(__name__)
+
+CHANNEL = "akane_cache_invalidation"
+
+
+class InvalidationBus:
+    """Broadcasts cache invalidations between processes over PostgreSQL.
+
+    Parameters
+    -----------
+    pool: asyncpg.Pool
+        The pool returned by :meth:`utils.db.Table.create_pool`.
+        One of its connections is held for as long as the bus is running.
+    channel: str
+        The NOTIFY channel to use.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, *, channel: str = CHANNEL) -> None:
+        self.pool = pool
+        self.channel = channel
+        # so we can ignore our own notifications
+        self.origin = uuid.uuid4().hex
+        self.published = 0
+        self.received = 0
+        self._connection: Optional[asyncpg.Connection] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._closed = False
+
+    def __repr__(self) -> str:
+        return f"<InvalidationBus channel={self.channel!r} origin={self.origin!r}>"
+
+    async def start(self) -> None:
+        """Starts listening and publishing invalidations."""
+        self._closed = False
+        await self._listen()
+        cache.add_invalidation_listener(self.publish)
+
+    async def close(self) -> None:
+        """Stops listening and publishing invalidations."""
+        self._closed = True
+        cache.remove_invalidation_listener(self.publish)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            await connection.remove_listener(self.channel, self._on_notification)
+            await self.pool.release(connection)
+
+    async def _listen(self) -> None:
+        connection = await self.pool.acquire()
+        connection.add_termination_listener(self._on_termination)
+        await connection.add_listener(self.channel, self._on_notification)
+        self._connection = connection
+
+    def _on_termination(self, connection: asyncpg.Connection) -> None:
+        if self._closed or connection is not self._connection:
+            return
+
+        log.warning("Lost the cache invalidation connection, reconnecting.")
+        self._connection = None
+        self._spawn(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 1.0
+        while not self._closed:
+            try:
+                await self._listen()
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                log.warning("Could not reconnect, retrying in %.0fs.", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+            else:
+                # we have no idea what we missed in the meantime
+                cache.clear_all()
+                log.info("Reconnected the cache invalidation connection.")
+                return
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def publish(self, name: str, kind: str, part: Any) -> None:
+        """Publishes an invalidation to every other process.
+
+        This is registered with :func:`utils.cache.add_invalidation_listener`
+        so every explicit ``invalidate`` call ends up here.
+
+        The notification is sent on its own connection right away, so
+        invalidate after the write has committed, not inside its
+        transaction. Otherwise other processes can re-fetch the old rows.
+        """
+        if self._closed:
+            return
+
+        payload = json.dumps(
+            {"origin": self.origin, "cache": name, "kind": kind, "part": part}
+        )
+        self._spawn(self._send(payload))
+
+    async def _send(self, payload: str) -> None:
+        try:
+            await self.pool.execute("SELECT pg_notify($1, $2);", self.channel, payload)
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+            log.exception("Could not publish cache invalidation %s.", payload)
+        else:
+            self.published += 1
+
+    def _on_notification(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ) -> None:
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            log.warning("Received a malformed cache invalidation: %r", payload)
+            return
+
+        if data.get("origin") == self.origin:
+            return
+
+        self.received += 1
+        found = cache.apply_invalidation(data["cache"], data["kind"], data["part"])
+        if not found:
+            log.debug("Received an invalidation for unknown cache %s.", data["cache"])
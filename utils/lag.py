@@ -0,0 +1,183 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Measures how late the event loop wakes up compared to when it was asked to.
+# A coroutine sleeps for a fixed interval and records the overshoot, while a
+# watchdog thread notices when that coroutine stops checking in and captures
+# the stack of whatever is hogging the loop at that moment.
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import datetime
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, List, NamedTuple, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    float("inf"),
+)
+
+
+class StallReport(NamedTuple):
+    when: datetime.datetime
+    duration: float
+    task: Optional[str]
+    stack: str
+
+
+class LagMonitor:
+    """Samples event loop lag into a histogram and reports long stalls.
+
+    Parameters
+    -----------
+    loop: asyncio.AbstractEventLoop
+        The loop to watch.
+    interval: float
+        How long the sampler sleeps between samples.
+    threshold: float
+        How long the loop has to be stuck before its stack is dumped.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        *,
+        interval: float = 0.25,
+        threshold: float = 0.5,
+    ) -> None:
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.counts: List[int] = [0] * len(BUCKETS)
+        self.samples = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stalls: Deque[StallReport] = deque(maxlen=10)
+        self._last_beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def __repr__(self) -> str:
+        return (
+            f"<LagMonitor samples={self.samples} mean={self.mean * 1000:.2f}ms "
+            f"max={self.max * 1000:.2f}ms stalls={len(self.stalls)}>"
+        )
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.samples if self.samples else 0.0
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Returns the upper bound of the bucket holding the given percentile."""
+        if not self.samples:
+            return None
+
+        wanted = self.samples * pct / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= wanted:
+                return bound if bound != float("inf") else self.max
+        return self.max
+
+    def recent_stalls(self, seconds: float) -> List[StallReport]:
+        """Returns the stalls reported in the last ``seconds``."""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+        return [stall for stall in self.stalls if stall.when >= cutoff]
+
+    def histogram(self) -> List[Tuple[float, int]]:
+        return list(zip(BUCKETS, self.counts))
+
+    def record(self, lag: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, lag)] += 1
+        self.samples += 1
+        self.total += lag
+        if lag > self.max:
+            self.max = lag
+
+    def start(self) -> None:
+        """Starts sampling once the loop runs, and starts the watchdog thread."""
+        if self._task is not None:
+            return
+
+        self._stopped.clear()
+        self._task = self.loop.create_task(self._sample())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="lag-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self) -> None:
+        self._loop_thread = threading.get_ident()
+        while True:
+            self._last_beat = time.monotonic()
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, self.loop.time() - start - self.interval))
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.threshold / 2):
+            beat = self._last_beat
+            stuck_for = time.monotonic() - beat - self.interval
+            if self._loop_thread is None or stuck_for < self.threshold:
+                continue
+
+            # the loop not running at all isn't a stall
+            if not self.loop.is_running():
+                continue
+
+            if beat == reported:
+                continue
+
+            # only report each stall once
+            reported = beat
+            self._report(stuck_for)
+
+    def _report(self, stuck_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+
+        stack = "".join(traceback.format_stack(frame))
+        # reading this from another thread is racy, but it is only informative
+        task = asyncio.current_task(self.loop)
+        name = repr(task) if task is not None else None
+        report = StallReport(datetime.datetime.utcnow(), stuck_for, name, stack)
+        self.stalls.append(report)
+        log.warning(
+            "Event loop blocked for over %.0fms in %s:\n%s",
+            stuck_for * 1000,
+            name or "no task",
+            stack,
+        )
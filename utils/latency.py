@@ -0,0 +1,162 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Where the time of a command goes. Each invocation is timed from on_command
+# until it completes or errors, split into its checks, its converters, the
+# queries it makes through ctx.db and the rest, which is the body. The
+# durations go into histograms with fixed buckets, so they can be added up
+# across processes and hours and still give percentiles.
+
+from __future__ import annotations
+
+import bisect
+import time
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Tuple
+
+__all__ = ("BOUNDS", "PHASES", "Histogram", "CommandTimer", "merge_histograms")
+
+# upper bounds of the buckets in milliseconds, a last one counts the rest
+BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+PHASES = ("checks", "converters", "db", "body", "total")
+
+
+class Histogram:
+    """Counts of durations, in milliseconds, per bucket of :data:`BOUNDS`."""
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self, counts: Optional[List[int]] = None, total: float = 0.0) -> None:
+        if counts is None:
+            counts = [0] * (len(BOUNDS) + 1)
+        self.counts = counts
+        self.total = total
+
+    def __repr__(self) -> str:
+        return f"<Histogram count={self.count} total={self.total:.1f}ms>"
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def add(self, milliseconds: float) -> None:
+        self.counts[bisect.bisect_left(BOUNDS, milliseconds)] += 1
+        self.total += milliseconds
+
+    def merge(self, other: Histogram) -> None:
+        # rows written with fewer buckets are padded
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for (index, count) in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+
+    def percentile(self, q: float) -> float:
+        """Estimates the ``q``-th percentile, interpolating inside its bucket.
+
+        Anything past the last bound is reported as the last bound.
+        """
+        count = self.count
+        if not count:
+            return 0.0
+
+        rank = count * q / 100
+        seen = 0
+        for (index, bucket) in enumerate(self.counts):
+            if not bucket or seen + bucket < rank:
+                seen += bucket
+                continue
+
+            if index >= len(BOUNDS):
+                return float(BOUNDS[-1])
+
+            lower = BOUNDS[index - 1] if index else 0
+            upper = BOUNDS[index]
+            return lower + (upper - lower) * (rank - seen) / bucket
+
+        return float(BOUNDS[-1])
+
+
+def merge_histograms(
+    rows: Iterable[Tuple[Any, List[int], float]]
+) -> Dict[Any, Histogram]:
+    """Adds up ``(key, counts, total)`` rows into a histogram per key."""
+    result: Dict[Any, Histogram] = {}
+    for (key, counts, total) in rows:
+        histogram = result.get(key)
+        if histogram is None:
+            histogram = result[key] = Histogram()
+        histogram.merge(Histogram(list(counts), total))
+    return result
+
+
+class CommandTimer:
+    """Splits the time of one invocation into its phases.
+
+    :meth:`mark` closes the phase that just ended. Only the first mark of
+    a phase counts, a group's subcommands go through the checks and the
+    converters again but that is all part of the group's body. Time spent
+    in the database is taken out of whichever phase it happened in, so the
+    phases add up to the total.
+    """
+
+    __slots__ = ("started", "total", "phases", "db", "_last", "_db_mark", "_marked")
+
+    def __init__(self) -> None:
+        self.started: Optional[float] = None
+        self.total: Optional[float] = None
+        self.phases = dict.fromkeys(("checks", "converters", "body"), 0.0)
+        self.db = 0.0
+        self._last = 0.0
+        self._db_mark = 0.0
+        self._marked = set()
+
+    def __repr__(self) -> str:
+        return f"<CommandTimer total={self.total} phases={self.phases} db={self.db}>"
+
+    @property
+    def running(self) -> bool:
+        return self.started is not None and self.total is None
+
+    def start(self) -> None:
+        self.total = None
+        self.phases = dict.fromkeys(self.phases, 0.0)
+        self.db = self._db_mark = 0.0
+        self._marked = set()
+        self.started = self._last = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        if not self.running or phase in self._marked:
+            return
+
+        self._marked.add(phase)
+
+        now = time.perf_counter()
+        in_db = self.db - self._db_mark
+        self.phases[phase] += max(now - self._last - in_db, 0.0)
+        self._last = now
+        self._db_mark = self.db
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+
+        self.mark("body")
+        self.total = self._last - self.started
+
+    async def time_db(self, awaitable: Awaitable[Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.db += time.perf_counter() - start
+
+    def timings(self) -> Dict[str, float]:
+        """The time of each phase in milliseconds, once stopped."""
+        result = {phase: elapsed * 1000 for phase, elapsed in self.phases.items()}
+        result["db"] = self.db * 1000
+        result["total"] = (self.total or 0.0) * 1000
+        return result
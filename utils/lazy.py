@@ -0,0 +1,132 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Finds the top level commands of an extension without importing it, so the
+# bot can register cheap stand-ins and only import the real thing the first
+# time one of them is used.
+
+from __future__ import annotations
+
+import ast
+import importlib.util
+from typing import List, NamedTuple, Optional
+
+__all__ = ("CommandStub", "find_command_stubs")
+
+
+class CommandStub(NamedTuple):
+    name: str
+    aliases: List[str]
+
+
+_COMMAND_DECORATORS = {"command", "group"}
+
+# cog methods discord.py applies to every command, not only the cog's own
+_GLOBAL_HOOKS = {"bot_check", "bot_check_once"}
+
+# attributes of the bot that register something for every command
+_BOT_HOOKS = {"check", "check_once", "before_invoke", "after_invoke", "help_command"}
+
+
+def _decorator_name(node: ast.expr) -> Optional[str]:
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+    return None
+
+
+def _is_top_level_command(node: ast.expr) -> bool:
+    # ``commands.command()`` and ``command()``, but not ``parent.command()``
+    if isinstance(node, ast.Call):
+        node = node.func
+    if isinstance(node, ast.Attribute):
+        return (
+            isinstance(node.value, ast.Name)
+            and node.value.id == "commands"
+            and node.attr in _COMMAND_DECORATORS
+        )
+    return isinstance(node, ast.Name) and node.id in _COMMAND_DECORATORS
+
+
+def _is_bot(node: ast.expr) -> bool:
+    # ``bot`` and ``self.bot``
+    if isinstance(node, ast.Attribute):
+        return node.attr == "bot"
+    return isinstance(node, ast.Name) and node.id == "bot"
+
+
+def _constant(node: ast.expr) -> Optional[str]:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def _stub_for(func: ast.AsyncFunctionDef, decorator: ast.expr) -> Optional[CommandStub]:
+    name = func.name
+    aliases: List[str] = []
+    if isinstance(decorator, ast.Call):
+        for keyword in decorator.keywords:
+            if keyword.arg == "name":
+                name = _constant(keyword.value)
+                if name is None:
+                    return None
+            elif keyword.arg == "aliases":
+                if not isinstance(keyword.value, (ast.List, ast.Tuple)):
+                    return None
+                aliases = [_constant(elt) for elt in keyword.value.elts]
+                if None in aliases:
+                    return None
+    return CommandStub(name, aliases)
+
+
+def find_command_stubs(name: str) -> Optional[List[CommandStub]]:
+    """Returns the top level commands an extension defines, without importing it.
+
+    Returns ``None`` if the extension can't be loaded lazily: it has
+    listeners, background tasks, ``required_intents`` or global checks and
+    hooks, which all have to be in place before the first command is used,
+    or its commands can't be worked out statically.
+    """
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.origin is None or not spec.has_location:
+        return None
+
+    with open(spec.origin, "r", encoding="utf-8") as fp:
+        tree = ast.parse(fp.read(), filename=spec.origin)
+
+    stubs: List[CommandStub] = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and (
+            node.attr in ("add_listener", "add_check")
+            or (node.attr in _BOT_HOOKS and _is_bot(node.value))
+        ):
+            return None
+
+        if isinstance(node, ast.Name) and node.id == "required_intents":
+            return None
+
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+
+        if node.name in _GLOBAL_HOOKS:
+            return None
+
+        for decorator in node.decorator_list:
+            if _decorator_name(decorator) in ("listener", "loop"):
+                return None
+
+            if isinstance(node, ast.AsyncFunctionDef) and _is_top_level_command(
+                decorator
+            ):
+                stub = _stub_for(node, decorator)
+                if stub is None:
+                    return None
+                stubs.append(stub)
+
+    return stubs or None
@@ -0,0 +1,297 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Serves the bot's health as Prometheus metrics over HTTP, so monitoring can
+# scrape it instead of someone running bothealth. Everything is read from
+# counters the bot already keeps when a scrape comes in, nothing is
+# collected in the background. It only listens on localhost by default.
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+import psutil
+from aiohttp import web
+
+from utils import cache
+from utils.lag import BUCKETS
+
+if TYPE_CHECKING:
+    from bot import Akane
+
+log = logging.getLogger(__name__)
+
+__all__ = ("MetricsServer", "render_metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Optional[Dict[str, Any]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Exposition:
+    """Builds the text exposition format, one metric family at a time."""
+
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+
+    def add(
+        self,
+        name: str,
+        kind: str,
+        help: str,
+        samples: Iterable[Tuple[Labels, float]],
+    ) -> None:
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.sample(name, labels, value)
+
+    def sample(self, name: str, labels: Labels, value: float) -> None:
+        if labels:
+            joined = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            name = f"{name}{{{joined}}}"
+        self.lines.append(f"{name} {_format_value(value)}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def _pool_metrics(out: _Exposition, pool: Any) -> None:
+    # the same internals bothealth reads, asyncpg has no public API for them
+    holders = pool._holders
+    idle = pool._queue.qsize()
+    out.add(
+        "akane_db_pool_size",
+        "gauge",
+        "Connections in the pool.",
+        [(None, len(holders))],
+    )
+    out.add(
+        "akane_db_pool_in_use",
+        "gauge",
+        "Connections currently acquired.",
+        [(None, len(holders) - idle)],
+    )
+    out.add(
+        "akane_db_pool_waiters",
+        "gauge",
+        "Coroutines waiting in Pool.acquire.",
+        [(None, len(pool._queue._getters))],
+    )
+
+
+def _loop_metrics(out: _Exposition, bot: Akane) -> None:
+    tasks = asyncio.all_tasks(loop=bot.loop)
+    events = sum(
+        1
+        for task in tasks
+        if getattr(task.get_coro(), "__qualname__", None) == "Client._run_event"
+    )
+    out.add("akane_tasks", "gauge", "Tasks on the event loop.", [(None, len(tasks))])
+    out.add(
+        "akane_event_tasks",
+        "gauge",
+        "Event listeners still running.",
+        [(None, events)],
+    )
+
+    lag = bot.lag_monitor
+    name = "akane_loop_lag_seconds"
+    out.add(name, "histogram", "How late the event loop wakes up.", [])
+    seen = 0
+    for bound, count in zip(BUCKETS, lag.counts):
+        seen += count
+        out.sample(f"{name}_bucket", {"le": _format_value(bound)}, seen)
+    out.sample(f"{name}_sum", None, lag.total)
+    out.sample(f"{name}_count", None, lag.samples)
+    out.add(
+        "akane_loop_stalls",
+        "gauge",
+        "Recent stalls longer than the threshold, up to 10.",
+        [(None, len(lag.stalls))],
+    )
+
+
+def _process_metrics(out: _Exposition, process: psutil.Process) -> None:
+    # memory_info is cheap, unlike the memory_full_info bothealth uses
+    with process.oneshot():
+        memory = process.memory_info()
+        cpu = process.cpu_times()
+        threads = process.num_threads()
+    out.add(
+        "process_resident_memory_bytes",
+        "gauge",
+        "Resident memory size in bytes.",
+        [(None, memory.rss)],
+    )
+    out.add(
+        "process_cpu_seconds_total",
+        "counter",
+        "User and system CPU time spent in seconds.",
+        [(None, cpu.user + cpu.system)],
+    )
+    out.add("process_threads", "gauge", "Threads of the process.", [(None, threads)])
+
+
+def _command_metrics(out: _Exposition, bot: Akane) -> None:
+    out.add(
+        "akane_commands_total",
+        "counter",
+        "Commands used since the bot started.",
+        [({"command": name}, count) for name, count in bot.command_stats.items()],
+    )
+    out.add(
+        "akane_messages_total",
+        "counter",
+        "How far messages got through process_commands.",
+        [({"outcome": name}, count) for name, count in bot.message_stats.items()],
+    )
+
+    stats = bot.get_cog("Stats")
+    if stats is not None:
+        out.add(
+            "akane_commands_dropped_total",
+            "counter",
+            "Command usage dropped because the buffer was full.",
+            [(None, stats.dropped_commands)],
+        )
+
+    out.add(
+        "akane_buffer_size",
+        "gauge",
+        "Entries waiting to be flushed, per buffer.",
+        [({"buffer": buffer.name}, len(buffer)) for buffer in bot.buffers],
+    )
+
+
+def _socket_metrics(out: _Exposition, bot: Akane) -> None:
+    out.add(
+        "akane_gateway_events_total",
+        "counter",
+        "Gateway events received, per type.",
+        [({"event": name}, count) for name, count in bot.socket_stats.items()],
+    )
+    latency = bot.latency
+    if latency == latency and latency != float("inf"):
+        out.add(
+            "akane_gateway_latency_seconds",
+            "gauge",
+            "Time between a heartbeat and its acknowledgement.",
+            [(None, latency)],
+        )
+    out.add(
+        "akane_guilds",
+        "gauge",
+        "Guilds the bot is in.",
+        [(None, len(bot._connection._guilds))],
+    )
+    out.add(
+        "akane_global_rate_limited",
+        "gauge",
+        "Whether the global HTTP rate limit was hit.",
+        [(None, int(not bot.http._global_over.is_set()))],
+    )
+
+
+def _cache_metrics(out: _Exposition, bot: Akane) -> None:
+    all_stats = cache.all_stats()
+    for attr, kind, help in (
+        ("size", "gauge", "Entries in the cache."),
+        ("in_flight", "gauge", "Loads currently running."),
+        ("hits", "counter", "Cache hits."),
+        ("misses", "counter", "Cache misses."),
+        ("evictions", "counter", "Entries evicted."),
+    ):
+        suffix = "_total" if kind == "counter" else ""
+        out.add(
+            f"akane_cache_{attr}{suffix}",
+            kind,
+            help,
+            [({"cache": stats.name}, getattr(stats, attr)) for stats in all_stats],
+        )
+
+    bus = bot.cache_bus
+    if bus is not None:
+        out.add(
+            "akane_cache_invalidations_total",
+            "counter",
+            "Invalidations sent to and received from other processes.",
+            [
+                ({"direction": "published"}, bus.published),
+                ({"direction": "received"}, bus.received),
+            ],
+        )
+
+
+def render_metrics(bot: Akane, process: psutil.Process) -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    out = _Exposition()
+    _pool_metrics(out, bot.pool)
+    _loop_metrics(out, bot)
+    _process_metrics(out, process)
+    _command_metrics(out, bot)
+    _socket_metrics(out, bot)
+    _cache_metrics(out, bot)
+    return out.render()
+
+
+class MetricsServer:
+    """Serves :func:`render_metrics` on ``/metrics``.
+
+    Parameters
+    -----------
+    bot: Akane
+        The bot to report on.
+    host: str
+        The address to listen on.
+    port: int
+        The port to listen on.
+    """
+
+    def __init__(self, bot: Akane, *, host: str = "127.0.0.1", port: int) -> None:
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.process = psutil.Process()
+        self.scrapes = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    def __repr__(self) -> str:
+        return f"<MetricsServer host={self.host!r} port={self.port} scrapes={self.scrapes}>"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        # scrapes every few seconds would flood the log otherwise
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        log.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.scrapes += 1
+        body = render_metrics(self.bot, self.process)
+        return web.Response(
+            body=body.encode("utf-8"), headers={"Content-Type": CONTENT_TYPE}
+        )
@@ -0,0 +1,174 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Micro-benchmarks of hot paths that need neither a connection to Discord nor
+# a database. Used by ``launcher.py bench --cache`` and ``--prefixes``.
+
+from __future__ import annotations
+
+import random
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from utils.cache import ExpiringCache
+from utils.formats import TabularData
+
+__all__ = ("bench_expiring_cache", "bench_prefixes")
+
+CACHE_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def _per_op(func: Callable[[], None], ops: int) -> float:
+    """Runs ``func`` once and returns how long each of its ``ops`` took, in ns."""
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) / ops * 1e9
+
+
+def bench_expiring_cache(
+    sizes: Sequence[int] = CACHE_SIZES, *, lookups: int = 100_000
+) -> Iterator[str]:
+    """Yields the cost of ExpiringCache operations for every cache size.
+
+    Lookups should cost the same whatever the size, since expiry only
+    looks at the entries that are due. Expiry is per expired entry.
+    """
+    table = TabularData()
+    table.set_columns(
+        ["Entries", "Set (ns)", "Hit (ns)", "Miss (ns)", "in (ns)", "Expiry (ns)"]
+    )
+    rng = random.Random(0)
+    for size in sizes:
+        cache = ExpiringCache(3600.0)
+        keys = list(range(size))
+        hits = [rng.randrange(size) for _ in range(lookups)]
+        misses = [size + i for i in range(lookups)]
+
+        def fill():
+            for key in keys:
+                cache[key] = key
+
+        def hit():
+            for key in hits:
+                cache[key]
+
+        def miss():
+            for key in misses:
+                cache.get(key)
+
+        def contains():
+            for key in hits:
+                key in cache
+
+        # entries expire while this fills up too, so only the ones the
+        # timed lookup gets rid of are counted
+        expired = []
+        expiring = ExpiringCache(0.05, callback=lambda k, v: expired.append(k))
+        for key in keys:
+            expiring[key] = key
+        time.sleep(0.1)
+        del expired[:]
+        start = time.perf_counter()
+        -1 in expiring
+        expiry = (time.perf_counter() - start) / max(len(expired), 1) * 1e9
+
+        table.add_row(
+            (
+                f"{size:,}",
+                f"{_per_op(fill, size):.0f}",
+                f"{_per_op(hit, lookups):.0f}",
+                f"{_per_op(miss, lookups):.0f}",
+                f"{_per_op(contains, lookups):.0f}",
+                f"{expiry:.0f}",
+            )
+        )
+
+    yield f"ExpiringCache, {lookups:,} lookups per size"
+    yield table.render()
+
+
+def _synthetic_messages(
+    count: int, prefixes: Dict[Optional[int], List[str]], bot_id: int
+) -> List[Tuple[Optional[int], str]]:
+    rng = random.Random(0)
+    guild_ids = list(prefixes)
+    words = ["hello", "lol", "what", "anyone here?", "gg", "https://example.com"]
+    messages = []
+    for _ in range(count):
+        guild_id = rng.choice(guild_ids)
+        roll = rng.random()
+        if roll < 0.05:
+            content = f"<@!{bot_id}> help"
+        elif roll < 0.15:
+            content = f"{rng.choice(prefixes[guild_id])}tag {rng.choice(words)}"
+        else:
+            content = " ".join(rng.choices(words, k=rng.randint(1, 8)))
+        messages.append((guild_id, content))
+    return messages
+
+
+def bench_prefixes(
+    messages: int = 100_000, *, guilds: int = 1_000, bot_id: int = 100000000000000000
+) -> Iterator[str]:
+    """Yields how long prefix matching takes over synthetic messages.
+
+    The list approach is what the bot did before: build every prefix of the
+    guild for each message and let discord.py try them one by one.
+    """
+    # the bot imports utils, not the other way around
+    from bot import PrefixMatcher
+
+    rng = random.Random(1)
+    defaults = ["a!", "A!"]
+    prefixes: Dict[Optional[int], List[str]] = {None: defaults}
+    for guild_id in range(1, guilds + 1):
+        if rng.random() < 0.8:
+            prefixes[guild_id] = defaults
+        else:
+            prefixes[guild_id] = [
+                f"{c}{rng.choice('!?.$')}" for c in "xyz"[: rng.randint(1, 3)]
+            ]
+
+    mentions = [f"<@!{bot_id}> ", f"<@{bot_id}> "]
+    corpus = _synthetic_messages(messages, prefixes, bot_id)
+
+    def with_lists():
+        found = 0
+        for guild_id, content in corpus:
+            candidates = [*mentions, *prefixes[guild_id]]
+            for prefix in candidates:
+                if content.startswith(prefix):
+                    found += 1
+                    break
+        return found
+
+    matchers: Dict[Optional[int], PrefixMatcher] = {}
+
+    def with_matchers():
+        found = 0
+        for guild_id, content in corpus:
+            try:
+                matcher = matchers[guild_id]
+            except KeyError:
+                matcher = matchers[guild_id] = PrefixMatcher(
+                    [*mentions, *prefixes[guild_id]]
+                )
+            if matcher.match(content) is not None:
+                found += 1
+        return found
+
+    table = TabularData()
+    table.set_columns(["Approach", "Total (ms)", "Per message (ns)", "Matched"])
+    for name, func in (("lists", with_lists), ("PrefixMatcher", with_matchers)):
+        start = time.perf_counter()
+        found = func()
+        elapsed = time.perf_counter() - start
+        table.add_row(
+            (name, f"{elapsed * 1000:.1f}", f"{elapsed / messages * 1e9:.0f}", found)
+        )
+
+    yield f"Prefix matching, {messages:,} messages over {guilds:,} guilds"
+    yield table.render()
@@ -0,0 +1,296 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# A stand-in for Discord's HTTP API and gateway, just enough for the bot to
+# log in, identify every shard and receive its guilds. Used by
+# ``launcher.py mockapi`` so ``launcher.py cluster --api-base`` can be tried
+# out without a real token or touching Discord. Payloads are built with the
+# same helpers as the replay harness.
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import random
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import WSMsgType, web
+
+from utils.replay import (
+    _BOT_ID,
+    _USER_BASE,
+    _dispatch,
+    _guild_create,
+    _member,
+    _ready,
+    _timestamp,
+    _user,
+)
+
+log = logging.getLogger(__name__)
+
+__all__ = ("MockDiscord",)
+
+HEARTBEAT_INTERVAL = 41250
+
+# gateway opcodes
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+RESUME = 6
+REQUEST_MEMBERS = 8
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+
+def _message(
+    message_id: int, guild_id: int, channel_id: int, author_id: int, content: str
+) -> Dict[str, Any]:
+    data = {
+        "id": str(message_id),
+        "channel_id": str(channel_id),
+        "author": _user(author_id, bot=author_id == _BOT_ID),
+        "content": content,
+        "timestamp": _timestamp(),
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+    if guild_id:
+        data["guild_id"] = str(guild_id)
+    return data
+
+
+def _json(data: Any) -> web.Response:
+    # discord.py compares the whole header, so there can't be a charset
+    return web.Response(
+        body=json.dumps(data).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+
+
+class _Session:
+    """One shard's gateway connection."""
+
+    def __init__(self, ws: web.WebSocketResponse) -> None:
+        self.ws = ws
+        self.shard_id = 0
+        self.seq = 0
+        self.guild_ids: List[int] = []
+
+    async def send(self, payload: Dict[str, Any]) -> None:
+        if payload["op"] == DISPATCH:
+            self.seq += 1
+            payload["s"] = self.seq
+        await self.ws.send_str(json.dumps(payload))
+
+
+class MockDiscord:
+    """Serves a fake Discord API under ``/api/v{version}`` and a gateway.
+
+    Every shard that identifies gets ``guilds`` guilds that belong to it,
+    each with one text channel and ``members`` members. Messages the bot
+    sends are echoed back like Discord would, any other request gets an
+    empty response.
+
+    Parameters
+    -----------
+    host: str
+        The address to listen on.
+    port: int
+        The port to listen on.
+    shards: int
+        The shard count handed out by ``/gateway/bot``.
+    guilds: int
+        The guilds per shard.
+    members: int
+        The members per guild.
+    rate: float
+        How many MESSAGE_CREATEs to send every shard per second, if any.
+    """
+
+    def __init__(
+        self,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        shards: int = 1,
+        guilds: int = 10,
+        members: int = 50,
+        rate: float = 0.0,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.shards = shards
+        self.guilds = guilds
+        self.members = members
+        self.rate = rate
+        self.calls: Counter = Counter()
+        self.identified: Counter = Counter()
+        self._sessions: List[_Session] = []
+        self._next_id = _USER_BASE * 2
+        self._runner: Optional[web.AppRunner] = None
+
+    def __repr__(self) -> str:
+        return f"<MockDiscord api_base={self.api_base!r} shards={self.shards}>"
+
+    @property
+    def api_base(self) -> str:
+        """What to pass as ``--api-base``."""
+        return f"http://{self.host}:{self.port}/api/v7"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/gateway", self.gateway)
+        app.router.add_route("*", "/api/{version}/{path:.*}", self.http)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        log.info("Serving a mock Discord API on %s", self.api_base)
+
+    async def close(self) -> None:
+        # the handlers remove their session as they finish
+        for session in list(self._sessions):
+            await session.ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _next_snowflake(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def shard_guilds(self, shard_id: int) -> List[int]:
+        """The guild IDs that Discord would route to ``shard_id``."""
+        # (guild_id >> 22) % shard_count is the shard a guild belongs to
+        return [
+            ((index + 1) * self.shards + shard_id) << 22 for index in range(self.guilds)
+        ]
+
+    async def http(self, request: web.Request) -> web.Response:
+        path = "/" + request.match_info["path"]
+        self.calls[f"{request.method} {path}"] += 1
+
+        if path in ("/gateway", "/gateway/bot"):
+            data = {
+                "url": f"ws://{request.host}/gateway",
+                "shards": self.shards,
+                "session_start_limit": {
+                    "total": 1000,
+                    "remaining": 1000,
+                    "reset_after": 0,
+                    "max_concurrency": 1,
+                },
+            }
+            return _json(data)
+
+        if path == "/users/@me":
+            return _json(_user(_BOT_ID, bot=True))
+
+        parts = path.strip("/").split("/")
+        if (
+            request.method == "POST"
+            and len(parts) == 3
+            and parts[0] == "channels"
+            and parts[2] == "messages"
+        ):
+            payload = {}
+            if request.content_type == "application/json":
+                payload = await request.json()
+            data = _message(
+                self._next_snowflake(),
+                0,
+                int(parts[1]),
+                _BOT_ID,
+                payload.get("content") or "",
+            )
+            if payload.get("embed"):
+                data["embeds"] = [payload["embed"]]
+            return _json(data)
+
+        if request.method in ("PUT", "DELETE"):
+            return web.Response(status=204)
+        return _json({})
+
+    async def gateway(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        session = _Session(ws)
+        self._sessions.append(session)
+        traffic: Optional[asyncio.Task] = None
+        try:
+            await session.send(
+                {"op": HELLO, "d": {"heartbeat_interval": HEARTBEAT_INTERVAL}}
+            )
+            async for msg in ws:
+                if msg.type is not WSMsgType.TEXT:
+                    continue
+
+                payload = json.loads(msg.data)
+                op = payload.get("op")
+                if op == HEARTBEAT:
+                    await session.send({"op": HEARTBEAT_ACK, "d": None})
+                elif op == IDENTIFY:
+                    await self._identify(session, payload["d"])
+                    if self.rate > 0 and traffic is None:
+                        traffic = asyncio.ensure_future(self._traffic(session))
+                elif op == RESUME:
+                    session.seq = payload["d"].get("seq") or 0
+                    await session.send(_dispatch("RESUMED", {}, 0))
+                elif op == REQUEST_MEMBERS:
+                    # every guild is sent with all its members already
+                    data = payload["d"]
+                    chunk = {
+                        "guild_id": str(data["guild_id"]),
+                        "members": [],
+                        "chunk_index": 0,
+                        "chunk_count": 1,
+                    }
+                    if data.get("nonce"):
+                        chunk["nonce"] = data["nonce"]
+                    await session.send(_dispatch("GUILD_MEMBERS_CHUNK", chunk, 0))
+        finally:
+            if traffic is not None:
+                traffic.cancel()
+            self._sessions.remove(session)
+        return ws
+
+    async def _identify(self, session: _Session, data: Dict[str, Any]) -> None:
+        shard_id, _ = data.get("shard") or (0, 1)
+        session.shard_id = shard_id
+        session.guild_ids = self.shard_guilds(shard_id)
+        self.identified[shard_id] += 1
+        log.info("Shard %s identified.", shard_id)
+
+        ready = _ready(session.guild_ids)
+        ready["d"]["session_id"] = f"mock-{shard_id}-{self.identified[shard_id]}"
+        ready["d"]["shard"] = [shard_id, self.shards]
+        await session.send(ready)
+        for guild_id in session.guild_ids:
+            await session.send(_guild_create(guild_id, [guild_id + 1], self.members))
+
+    async def _traffic(self, session: _Session) -> None:
+        rng = random.Random(session.shard_id)
+        delay = 1.0 / self.rate
+        while not session.ws.closed:
+            guild_id = rng.choice(session.guild_ids)
+            author_id = _USER_BASE + rng.randrange(self.members)
+            content = rng.choice(("hello", "a!ping", "a!help", "lol"))
+            data = _message(
+                self._next_snowflake(), guild_id, guild_id + 1, author_id, content
+            )
+            data["member"] = _member(author_id, with_user=False)
+            await session.send(_dispatch("MESSAGE_CREATE", data, 0))
+            await asyncio.sleep(delay)
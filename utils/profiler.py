@@ -0,0 +1,158 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Measures what every event listener costs. Besides wall time, which includes
+# time spent waiting on the database or HTTP, each step of the listener's
+# coroutine is timed separately so we know how long it actually held the loop.
+
+from __future__ import annotations
+
+import datetime
+import functools
+import time
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Generator, List
+
+__all__ = ("ListenerProfiler", "ListenerCost")
+
+
+class ListenerCost:
+    __slots__ = (
+        "name",
+        "calls",
+        "errors",
+        "in_flight",
+        "total",
+        "max",
+        "busy",
+        "busy_max",
+    )
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        # wall time, from start to finish
+        self.total = 0.0
+        self.max = 0.0
+        # time spent actually running on the loop
+        self.busy = 0.0
+        self.busy_max = 0.0
+
+    def __repr__(self) -> str:
+        return f"<ListenerCost name={self.name!r} calls={self.calls} busy={self.busy:.3f}s>"
+
+
+class _Timed:
+    """Runs a coroutine, adding up how long each of its steps takes."""
+
+    __slots__ = ("coro", "busy")
+
+    def __init__(self, coro: Coroutine[Any, Any, Any]) -> None:
+        self.coro = coro
+        self.busy = 0.0
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        coro = self.coro
+        send, throw = coro.send, coro.throw
+        value: Any = None
+        error: Any = None
+        perf_counter = time.perf_counter
+        while True:
+            start = perf_counter()
+            try:
+                if error is None:
+                    yielded = send(value)
+                else:
+                    yielded = throw(error)
+            except StopIteration as e:
+                self.busy += perf_counter() - start
+                return e.value
+            except BaseException:
+                self.busy += perf_counter() - start
+                raise
+
+            self.busy += perf_counter() - start
+            try:
+                value = yield yielded
+            except BaseException as e:
+                value, error = None, e
+            else:
+                error = None
+
+
+class ListenerProfiler:
+    """Keeps :class:`ListenerCost` for every listener it wraps."""
+
+    def __init__(self, *, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.stats: Dict[str, ListenerCost] = {}
+        self.started = datetime.datetime.utcnow()
+
+    def __repr__(self) -> str:
+        return f"<ListenerProfiler enabled={self.enabled} listeners={len(self.stats)}>"
+
+    def reset(self) -> None:
+        # listeners still running finish into the new entries, so those
+        # start out with the old in-flight counts
+        stats = {}
+        for (name, entry) in self.stats.items():
+            if entry.in_flight:
+                fresh = stats[name] = ListenerCost(name)
+                fresh.in_flight = entry.in_flight
+        self.stats = stats
+        self.started = datetime.datetime.utcnow()
+
+    def _entry(self, name: str) -> ListenerCost:
+        try:
+            return self.stats[name]
+        except KeyError:
+            entry = self.stats[name] = ListenerCost(name)
+            return entry
+
+    def record(self, name: str, elapsed: float) -> None:
+        """Records something that ran synchronously, such as a dispatch."""
+        entry = self._entry(name)
+        entry.calls += 1
+        entry.total += elapsed
+        entry.busy += elapsed
+        if elapsed > entry.max:
+            entry.max = entry.busy_max = elapsed
+
+    def wrap(
+        self, func: Callable[..., Awaitable[Any]]
+    ) -> Callable[..., Awaitable[Any]]:
+        name = getattr(func, "__qualname__", repr(func))
+
+        @functools.wraps(func)
+        async def profiled(*args: Any, **kwargs: Any) -> Any:
+            timed = _Timed(func(*args, **kwargs))
+            self._entry(name).in_flight += 1
+            start = time.perf_counter()
+            failed = False
+            try:
+                return await timed
+            except Exception:
+                failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                # looked up again, the stats may have been reset meanwhile
+                entry = self._entry(name)
+                entry.errors += failed
+                entry.in_flight -= 1
+                entry.calls += 1
+                entry.total += elapsed
+                entry.busy += timed.busy
+                if elapsed > entry.max:
+                    entry.max = elapsed
+                if timed.busy > entry.busy_max:
+                    entry.busy_max = timed.busy
+
+        return profiled
+
+    def sorted_stats(self) -> List[ListenerCost]:
+        return sorted(self.stats.values(), key=lambda s: s.busy, reverse=True)
@@ -0,0 +1,485 @@
+"""
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+
+# Feeds recorded or synthetic gateway payloads straight into a bot's parsers,
+# as if they had come from the websocket, and measures what every listener
+# costs. Nothing is sent to Discord, its HTTP API is replaced with FakeHTTP.
+# Used by ``launcher.py bench``.
+
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import logging
+import random
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import discord
+from discord.ext import commands
+
+from utils.formats import TabularData
+
+log = logging.getLogger(__name__)
+
+__all__ = (
+    "FakeHTTP",
+    "ListenerStats",
+    "ReplayReport",
+    "read_event_log",
+    "synthetic_events",
+    "replay",
+    "iter_report",
+)
+
+_BOT_ID = 100000000000000000
+_GUILD_ID = 200000000000000000
+_CHANNEL_ID = 300000000000000000
+_USER_BASE = 400000000000000000
+_MESSAGE_BASE = 500000000000000000
+
+
+def read_event_log(path: str) -> List[Dict[str, Any]]:
+    """Reads the payloads :meth:`Akane.run` writes to ``prev_events.log``.
+
+    The file holds indented JSON documents one after the other. Payloads
+    that couldn't be encoded were written with ``str`` and are skipped.
+    """
+    with open(path, "r", encoding="utf-8") as fp:
+        content = fp.read()
+
+    decoder = json.JSONDecoder()
+    payloads = []
+    index = 0
+    end = len(content)
+    while index < end:
+        if content[index].isspace():
+            index += 1
+            continue
+
+        try:
+            payload, index = decoder.raw_decode(content, index)
+        except ValueError:
+            # a line written with str(), skip it
+            newline = content.find("\n", index)
+            log.warning("Skipping a payload that isn't JSON at offset %d.", index)
+            index = end if newline == -1 else newline + 1
+            continue
+
+        if isinstance(payload, dict):
+            payloads.append(payload)
+
+    return payloads
+
+
+def _timestamp(offset: float = 0.0) -> str:
+    when = datetime.datetime(2021, 1, 1) + datetime.timedelta(seconds=offset)
+    return when.isoformat() + "+00:00"
+
+
+def _user(user_id: int, *, bot: bool = False) -> Dict[str, Any]:
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id % 10000}",
+        "discriminator": f"{user_id % 10000:04}",
+        "avatar": None,
+        "bot": bot,
+    }
+
+
+def _member(user_id: int, *, with_user: bool = True) -> Dict[str, Any]:
+    data = {
+        "roles": [],
+        "joined_at": _timestamp(),
+        "nick": None,
+        "deaf": False,
+        "mute": False,
+    }
+    if with_user:
+        data["user"] = _user(user_id)
+    return data
+
+
+def _dispatch(event: str, data: Dict[str, Any], seq: int) -> Dict[str, Any]:
+    return {"op": 0, "t": event, "s": seq, "d": data}
+
+
+def _ready(guild_ids: List[int]) -> Dict[str, Any]:
+    return _dispatch(
+        "READY",
+        {
+            "v": 6,
+            "user": _user(_BOT_ID, bot=True),
+            "guilds": [{"id": str(g), "unavailable": True} for g in guild_ids],
+            "session_id": "replay",
+            "private_channels": [],
+            "relationships": [],
+        },
+        0,
+    )
+
+
+def _guild_create(
+    guild_id: int, channel_ids: List[int], members: int
+) -> Dict[str, Any]:
+    return _dispatch(
+        "GUILD_CREATE",
+        {
+            "id": str(guild_id),
+            "name": f"guild {guild_id % 10000}",
+            "owner_id": str(_USER_BASE),
+            "region": "us-east",
+            "afk_timeout": 300,
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "features": [],
+            "emojis": [],
+            "roles": [
+                {
+                    "id": str(guild_id),
+                    "name": "@everyone",
+                    "permissions": "104324673",
+                    "position": 0,
+                    "color": 0,
+                    "hoist": False,
+                    "managed": False,
+                    "mentionable": False,
+                }
+            ],
+            "channels": [
+                {
+                    "id": str(channel_id),
+                    "type": 0,
+                    "name": f"channel-{channel_id % 10000}",
+                    "position": index,
+                    "permission_overwrites": [],
+                }
+                for index, channel_id in enumerate(channel_ids)
+            ],
+            "members": [_member(_BOT_ID)]
+            + [_member(_USER_BASE + n) for n in range(members)],
+            "member_count": members + 1,
+            "large": False,
+            "voice_states": [],
+            "presences": [],
+            "unavailable": False,
+        },
+        0,
+    )
+
+
+def synthetic_events(
+    count: int, *, members: int = 50, seed: int = 0
+) -> List[Dict[str, Any]]:
+    """Builds a mix of MESSAGE_CREATE, MESSAGE_REACTION_ADD and GUILD_MEMBER_ADD.
+
+    They all happen in a single guild with one text channel.
+    """
+    rng = random.Random(seed)
+    payloads = []
+    for seq in range(1, count + 1):
+        user_id = _USER_BASE + rng.randrange(members)
+        message_id = _MESSAGE_BASE + seq
+        kind = rng.random()
+        if kind < 0.8:
+            content = rng.choice(("hello", "a!ping", "a!help", "lol", "⭐" * 3))
+            data = {
+                "id": str(message_id),
+                "channel_id": str(_CHANNEL_ID),
+                "guild_id": str(_GUILD_ID),
+                "author": _user(user_id),
+                "member": _member(user_id, with_user=False),
+                "content": content,
+                "timestamp": _timestamp(seq),
+                "edited_timestamp": None,
+                "tts": False,
+                "mention_everyone": False,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": [],
+                "embeds": [],
+                "pinned": False,
+                "type": 0,
+            }
+            payloads.append(_dispatch("MESSAGE_CREATE", data, seq))
+        elif kind < 0.95:
+            data = {
+                "user_id": str(user_id),
+                "channel_id": str(_CHANNEL_ID),
+                "message_id": str(message_id - rng.randrange(1, 50)),
+                "guild_id": str(_GUILD_ID),
+                "emoji": {"id": None, "name": "\N{WHITE MEDIUM STAR}"},
+                "member": _member(user_id),
+            }
+            payloads.append(_dispatch("MESSAGE_REACTION_ADD", data, seq))
+        else:
+            data = _member(_USER_BASE + members + seq)
+            data["guild_id"] = str(_GUILD_ID)
+            payloads.append(_dispatch("GUILD_MEMBER_ADD", data, seq))
+
+    return payloads
+
+
+def _setup_payloads(payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Builds the READY and GUILD_CREATEs needed for the payloads to make sense."""
+    channels: Dict[int, Set[int]] = defaultdict(set)
+    created = set()
+    for payload in payloads:
+        data = payload.get("d")
+        if not isinstance(data, dict):
+            continue
+
+        if payload.get("t") == "GUILD_CREATE":
+            created.add(int(data["id"]))
+        elif "guild_id" in data and data["guild_id"] is not None:
+            channel = channels[int(data["guild_id"])]
+            if "channel_id" in data:
+                channel.add(int(data["channel_id"]))
+
+    setup = [_ready(list(channels.keys() | created))]
+    for guild_id, channel_ids in channels.items():
+        if guild_id not in created:
+            setup.append(_guild_create(guild_id, sorted(channel_ids), 50))
+    return setup
+
+
+class FakeHTTP(discord.http.HTTPClient):
+    """An HTTP client that answers every request itself.
+
+    Messages that get sent are echoed back as if Discord created them,
+    everything else gets an empty response.
+    """
+
+    def __init__(self, *, loop: asyncio.AbstractEventLoop) -> None:
+        super().__init__(loop=loop)
+        self.calls: Counter = Counter()
+        self._next_id = _MESSAGE_BASE * 2
+
+    async def request(self, route: discord.http.Route, **kwargs: Any) -> Any:
+        self.calls[f"{route.method} {route.path}"] += 1
+        if route.method == "POST" and route.path.endswith("/messages"):
+            self._next_id += 1
+            payload = kwargs.get("json") or {}
+            return {
+                "id": str(self._next_id),
+                "channel_id": str(route.channel_id),
+                "author": _user(_BOT_ID, bot=True),
+                "content": payload.get("content") or "",
+                "timestamp": _timestamp(),
+                "edited_timestamp": None,
+                "tts": False,
+                "mention_everyone": False,
+                "mentions": [],
+                "mention_roles": [],
+                "attachments": [],
+                "embeds": [payload["embed"]] if payload.get("embed") else [],
+                "pinned": False,
+                "type": 0,
+            }
+
+        if route.method in ("PUT", "DELETE"):
+            return None
+        return {}
+
+    async def close(self) -> None:
+        pass
+
+
+class ListenerStats:
+    __slots__ = ("name", "calls", "errors", "total", "max", "_samples")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples: List[float] = []
+
+    def add(self, elapsed: float) -> None:
+        self.calls += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self._samples.append(elapsed)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+    def percentile(self, pct: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+
+class ReplayReport(NamedTuple):
+    events: int
+    elapsed: float
+    event_types: Counter
+    listeners: List[ListenerStats]
+    http_calls: Counter
+    # (where, size difference in bytes, count difference)
+    allocations: Optional[List[Tuple[str, int, int]]]
+
+    @property
+    def events_per_second(self) -> float:
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+
+def _prepare(bot: commands.Bot) -> Tuple[Dict[str, ListenerStats], Set[asyncio.Future]]:
+    """Points the bot at FakeHTTP and times every listener it schedules."""
+    loop = bot.loop
+    http = FakeHTTP(loop=loop)
+    bot.http = http
+    state = bot._connection
+    state.http = http
+    state.is_bot = True
+    state._chunk_guilds = False
+    state.guild_ready_timeout = 0.1
+
+    stats: Dict[str, ListenerStats] = {}
+    pending: Set[asyncio.Future] = set()
+    schedule = bot._schedule_event
+
+    def _schedule_event(coro, event_name, *args, **kwargs):
+        name = getattr(coro, "__qualname__", event_name)
+        entry = stats.get(name)
+        if entry is None:
+            entry = stats[name] = ListenerStats(name)
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                await coro(*args, **kwargs)
+            except Exception:
+                entry.errors += 1
+                raise
+            finally:
+                entry.add(time.perf_counter() - start)
+
+        task = schedule(timed, event_name, *args, **kwargs)
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        return task
+
+    async def on_error(event_method, *args, **kwargs):
+        log.debug("Listener for %s failed.", event_method, exc_info=True)
+
+    bot._schedule_event = _schedule_event
+    bot.on_error = on_error
+    return stats, pending
+
+
+async def _settle(pending: Set[asyncio.Future]) -> None:
+    # listeners can schedule more listeners, wait for all of them
+    while pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _feed(bot: commands.Bot, payload: Dict[str, Any]) -> None:
+    # what DiscordWebSocket.received_message does with a decoded payload
+    bot.dispatch("socket_response", payload)
+    if payload.get("op") != 0:
+        return
+
+    parser = bot._connection.parsers.get(payload.get("t"))
+    if parser is not None:
+        parser(payload["d"])
+
+
+async def replay(
+    bot: commands.Bot,
+    payloads: List[Dict[str, Any]],
+    *,
+    trace_allocations: bool = False,
+) -> ReplayReport:
+    """Replays the payloads through the bot, one at a time.
+
+    Every listener an event triggers has to finish before the next payload
+    is fed, so the timings are per event rather than under contention.
+    This must be called before the bot connects, and the bot shouldn't be
+    used for anything else afterwards.
+    """
+    stats, pending = _prepare(bot)
+
+    for payload in _setup_payloads(payloads):
+        _feed(bot, payload)
+    await bot.wait_until_ready()
+    await _settle(pending)
+    stats.clear()
+    bot.http.calls.clear()
+
+    event_types: Counter = Counter()
+    if trace_allocations:
+        tracemalloc.start(10)
+        before = tracemalloc.take_snapshot()
+
+    start = time.perf_counter()
+    for payload in payloads:
+        event_types[payload.get("t")] += 1
+        _feed(bot, payload)
+        await _settle(pending)
+    elapsed = time.perf_counter() - start
+
+    allocations = None
+    if trace_allocations:
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocations = [
+            (str(stat.traceback[0]), stat.size_diff, stat.count_diff)
+            for stat in after.compare_to(before, "lineno")[:15]
+        ]
+
+    listeners = sorted(stats.values(), key=lambda s: s.total, reverse=True)
+    return ReplayReport(
+        len(payloads), elapsed, event_types, listeners, bot.http.calls, allocations
+    )
+
+
+def iter_report(report: ReplayReport) -> Iterator[str]:
+    """Yields a plain text rendering of the report."""
+    yield (
+        f"Replayed {report.events} events in {report.elapsed:.2f}s "
+        f"({report.events_per_second:.0f} events/s)"
+    )
+    yield ", ".join(f"{t}: {c}" for t, c in report.event_types.most_common())
+
+    table = TabularData()
+    table.set_columns(
+        ["Listener", "Calls", "Errors", "Mean (µs)", "p95 (µs)", "Max (µs)"]
+    )
+    for entry in report.listeners:
+        table.add_row(
+            (
+                entry.name,
+                entry.calls,
+                entry.errors,
+                f"{entry.mean * 1e6:.0f}",
+                f"{entry.percentile(95) * 1e6:.0f}",
+                f"{entry.max * 1e6:.0f}",
+            )
+        )
+    yield table.render()
+
+    if report.http_calls:
+        yield "HTTP requests: " + ", ".join(
+            f"{route} x{count}" for route, count in report.http_calls.most_common()
+        )
+
+    if report.allocations is not None:
+        table = TabularData()
+        table.set_columns(["Where", "Size (KiB)", "Blocks"])
+        for where, size, count in report.allocations:
+            table.add_row((where, f"{size / 1024:.1f}", count))
+        yield table.render()